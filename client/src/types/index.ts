@@ -19,8 +19,11 @@ export interface DockerImage extends Model {
 
 export interface Dataset extends Model {
   name: string;
-  files: number[];
   size: number;
+  // Only present when retrieving a single dataset
+  files?: number[];
+  // Only present when listing datasets
+  num_files?: number;
 }
 
 export interface Algorithm extends Model {
@@ -29,14 +32,26 @@ export interface Algorithm extends Model {
   command: string;
   entrypoint: string | null;
   gpu: boolean;
+  num_shards: number;
+  input_mode: 'download' | 'fuse';
+  stream_inputs: boolean;
   docker_image: number;
   input_dataset: number[];
 }
 
 export type TaskStatus = 'created' | 'queued' | 'running' | 'failed' | 'success';
+export type TaskTimeline = {[key: string]: number};
+export interface TaskShard extends Model {
+  index: number;
+  status: TaskStatus;
+  timeline: TaskTimeline;
+}
+
 export interface Task extends Model {
   status: TaskStatus;
   algorithm: number;
+  shards: TaskShard[];
+  timeline: TaskTimeline;
 }
 
 export interface ChecksumFile extends Model {
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from rgd_workflow.models import Workflow
+
+
+class Command(BaseCommand):
+    help = 'Validate the closure table of workflows against the direct edges between their steps.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('workflows', nargs='*', type=int, help='IDs of workflows to check')
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            default=False,
+            help='Rebuild the closure table of inconsistent workflows',
+        )
+
+    def handle(self, *args, **options):
+        workflows = Workflow.objects.order_by('pk')
+        if options['workflows']:
+            workflows = workflows.filter(pk__in=options['workflows'])
+
+        inconsistent = 0
+        for workflow in workflows.iterator():
+            errors = workflow.check_graph()
+            if not errors:
+                continue
+
+            inconsistent += 1
+            self.stdout.write(self.style.WARNING(f'Workflow {workflow.pk}:'))
+            for error in errors:
+                self.stdout.write(f'  {error}')
+
+            if options['repair']:
+                workflow.repair_graph()
+                self.stdout.write(self.style.SUCCESS(f'Repaired workflow {workflow.pk}.'))
+
+        if not inconsistent:
+            self.stdout.write(self.style.SUCCESS('All workflow closure tables are consistent.'))
+        elif not options['repair']:
+            raise CommandError(f'{inconsistent} workflow(s) have an inconsistent closure table.')
@@ -0,0 +1,137 @@
+# Generated by Django 3.2.7 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rgd', '0003_checksumfile_created_by'),
+        ('rgd_workflow', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowRun',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                (
+                    'created',
+                    django_extensions.db.fields.CreationDateTimeField(
+                        auto_now_add=True, verbose_name='created'
+                    ),
+                ),
+                (
+                    'modified',
+                    django_extensions.db.fields.ModificationDateTimeField(
+                        auto_now=True, verbose_name='modified'
+                    ),
+                ),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('created', 'Created but not queued'),
+                            ('queued', 'Queued for processing'),
+                            ('running', 'Running'),
+                            ('failed', 'Failed'),
+                            ('success', 'Succeeded'),
+                            ('skipped', 'Skipped'),
+                        ],
+                        default='created',
+                        max_length=16,
+                    ),
+                ),
+                (
+                    'input_files',
+                    models.ManyToManyField(
+                        blank=True, related_name='workflow_run_inputs', to='rgd.checksumfile'
+                    ),
+                ),
+                (
+                    'workflow',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='runs',
+                        to='rgd_workflow.workflow',
+                    ),
+                ),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkflowStepRun',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                (
+                    'created',
+                    django_extensions.db.fields.CreationDateTimeField(
+                        auto_now_add=True, verbose_name='created'
+                    ),
+                ),
+                (
+                    'modified',
+                    django_extensions.db.fields.ModificationDateTimeField(
+                        auto_now=True, verbose_name='modified'
+                    ),
+                ),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('created', 'Created but not queued'),
+                            ('queued', 'Queued for processing'),
+                            ('running', 'Running'),
+                            ('failed', 'Failed'),
+                            ('success', 'Succeeded'),
+                            ('skipped', 'Skipped'),
+                        ],
+                        default='created',
+                        max_length=16,
+                    ),
+                ),
+                ('output_log', models.TextField(blank=True, default='')),
+                (
+                    'output_files',
+                    models.ManyToManyField(
+                        blank=True, related_name='workflow_step_run_outputs', to='rgd.checksumfile'
+                    ),
+                ),
+                (
+                    'run',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='step_runs',
+                        to='rgd_workflow.workflowrun',
+                    ),
+                ),
+                (
+                    'step',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='runs',
+                        to='rgd_workflow.workflowstep',
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='workflowsteprun',
+            constraint=models.UniqueConstraint(fields=('run', 'step'), name='unique_step_run'),
+        ),
+    ]
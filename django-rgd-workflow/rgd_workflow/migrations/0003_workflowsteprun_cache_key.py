@@ -0,0 +1,35 @@
+# Generated by Django 3.2.7 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rgd_workflow', '0002_workflowrun_workflowsteprun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowrun',
+            name='use_cache',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='workflowsteprun',
+            name='cache_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='workflowsteprun',
+            name='reused_from',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='reused_by',
+                to='rgd_workflow.workflowsteprun',
+            ),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 3.2.7 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rgd', '0003_checksumfile_created_by'),
+        ('rgd_workflow', '0003_workflowsteprun_cache_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowstep',
+            name='partition_mode',
+            field=models.CharField(
+                choices=[
+                    ('none', 'Run once over all input files'),
+                    ('file', 'Run once per input file'),
+                    ('chunk', 'Run once per group of input files'),
+                    ('folder', 'Run once per input folder'),
+                ],
+                default='none',
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name='workflowstep',
+            name='partition_size',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='WorkflowStepRunPartition',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                (
+                    'created',
+                    django_extensions.db.fields.CreationDateTimeField(
+                        auto_now_add=True, verbose_name='created'
+                    ),
+                ),
+                (
+                    'modified',
+                    django_extensions.db.fields.ModificationDateTimeField(
+                        auto_now=True, verbose_name='modified'
+                    ),
+                ),
+                ('key', models.CharField(max_length=1024)),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('created', 'Created but not queued'),
+                            ('queued', 'Queued for processing'),
+                            ('running', 'Running'),
+                            ('failed', 'Failed'),
+                            ('success', 'Succeeded'),
+                            ('skipped', 'Skipped'),
+                        ],
+                        default='created',
+                        max_length=16,
+                    ),
+                ),
+                ('output_log', models.TextField(blank=True, default='')),
+                (
+                    'output_files',
+                    models.ManyToManyField(
+                        blank=True,
+                        related_name='workflow_step_run_partition_outputs',
+                        to='rgd.checksumfile',
+                    ),
+                ),
+                (
+                    'step_run',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='partitions',
+                        to='rgd_workflow.workflowsteprun',
+                    ),
+                ),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='workflowsteprunpartition',
+            constraint=models.UniqueConstraint(
+                fields=('step_run', 'key'), name='unique_step_run_partition'
+            ),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.7 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rgd', '0003_checksumfile_created_by'),
+        ('rgd_workflow', '0004_workflowstep_partition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowStepRunPartitionInput',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('directory', models.CharField(blank=True, default='', max_length=1024)),
+                (
+                    'checksum_file',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to='rgd.checksumfile'
+                    ),
+                ),
+                (
+                    'partition',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='inputs',
+                        to='rgd_workflow.workflowsteprunpartition',
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='workflowsteprunpartition',
+            name='input_files',
+            field=models.ManyToManyField(
+                blank=True,
+                related_name='workflow_step_run_partition_inputs',
+                through='rgd_workflow.WorkflowStepRunPartitionInput',
+                to='rgd.ChecksumFile',
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='workflowsteprunpartitioninput',
+            constraint=models.UniqueConstraint(
+                fields=('partition', 'directory', 'checksum_file'),
+                name='unique_step_run_partition_input',
+            ),
+        ),
+    ]
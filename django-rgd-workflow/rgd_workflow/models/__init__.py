@@ -1 +1,3 @@
+from .graph import *  # noqa
+from .run import *  # noqa
 from .workflow import *  # noqa
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from collections import defaultdict, deque
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from django.core.exceptions import ValidationError
+
+__all__ = ['WorkflowGraph']
+
+# A closure table row, as (parent ID, child ID, distance)
+Link = Tuple[int, int, int]
+
+
+class WorkflowGraph:
+    """
+    An in-memory snapshot of a workflow's closure table.
+
+    This is constructed from every WorkflowStepDependency in a workflow, and answers questions
+    about the structure of the workflow (parents, children, roots, ordering and cycles) without
+    any further database queries. Links should be provided ordered by distance, as the order of
+    returned parents and children follows the order in which links were provided.
+    """
+
+    def __init__(self, links: Iterable[Link]):
+        # Map each step to its ancestors/descendants, and the distance to each
+        self._ancestors: Dict[int, Dict[int, int]] = defaultdict(dict)
+        self._descendants: Dict[int, Dict[int, int]] = defaultdict(dict)
+
+        for parent, child, distance in links:
+            self._ancestors[child][parent] = distance
+            self._descendants[parent][child] = distance
+
+    @classmethod
+    def from_workflow(cls, workflow) -> WorkflowGraph:
+        """Construct a graph from a workflow (or its ID), using a single query."""
+        # Prevent circular import
+        from .workflow import WorkflowStepDependency
+
+        links = (
+            WorkflowStepDependency.objects.filter(child__workflow=workflow)
+            .order_by('distance', 'modified')
+            .values_list('parent_id', 'child_id', 'distance')
+        )
+        return cls(links)
+
+    @classmethod
+    def from_edges(
+        cls, steps: Iterable[Hashable], edges: Iterable[Tuple[Hashable, Hashable]]
+    ) -> WorkflowGraph:
+        """
+        Construct a graph from a set of steps and the direct edges between them.
+
+        Steps may be identified by any hashable value (e.g. their names), and the full transitive
+        closure is computed in memory. The distance between two steps is the longest path between
+        them, matching the depth used to order workflow steps. Raises a ValidationError if the
+        edges contain a circular dependency.
+        """
+        steps = list(steps)
+        parents = {step: [] for step in steps}
+        children = {step: [] for step in steps}
+        for parent, child in edges:
+            parents[child].append(parent)
+            children[parent].append(child)
+
+        # Visit steps in topological order (Kahn's algorithm), so that the ancestors of every parent
+        # are known before its children are visited
+        remaining = {step: len(parents[step]) for step in steps}
+        queue = deque(step for step in steps if not remaining[step])
+        ancestors: Dict[Hashable, Dict[Hashable, int]] = {}
+        while queue:
+            step = queue.popleft()
+            ancestors[step] = {step: 0}
+            for parent in parents[step]:
+                for ancestor, distance in ancestors[parent].items():
+                    ancestors[step][ancestor] = max(ancestors[step].get(ancestor, 0), distance + 1)
+
+            for child in children[step]:
+                remaining[child] -= 1
+                if not remaining[child]:
+                    queue.append(child)
+
+        # Any step that was never visited is part of a cycle
+        if len(ancestors) < len(steps):
+            raise ValidationError('Workflow graph contains a circular dependency.')
+
+        links = [
+            (ancestor, step, distance)
+            for step, step_ancestors in ancestors.items()
+            for ancestor, distance in step_ancestors.items()
+        ]
+        return cls(sorted(links, key=lambda link: link[2]))
+
+    @property
+    def steps(self) -> List[int]:
+        """Return the IDs of all steps in the graph."""
+        return list(dict.fromkeys([*self._ancestors, *self._descendants]))
+
+    def links(self) -> List[Link]:
+        """Return every link in the graph, including self references."""
+        return [
+            (parent, child, distance)
+            for child, ancestors in self._ancestors.items()
+            for parent, distance in ancestors.items()
+        ]
+
+    def direct_edges(self) -> List[Tuple[int, int]]:
+        """Return every (parent, child) pair where the child runs directly after the parent."""
+        return [(parent, child) for parent, child, distance in self.links() if distance == 1]
+
+    def ancestors(self, step: int) -> Dict[int, int]:
+        """Return a mapping of every ancestor of a step (including itself) to its distance."""
+        return self._ancestors.get(step, {step: 0})
+
+    def descendants(self, step: int) -> Dict[int, int]:
+        """Return a mapping of every descendant of a step (including itself) to its distance."""
+        return self._descendants.get(step, {step: 0})
+
+    def parents(self, step: int, depth: Optional[int] = None) -> List[int]:
+        """Return the parents of a step, nearest first."""
+        return [
+            parent
+            for parent, distance in self.ancestors(step).items()
+            if 0 < distance and (depth is None or distance <= depth)
+        ]
+
+    def children(self, step: int, depth: Optional[int] = None) -> List[int]:
+        """Return the children of a step, nearest first."""
+        return [
+            child
+            for child, distance in self.descendants(step).items()
+            if 0 < distance and (depth is None or distance <= depth)
+        ]
+
+    def roots(self) -> List[int]:
+        """Return the steps which have no parents."""
+        return [step for step in self.steps if not self.parents(step)]
+
+    def topological_order(self) -> List[int]:
+        """Return all steps, ordered such that every step comes after all of its parents."""
+        # Since the closure table is transitive, every step has strictly more ancestors than
+        # any of its parents
+        return sorted(self.steps, key=lambda step: len(self.ancestors(step)))
+
+    def would_create_cycle(self, parent: int, child: int) -> bool:
+        """Return whether linking the parent to the child would create a circular dependency."""
+        return parent in self.descendants(child)
+
+    def with_edge(self, parent: int, child: int) -> WorkflowGraph:
+        """
+        Return the graph which results from running the child directly after the parent.
+
+        Every ancestor of the parent is linked to every descendant of the child, keeping the
+        longest distance between each pair. This does not check for circular dependencies.
+        """
+        links = {(p, c): distance for p, c, distance in self.links()}
+        for ancestor, ancestor_distance in self.ancestors(parent).items():
+            for descendant, descendant_distance in self.descendants(child).items():
+                distance = ancestor_distance + 1 + descendant_distance
+                links[ancestor, descendant] = max(links.get((ancestor, descendant), 0), distance)
+
+        links.setdefault((child, child), 0)
+        return WorkflowGraph(
+            sorted(
+                ((p, c, distance) for (p, c), distance in links.items()), key=lambda link: link[2]
+            )
+        )
+
+    def without(self, removed: Iterable[int]) -> WorkflowGraph:
+        """
+        Return the graph which results from removing steps.
+
+        The direct parents of each removed step are linked to its direct children, so the ordering
+        between all remaining steps is preserved. Distances are recomputed from the remaining edges.
+        """
+        removed = set(removed)
+        edges = set()
+        for parent, child in self.direct_edges():
+            if child in removed:
+                continue
+
+            # Replace removed parents with their nearest remaining parents
+            pending = [parent]
+            while pending:
+                step = pending.pop()
+                if step in removed:
+                    pending.extend(self.parents(step, depth=1))
+                else:
+                    edges.add((step, child))
+
+        return WorkflowGraph.from_edges(
+            [step for step in self.steps if step not in removed], sorted(edges)
+        )
+
+    def errors(self) -> List[str]:
+        """
+        Return a description of every inconsistency between the closure table and its direct edges.
+
+        The links of a consistent graph are exactly the transitive closure of its direct edges, with
+        a self reference for every step, and distances equal to the longest path between steps.
+        """
+        try:
+            expected = WorkflowGraph.from_edges(self.steps, self.direct_edges())
+        except ValidationError:
+            return ['Direct edges contain a circular dependency.']
+
+        errors = []
+        for step in self.steps:
+            actual, correct = self._ancestors.get(step, {}), expected.ancestors(step)
+            errors.extend(
+                f'Missing link {ancestor} -> {step} (distance {correct[ancestor]}).'
+                for ancestor in correct
+                if ancestor not in actual
+            )
+            errors.extend(
+                f'Unexpected link {ancestor} -> {step} (distance {actual[ancestor]}).'
+                for ancestor in actual
+                if ancestor not in correct
+            )
+            errors.extend(
+                f'Link {ancestor} -> {step} has distance {actual[ancestor]}, '
+                f'expected {correct[ancestor]}.'
+                for ancestor in actual
+                if ancestor in correct and actual[ancestor] != correct[ancestor]
+            )
+
+        return errors
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Set
+
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+from django_extensions.db.models import TimeStampedModel
+from rgd.models import ChecksumFile
+
+from .workflow import Workflow, WorkflowStep
+
+__all__ = [
+    'RunStatus',
+    'WorkflowRun',
+    'WorkflowStepRun',
+    'WorkflowStepRunPartition',
+    'WorkflowStepRunPartitionInput',
+]
+
+
+class RunStatus(models.TextChoices):
+    CREATED = 'created', _('Created but not queued')
+    QUEUED = 'queued', _('Queued for processing')
+    RUNNING = 'running', _('Running')
+    FAILED = 'failed', _('Failed')
+    SUCCEEDED = 'success', _('Succeeded')
+    SKIPPED = 'skipped', _('Skipped')
+
+
+class WorkflowRun(TimeStampedModel):
+    """A single execution of a workflow."""
+
+    workflow = models.ForeignKey(Workflow, related_name='runs', on_delete=models.CASCADE)
+    status = models.CharField(choices=RunStatus.choices, default=RunStatus.CREATED, max_length=16)
+
+    # Whether steps may reuse the outputs of previous identical step runs
+    use_cache = models.BooleanField(default=True)
+
+    # The files provided as input to the root steps of the workflow
+    input_files = models.ManyToManyField(
+        ChecksumFile, blank=True, related_name='workflow_run_inputs'
+    )
+
+    def direct_parents(self) -> Dict[int, Set[int]]:
+        """Return a mapping of each step ID to the IDs of its direct parents."""
+        graph = self.workflow.graph()
+        return {step: set(graph.parents(step, depth=1)) for step in graph.steps}
+
+
+class WorkflowStepRun(TimeStampedModel):
+    """The execution of a single step, within a workflow run."""
+
+    run = models.ForeignKey(WorkflowRun, related_name='step_runs', on_delete=models.CASCADE)
+    step = models.ForeignKey(WorkflowStep, related_name='runs', on_delete=models.CASCADE)
+    status = models.CharField(choices=RunStatus.choices, default=RunStatus.CREATED, max_length=16)
+    output_log = models.TextField(blank=True, default='')
+    output_files = models.ManyToManyField(
+        ChecksumFile, blank=True, related_name='workflow_step_run_outputs'
+    )
+
+    # A hash of the docker image, command and input files of this step run
+    cache_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+
+    # The previous step run whose outputs were reused, if any
+    reused_from = models.ForeignKey(
+        'self', null=True, blank=True, related_name='reused_by', on_delete=models.SET_NULL
+    )
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['run', 'step'], name='unique_step_run')]
+
+    def input_files(self) -> Dict[str, List[ChecksumFile]]:
+        """
+        Return the input files of this step, keyed by the directory they should be placed in.
+
+        Root steps receive the input files of the workflow run, at the top level (''). Any other
+        step receives the output files of each of its direct parents, under the parent's name.
+        """
+        parents = self.step.parents(depth=1)
+        if not parents:
+            return {'': list(self.run.input_files.all())}
+
+        parent_runs = WorkflowStepRun.objects.filter(run=self.run, step__in=parents).select_related(
+            'step'
+        )
+        return {
+            parent_run.step.name: list(parent_run.output_files.all()) for parent_run in parent_runs
+        }
+
+    def cached_run(self) -> Optional[WorkflowStepRun]:
+        """Return the most recent successful step run with the same cache key, if any."""
+        if not self.cache_key:
+            return None
+
+        return (
+            WorkflowStepRun.objects.filter(cache_key=self.cache_key, status=RunStatus.SUCCEEDED)
+            .exclude(pk=self.pk)
+            .order_by('-modified')
+            .first()
+        )
+
+
+class WorkflowStepRunPartition(TimeStampedModel):
+    """The execution of a map step over a single partition of its input files."""
+
+    step_run = models.ForeignKey(
+        WorkflowStepRun, related_name='partitions', on_delete=models.CASCADE
+    )
+
+    # The name of this partition, as returned by WorkflowStep.partition
+    key = models.CharField(max_length=1024)
+
+    status = models.CharField(choices=RunStatus.choices, default=RunStatus.CREATED, max_length=16)
+    output_log = models.TextField(blank=True, default='')
+    output_files = models.ManyToManyField(
+        ChecksumFile, blank=True, related_name='workflow_step_run_partition_outputs'
+    )
+
+    # The files in this partition, stored once when the partitions are dispatched
+    input_files = models.ManyToManyField(
+        ChecksumFile,
+        blank=True,
+        through='WorkflowStepRunPartitionInput',
+        related_name='workflow_step_run_partition_inputs',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['step_run', 'key'], name='unique_step_run_partition')
+        ]
+
+    @property
+    def output_prefix(self) -> str:
+        """The folder that the output files of this partition are named within."""
+        return f'{self.key}/' if self.key else ''
+
+    def input_files_by_directory(self) -> Dict[str, List[ChecksumFile]]:
+        """Return the input files of this partition, keyed by input directory."""
+        inputs = self.inputs.select_related('checksum_file').order_by(
+            'directory', 'checksum_file__name', 'checksum_file__pk'
+        )
+        files: Dict[str, List[ChecksumFile]] = {}
+        for partition_input in inputs:
+            files.setdefault(partition_input.directory, []).append(partition_input.checksum_file)
+
+        return files
+
+
+class WorkflowStepRunPartitionInput(models.Model):
+    """An input file of a map step partition, and the input directory it is placed in."""
+
+    partition = models.ForeignKey(
+        WorkflowStepRunPartition, related_name='inputs', on_delete=models.CASCADE
+    )
+    checksum_file = models.ForeignKey(ChecksumFile, on_delete=models.CASCADE)
+    directory = models.CharField(max_length=1024, blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['partition', 'directory', 'checksum_file'],
+                name='unique_step_run_partition_input',
+            )
+        ]
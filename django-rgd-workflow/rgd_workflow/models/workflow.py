@@ -1,16 +1,20 @@
 from __future__ import annotations
 
-from typing import List, Optional, Type
+import posixpath
+from typing import Dict, Iterable, List, Optional, Tuple, Type
 
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import post_delete, pre_delete
 from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
 from django_extensions.db.models import TimeStampedModel
 from rgd.models import ChecksumFile, Collection
 
-__all__ = ['DockerImage', 'WorkflowStepDependency', 'WorkflowStep', 'Workflow']
+from .graph import WorkflowGraph
+
+__all__ = ['DockerImage', 'PartitionMode', 'WorkflowStepDependency', 'WorkflowStep', 'Workflow']
 
 
 def create_default_workflow_collection():
@@ -73,7 +77,8 @@ class WorkflowStepDependency(TimeStampedModel):
     # all links from node.parent_links have the form (parent=parent_node, child=node)
     child = models.ForeignKey('WorkflowStep', related_name='parent_links', on_delete=models.CASCADE)
 
-    # The distance between the parent and child (direct child = 1, grandchild = 2, etc.)
+    # The distance between the parent and child (direct child = 1, grandchild = 2, etc.). Where
+    # there are multiple paths between two steps, this is the length of the longest.
     distance = models.PositiveIntegerField()
 
     class Meta:
@@ -82,6 +87,13 @@ class WorkflowStepDependency(TimeStampedModel):
         ]
 
 
+class PartitionMode(models.TextChoices):
+    NONE = 'none', _('Run once over all input files')
+    FILE = 'file', _('Run once per input file')
+    CHUNK = 'chunk', _('Run once per group of input files')
+    FOLDER = 'folder', _('Run once per input folder')
+
+
 class WorkflowStep(TimeStampedModel):
     """An algorithm to run in a workflow."""
 
@@ -100,11 +112,55 @@ class WorkflowStep(TimeStampedModel):
         'Workflow', related_name='workflow_steps', on_delete=models.CASCADE
     )
 
+    # How to split the input files of this step, running one container per partition (a "map" step)
+    partition_mode = models.CharField(
+        choices=PartitionMode.choices, default=PartitionMode.NONE, max_length=16
+    )
+
+    # The number of input files in each partition, when partitioning by chunk
+    partition_size = models.PositiveIntegerField(default=1)
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['workflow', 'name'], name='unique_workflow_step')
         ]
 
+    @property
+    def is_map_step(self) -> bool:
+        """Whether this step runs once per partition of its input files."""
+        return self.partition_mode != PartitionMode.NONE
+
+    def partition(
+        self, input_files: Dict[str, List[ChecksumFile]]
+    ) -> Dict[str, Dict[str, List[ChecksumFile]]]:
+        """
+        Split the input files of this step into partitions, keyed by a name for each partition.
+
+        Each partition keeps the layout of the provided input files (keyed by input directory).
+        Files are grouped individually, in chunks of `partition_size` files, or by the folder of
+        their name. Files are ordered by directory and name, so partitioning is deterministic.
+        """
+        files = sorted(
+            ((directory, f) for directory, dir_files in input_files.items() for f in dir_files),
+            key=lambda item: (item[0], item[1].name, item[1].pk or 0),
+        )
+
+        if self.partition_mode == PartitionMode.NONE:
+            keys = ['' for _ in files]
+        elif self.partition_mode == PartitionMode.FILE:
+            keys = [posixpath.join(directory, f.name) for directory, f in files]
+        elif self.partition_mode == PartitionMode.CHUNK:
+            size = max(self.partition_size, 1)
+            keys = [str(index // size) for index in range(len(files))]
+        else:
+            keys = [posixpath.join(directory, posixpath.dirname(f.name)) for directory, f in files]
+
+        partitions: Dict[str, Dict[str, List[ChecksumFile]]] = {}
+        for key, (directory, f) in zip(keys, files):
+            partitions.setdefault(key, {}).setdefault(directory, []).append(f)
+
+        return partitions
+
     def _parent_links(self, depth: Optional[int]):
         """Return the queryset of links between this step and its parents."""
         query = (
@@ -146,26 +202,21 @@ class WorkflowStep(TimeStampedModel):
         # Ensure that step is saved
         step.save()
 
-        # Ensure no circular dependency is created
-        if self in step.children():
+        # Ensure no circular dependency is created, using a fresh snapshot of the workflow, as other
+        # instances of this workflow may have modified it
+        self.workflow.invalidate_graph()
+        graph = self.workflow.graph()
+        if graph.would_create_cycle(self.pk, step.pk):
             raise ValidationError(
                 'Cannot append parent step as a child of this step (circular dependency).'
             )
 
-        # Create dependencies between this step's parents and the new step
-        dependencies = [
-            WorkflowStepDependency(parent=p.parent, child=step, distance=p.distance + 1)
-            for p in self._parent_links(None)
-        ]
-
-        # Create a dependency between this step and the new step
-        dependencies.append(WorkflowStepDependency(parent=self, child=step, distance=1))
-
-        # Add self reference dependency
-        dependencies.append(WorkflowStepDependency(parent=step, child=step, distance=0))
-
-        # Save dependencies, ignoring any possible duplicates
-        WorkflowStepDependency.objects.bulk_create(dependencies, ignore_conflicts=True)
+        # Link every ancestor of this step (including itself) to every descendant of the new step
+        # (including itself), only writing links that are new or whose distance has changed
+        self.workflow._update_links(
+            graph.with_edge(self.pk, step.pk), graph.descendants(step.pk).keys()
+        )
+        self.workflow.invalidate_graph()
 
         # Return added step
         return step
@@ -173,15 +224,23 @@ class WorkflowStep(TimeStampedModel):
 
 @receiver(pre_delete, sender=WorkflowStep)
 def workflow_step_distance_adjust(sender: Type[WorkflowStep], instance: WorkflowStep, **kwargs):
-    """Update the distance of all links to this step's children."""
-    # Only include links that point to children of this step
-    links = WorkflowStepDependency.objects.filter(child__in=instance.children())
+    """Link this step's parents to its children, and update the distance of all affected links."""
+    # All steps are deleted along with their workflow, so there are no links left to adjust
+    # (`origin` is only provided by Django 4.1+, see `Workflow.delete` otherwise)
+    if isinstance(kwargs.get('origin'), Workflow):
+        return
 
-    # Only include indirect links
-    links = links.filter(distance__gte=2)
+    workflow: Workflow = instance.workflow
+    workflow.invalidate_graph()
+    graph = workflow.graph()
 
-    # Subtract 1 from all relevant links
-    links.update(distance=models.F('distance') - 1)
+    # Only the links to this step's descendants can change. Links to and from this step are
+    # removed by the cascading delete.
+    descendants = [step for step in graph.descendants(instance.pk) if step != instance.pk]
+    if descendants:
+        workflow._update_links(graph.without([instance.pk]), descendants)
+
+    workflow.invalidate_graph()
 
 
 class Workflow(TimeStampedModel):
@@ -192,6 +251,83 @@ class Workflow(TimeStampedModel):
         Collection, on_delete=models.PROTECT, default=create_default_workflow_collection
     )
 
+    def delete(self, *args, **kwargs):
+        # Delete all links up front, so that deleting each step has no links to adjust
+        with transaction.atomic():
+            WorkflowStepDependency.objects.filter(child__workflow=self).delete()
+            return super().delete(*args, **kwargs)
+
+    def graph(self) -> WorkflowGraph:
+        """
+        Return an in-memory snapshot of this workflow's step dependencies.
+
+        The snapshot is loaded with a single query, and cached on this instance until the workflow
+        is modified through any of the provided methods.
+        """
+        if getattr(self, '_graph', None) is None:
+            self._graph = WorkflowGraph.from_workflow(self)
+
+        return self._graph
+
+    def invalidate_graph(self):
+        """Discard the cached graph snapshot, if any."""
+        self._graph = None
+
+    def _update_links(self, graph: WorkflowGraph, steps: Iterable[int], batch_size: int = 1000):
+        """
+        Update the stored links to each of the given steps, to match the provided graph.
+
+        Links to other steps are left untouched. Changes are applied with bulk queries, in a single
+        transaction.
+        """
+        steps = list(steps)
+        existing = set()
+        changed: List[WorkflowStepDependency] = []
+        removed: List[int] = []
+
+        links = WorkflowStepDependency.objects.filter(child_id__in=steps).only(
+            'parent_id', 'child_id', 'distance'
+        )
+        for link in links:
+            existing.add((link.parent_id, link.child_id))
+            distance = graph.ancestors(link.child_id).get(link.parent_id)
+            if distance is None:
+                removed.append(link.pk)
+            elif distance != link.distance:
+                link.distance = distance
+                changed.append(link)
+
+        added = [
+            WorkflowStepDependency(parent_id=ancestor, child_id=step, distance=distance)
+            for step in steps
+            for ancestor, distance in graph.ancestors(step).items()
+            if (ancestor, step) not in existing
+        ]
+
+        with transaction.atomic():
+            WorkflowStepDependency.objects.filter(pk__in=removed).delete()
+            WorkflowStepDependency.objects.bulk_update(changed, ['distance'], batch_size=batch_size)
+            WorkflowStepDependency.objects.bulk_create(added, batch_size=batch_size)
+
+    def check_graph(self) -> List[str]:
+        """Return a description of every inconsistency in this workflow's closure table."""
+        self.invalidate_graph()
+        graph = self.graph()
+
+        unlinked = WorkflowStep.objects.filter(workflow=self).exclude(pk__in=graph.steps)
+        errors = [
+            f'Step {step_id} has no links.' for step_id in unlinked.values_list('pk', flat=True)
+        ]
+        return errors + graph.errors()
+
+    def repair_graph(self):
+        """Rebuild this workflow's closure table from the direct edges between its steps."""
+        self.invalidate_graph()
+        graph = self.graph()
+        steps = list(WorkflowStep.objects.filter(workflow=self).values_list('pk', flat=True))
+        self._update_links(WorkflowGraph.from_edges(steps, graph.direct_edges()), steps)
+        self.invalidate_graph()
+
     def _steps_queryset(self, depth: Optional[int]):
         """
         Return all workflow steps, ordered from first to last.
@@ -232,10 +368,100 @@ class Workflow(TimeStampedModel):
 
         # Add self referencing step
         WorkflowStepDependency.objects.create(parent=workflow_step, child=workflow_step, distance=0)
+        self.invalidate_graph()
 
         # Return added_step
         return workflow_step
 
+    def import_graph(
+        self, steps: List[WorkflowStep], edges: Iterable[Tuple[str, str]], batch_size: int = 1000
+    ) -> List[WorkflowStep]:
+        """
+        Add an entire graph of new steps to this workflow at once.
+
+        Edges are given as (parent name, child name) pairs between the provided (unsaved) steps.
+        The graph is validated and its transitive closure computed in memory, before all steps
+        and dependencies are written with bulk inserts, in a single transaction. Raises a
+        ValidationError if the graph contains a cycle, a step name is already in use, or an edge is
+        implied by a longer path between its steps, since such edges can't be stored.
+        """
+        names = [step.name for step in steps]
+        edges = list(edges)
+        graph = WorkflowGraph.from_edges(names, edges)
+
+        redundant = [
+            (parent, child) for parent, child in edges if graph.ancestors(child)[parent] > 1
+        ]
+        if redundant:
+            raise ValidationError(
+                f'These edges are implied by longer paths through other steps: '
+                f'{", ".join(f"{parent} -> {child}" for parent, child in redundant)}'
+            )
+
+        existing = WorkflowStep.objects.filter(workflow=self, name__in=names)
+        if existing.exists():
+            raise ValidationError(
+                f'Steps with these names already exist in this workflow: '
+                f'{", ".join(existing.values_list("name", flat=True))}'
+            )
+
+        with transaction.atomic():
+            for step in steps:
+                step.workflow = self
+            WorkflowStep.objects.bulk_create(steps, batch_size=batch_size)
+
+            step_ids = {step.name: step.pk for step in steps}
+            WorkflowStepDependency.objects.bulk_create(
+                [
+                    WorkflowStepDependency(
+                        parent_id=step_ids[parent], child_id=step_ids[child], distance=distance
+                    )
+                    for parent, child, distance in graph.links()
+                ],
+                batch_size=batch_size,
+            )
+
+        self.invalidate_graph()
+        return steps
+
+    def export_graph(self) -> Tuple[List[WorkflowStep], List[Tuple[str, str]]]:
+        """
+        Return all steps of this workflow, and the direct edges between them.
+
+        Steps are returned in topological order, and edges as (parent name, child name) pairs,
+        suitable for passing to `import_graph`.
+        """
+        graph = self.graph()
+        steps = WorkflowStep.objects.filter(workflow=self).in_bulk()
+        ordered_steps = [steps[step_id] for step_id in graph.topological_order()]
+        edges = [
+            (steps[parent_id].name, step.name)
+            for step in ordered_steps
+            for parent_id in graph.parents(step.pk, depth=1)
+        ]
+
+        return ordered_steps, edges
+
+    def run(self, input_files: Optional[List[ChecksumFile]] = None, use_cache: bool = True):
+        """
+        Run this workflow, returning the created WorkflowRun.
+
+        Each step is dispatched as soon as all of its parents have succeeded, receiving their output
+        files as input. Root steps receive the provided input files. If `use_cache` is set, steps
+        whose image, command and inputs are unchanged since a previous run reuse its outputs.
+        """
+        # Prevent circular import
+        from rgd_workflow.models.run import WorkflowRun
+        from rgd_workflow.tasks.jobs import run_workflow
+
+        workflow_run = WorkflowRun.objects.create(workflow=self, use_cache=use_cache)
+        if input_files:
+            workflow_run.input_files.set(input_files)
+
+        run_workflow.delay(workflow_run.pk)
+
+        return workflow_run
+
 
 @receiver(post_delete, sender=Workflow)
 def workflow_collection_delete(sender: Type[Workflow], instance: Workflow, **kwargs):
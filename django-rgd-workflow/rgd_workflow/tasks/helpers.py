@@ -1,255 +1,169 @@
+import hashlib
 import json
 import os
-import shlex
-import shutil
-import subprocess
+from pathlib import Path
 import tempfile
-import time
+from typing import Dict, List, Optional, Tuple
 
-import GPUtil
 from celery.utils.log import get_task_logger
-from django.db.models.fields.files import FieldFile
-import docker
-from girder_utils.files import field_file_to_local_path
-import magic
+from django.core.files import File
+from rgd.models import ChecksumFile, Collection
+from rgd.utility import compute_hash
 
-from ..models import AlgorithmJob, AlgorithmResult, ScoreJob, ScoreResult
+from ..models import DockerImage, WorkflowStep
 
 logger = get_task_logger(__name__)
 
 
-def _run_algorithm(algorithm_job):
-    algorithm_file: FieldFile = algorithm_job.algorithm.data
-    dataset_file: FieldFile = algorithm_job.dataset.data
-    try:
-        client = docker.from_env(version='auto', timeout=3600)
-        image = None
-        if algorithm_job.algorithm.docker_image_id:
-            try:
-                image = client.images.get(algorithm_job.algorithm.docker_image_id)
-                logger.info(
-                    'Loaded existing docker image %r' % algorithm_job.algorithm.docker_image_id
-                )
-            except docker.errors.ImageNotFound:
-                pass
-        if not image:
-            with algorithm_file.open() as algorithm_file_obj:
-                logger.info('Loading docker image %s' % algorithm_file)
-                image = client.images.load(algorithm_file_obj)
-                if len(image) != 1:
-                    raise Exception('tar file contains more than one image')
-                image = image[0]
-                algorithm_job.algorithm.docker_image_id = image.attrs['Id']
-                algorithm_job.algorithm.save(update_fields=['docker_image_id'])
-                logger.info('Loaded docker image %r' % algorithm_job.algorithm.docker_image_id)
-        with dataset_file.open() as dataset_file_obj:
-            logger.info(
-                'Running image %s with data %s'
-                % (algorithm_job.algorithm.docker_image_id, dataset_file)
-            )
-            tmpdir = tempfile.mkdtemp()
-            output_path = os.path.join(tmpdir, 'output.dat')
-            stderr_path = os.path.join(tmpdir, 'stderr.dat')
-            cmd = [
-                'docker',
-                'run',
-                '--rm',
-                '-i',
-                '--name',
-                'algorithm_job_%s_%s' % (algorithm_job.id, time.time()),
-            ]
-            if len(GPUtil.getAvailable()):
-                cmd += ['--gpus', 'all']
-            cmd += [str(algorithm_job.algorithm.docker_image_id)]
-            logger.info(
-                'Running %s <%s >%s 2>%s'
-                % (
-                    ' '.join([shlex.quote(c) for c in cmd]),
-                    shlex.quote(str(dataset_file)),
-                    shlex.quote(output_path),
-                    shlex.quote(stderr_path),
-                )
-            )
-            try:
-                subprocess.check_call(
-                    cmd,
-                    stdin=dataset_file_obj,
-                    stdout=open(output_path, 'wb'),
-                    stderr=open(stderr_path, 'wb'),
-                )
-                result = 0
-                algorithm_job.fail_reason = None
-            except subprocess.CalledProcessError as exc:
-                result = exc.returncode
-                logger.info(
-                    'Failed to successfully run image %s (%r)'
-                    % (algorithm_job.algorithm.docker_image_id, exc)
-                )
-                algorithm_job.fail_reason = 'Return code: %s\nException:\n%r' % (result, exc)
-            logger.info('Finished running image with result %r' % result)
-            # Store result
-            algorithm_result = AlgorithmResult(algorithm_job=algorithm_job)
-            algorithm_result.data.save(
-                'algorithm_job_%s.dat' % algorithm_job.id, open(output_path, 'rb')
-            )
-            algorithm_result.log.save(
-                'algorithm_job_%s_log.dat' % algorithm_job.id, open(stderr_path, 'rb')
-            )
-            algorithm_result.data_mimetype = _get_mimetype(output_path)
-            algorithm_result.save()
-            shutil.rmtree(tmpdir)
-            algorithm_job.status = (
-                AlgorithmJob.Status.SUCCEEDED if not result else AlgorithmJob.Status.FAILED
-            )
-    except Exception as exc:
-        logger.exception(f'Internal error run algorithm {algorithm_job.id}: {exc}')
-        algorithm_job.status = AlgorithmJob.Status.INTERNAL_FAILURE
-        try:
-            algorithm_job.fail_reason = exc.args[0]
-        except Exception:
-            pass
-    return algorithm_job
+def _download_input_files(input_files: Dict[str, List[ChecksumFile]], input_dir: Path):
+    """Download each group of input files into its own subdirectory of the input dir."""
+    for directory, files in input_files.items():
+        for checksum_file in files:
+            checksum_file.download_to_local_path(str(input_dir / directory))
 
 
-def _run_scoring(score_job):
-    score_algorithm_file: FieldFile = score_job.score_algorithm.data
-    algorithm_result_file: FieldFile = score_job.algorithm_result.data
-    groundtruth_file: FieldFile = score_job.groundtruth.data
-    try:
-        client = docker.from_env(version='auto', timeout=3600)
-        image = None
-        if score_job.score_algorithm.docker_image_id:
-            try:
-                image = client.images.get(score_job.score_algorithm.docker_image_id)
-                logger.info(
-                    'Loaded existing docker image %r' % score_job.score_algorithm.docker_image_id
-                )
-            except docker.errors.ImageNotFound:
-                pass
-        if not image:
-            with field_file_to_local_path(score_algorithm_file) as score_algorithm_path:
-                logger.info('Loading docker image %s' % score_algorithm_path)
-                image = client.images.load(open(score_algorithm_path, 'rb'))
-                if len(image) != 1:
-                    raise Exception('tar file contains more than one image')
-                image = image[0]
-                score_job.score_algorithm.docker_image_id = image.attrs['Id']
-                score_job.score_algorithm.save(update_fields=['docker_image_id'])
-                logger.info('Loaded docker image %r' % score_job.score_algorithm.docker_image_id)
-        with field_file_to_local_path(
-            algorithm_result_file
-        ) as algorithm_result_path, field_file_to_local_path(groundtruth_file) as groundtruth_path:
-            logger.info(
-                'Running image %s with groundtruth %s and results %s'
-                % (
-                    score_job.score_algorithm.docker_image_id,
-                    groundtruth_path,
-                    algorithm_result_path,
-                )
-            )
-            tmpdir = tempfile.mkdtemp()
-            output_path = os.path.join(tmpdir, 'output.dat')
-            stderr_path = os.path.join(tmpdir, 'stderr.dat')
-            cmd = [
-                'docker',
-                'run',
-                '--rm',
-                '-i',
-                '--name',
-                'score_job_%s_%s' % (score_job.id, time.time()),
-                '-v',
-                '%s:%s:ro' % (groundtruth_path, '/groundtruth.dat'),
-                str(score_job.score_algorithm.docker_image_id),
-            ]
-            logger.info(
-                'Running %s <%s >%s 2>%s'
-                % (
-                    ' '.join([shlex.quote(c) for c in cmd]),
-                    shlex.quote(str(algorithm_result_path)),
-                    shlex.quote(output_path),
-                    shlex.quote(stderr_path),
-                )
-            )
-            try:
-                subprocess.check_call(
-                    cmd,
-                    stdin=open(algorithm_result_path, 'rb'),
-                    stdout=open(output_path, 'wb'),
-                    stderr=open(stderr_path, 'wb'),
-                )
-                result = 0
-                score_job.fail_reason = None
-            except subprocess.CalledProcessError as exc:
-                result = exc.returncode
-                logger.info(
-                    'Failed to successfully run image %s (%r)' % (score_algorithm_path, exc)
-                )
-                score_job.fail_reason = 'Return code: %s\nException:\n%r' % (result, exc)
-            logger.info('Finished running image with result %r' % result)
-            score_result = ScoreResult(score_job=score_job)
-            score_result.data.save('score_job_%s.dat' % score_job.id, open(output_path, 'rb'))
-            score_result.log.save('score_job_%s_log.dat' % score_job.id, open(stderr_path, 'rb'))
-            score_result.overall_score, score_result.result_type = _overall_score_and_result_type(
-                score_result.data
-            )
-            score_result.save()
-            shutil.rmtree(tmpdir)
-            score_job.status = ScoreJob.Status.SUCCEEDED if not result else ScoreJob.Status.FAILED
-    except Exception as exc:
-        logger.exception(f'Internal error run score_algorithm {score_job.id}: {exc}')
-        score_job.status = ScoreJob.Status.INTERNAL_FAILURE
-        try:
-            score_job.fail_reason = exc.args[0]
-        except Exception:
-            pass
-    return score_job
+def _upload_output_files(
+    output_dir: Path, collection: Collection, prefix: str = ''
+) -> List[ChecksumFile]:
+    """
+    Upload all files in the output dir, returning the created ChecksumFiles.
+
+    Each file is named by its path relative to the output dir, following the prefix.
+    """
+    output_files: List[ChecksumFile] = []
+    for path, _, files in os.walk(output_dir):
+        for filename in files:
+            local_path = Path(path) / filename
+            relative_filename = f'{prefix}{local_path.relative_to(output_dir).as_posix()}'
+
+            checksum_file = ChecksumFile(name=relative_filename, collection=collection)
+            with open(local_path, 'rb') as file_contents:
+                # Record the checksum, so that step runs using this file can be memoized
+                checksum_file.checksum = compute_hash(file_contents)
+                file_contents.seek(0)
+                checksum_file.file.save(relative_filename, File(file_contents), save=False)
+
+            checksum_file.save()
+            output_files.append(checksum_file)
+
+    return output_files
 
 
-def _validate_docker(docker_file):
-    results = {}
+def _docker_image_digest(docker_image: DockerImage) -> str:
+    """Return an identifier for the exact contents of a docker image."""
+    if docker_image.image_file is not None:
+        if not docker_image.image_file.checksum:
+            docker_image.image_file.update_checksum()
+
+        return docker_image.image_file.checksum
+
+    # Import docker here so django can import tasks without docker
+    import docker
+    from docker.errors import ImageNotFound
+
+    client = docker.from_env()
     try:
-        with docker_file.open() as docker_file_obj:
-            client = docker.from_env(version='auto', timeout=3600)
-            logger.info('Loading docker image %s' % docker_file)
-            image = client.images.load(docker_file_obj)
-            if len(image) != 1:
-                raise Exception('tar file contains more than one image')
-            image = image[0]
-            results['docker_image_id'] = image.attrs['Id']
-            results['docker_attrs'] = json.dumps(image.attrs)
-            logger.info('Loaded docker image %r' % results['docker_image_id'])
-    except Exception as exc:
-        logger.exception(f'Internal error validating docker image: {exc}')
+        return client.images.get(docker_image.image_id).id
+    except ImageNotFound:
+        return client.images.get_registry_data(docker_image.image_id).id
+
+
+def _step_cache_key(step: WorkflowStep, input_files: Dict[str, List[ChecksumFile]]) -> str:
+    """
+    Return a key identifying the result of running a step with the given inputs.
+
+    The key is a hash of the docker image digest, the command, the partitioning of map steps, and
+    the location and checksum of every input file. Any input file without a checksum has it
+    computed and saved.
+    """
+    inputs = []
+    for directory, files in input_files.items():
+        for checksum_file in files:
+            if not checksum_file.checksum:
+                checksum_file.update_checksum()
+
+            inputs.append([directory, checksum_file.name, checksum_file.checksum])
+
+    key = {
+        'image': _docker_image_digest(step.docker_image),
+        'command': list(step.command),
+        'inputs': sorted(inputs),
+    }
+    if step.is_map_step:
+        key['partition'] = [step.partition_mode, step.partition_size]
+
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def _get_docker_image_id(client, docker_image: DockerImage, docker_dir: Path) -> str:
+    """Return the ID of a docker image, loading it from its image file if necessary."""
+    if docker_image.image_file is None:
+        return docker_image.image_id
+
+    image_path = docker_image.image_file.download_to_local_path(str(docker_dir))
+    with open(image_path, 'rb') as f:
+        images = client.images.load(f)
+
+    if len(images) != 1:
+        raise Exception('tar file contains more than one image')
+
+    return images[0].id
+
+
+def _run_step_container(
+    step: WorkflowStep, input_files: Dict[str, List[ChecksumFile]], output_prefix: str = ''
+) -> Tuple[Optional[int], str, List[ChecksumFile]]:
+    """
+    Run a workflow step in a docker container.
+
+    The input files are placed in `input/` and any files the container writes to `output/` are
+    uploaded into the workflow's collection, with their names following `output_prefix`.
+
+    Returns:
+        A tuple of the container's exit code, its logs, and the uploaded output files.
+    """
+    # Import docker here so django can import tasks without docker
+    import docker
+    from docker.errors import DockerException, ImageNotFound
+    from docker.types import Mount
+
+    client = docker.from_env()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root_dir = Path(tmpdir)
+        input_dir = root_dir / 'input'
+        output_dir = root_dir / 'output'
+        docker_dir = root_dir / 'docker'
+        for directory in (input_dir, output_dir, docker_dir):
+            directory.mkdir()
+
+        _download_input_files(input_files, input_dir)
+
+        image_id = _get_docker_image_id(client, step.docker_image, docker_dir)
         try:
-            results['failed'] = exc.args[0]
-        except Exception:
-            results['failed'] = repr(exc)
-    return results
+            image = client.images.get(image_id)
+        except ImageNotFound:
+            logger.info(f'Pulling {image_id}. This may take a while...')
+            image = client.images.pull(image_id)
 
+        mounts = [
+            Mount(target=str(path), source=str(path), type='bind')
+            for path in (input_dir, output_dir)
+        ]
+        try:
+            container = client.containers.run(
+                image,
+                command=step.command or None,
+                mounts=mounts,
+                working_dir=str(root_dir),
+                detach=True,
+            )
+        except DockerException as e:
+            # Replace null characters with �
+            return getattr(e, 'status_code', None) or 1, str(e).replace('\x00', '\ufffd'), []
 
-def _overall_score_and_result_type(datafile):
-    # In the future, inspect the data to determine the result type.
-    # For now, just extract a float from the data file
-    try:
-        overall_score = float(datafile.readline())
-        result_type = ScoreResult.ResultTypes.SIMPLE
-    except ValueError:
-        return None, None
-    return overall_score, result_type
-
-
-def _get_mimetype(file_path):
-    mimetype = magic.from_file(file_path, mime=True)
-    # check if mimetype has something useful
-    # empty file returns inode/x-empty
-    if mimetype == 'inode/x-empty':
-        # if no mime type, it can be null(None)
-        return None
-    uncompressed_magic = magic.Magic(mime=True, uncompress=True)
-    uncompressed_mimetype = uncompressed_magic.from_file(file_path)
-    if mimetype == uncompressed_mimetype:
-        return mimetype
-    else:
-        file_mimetype = '%s,%s' % (mimetype, uncompressed_mimetype)
-        # store both mimetypes and return
-        return file_mimetype
+        res = container.wait()
+        log = container.logs().decode('utf-8').replace('\x00', '\ufffd')
+        container.remove()
+
+        output_files = _upload_output_files(output_dir, step.workflow.collection, output_prefix)
+        return res['StatusCode'], log, output_files
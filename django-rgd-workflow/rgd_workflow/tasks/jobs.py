@@ -1,60 +1,218 @@
-# from celery import shared_task
-# from django.db.models.fields.files import FieldFile
-
-# from ..models import Algorithm, AlgorithmJob, ScoreAlgorithm, ScoreJob
-
-
-# @shared_task(time_limit=86400)
-# def run_algorithm(algorithm_job_id, dry_run=False):
-#     from .helpers import _run_algorithm
-
-#     algorithm_job = AlgorithmJob.objects.get(pk=algorithm_job_id)
-#     if not dry_run:
-#         algorithm_job.status = AlgorithmJob.Status.RUNNING
-#         algorithm_job.save(update_fields=['status'])
-#     algorithm_job = _run_algorithm(algorithm_job)
-#     if not dry_run:
-#         algorithm_job.save()
-#         # Notify
-
-
-# @shared_task(time_limit=86400)
-# def validate_algorithm(algorithm_id):
-#     from .helpers import _validate_docker
-
-#     algorithm = Algorithm.objects.get(pk=algorithm_id)
-#     algorithm_file: FieldFile = algorithm.data
-#     results = _validate_docker(algorithm_file)
-#     algorithm.docker_image_id = results.get('docker_image_id')
-#     algorithm.docker_attrs = results.get('docker_attrs')
-#     algorithm.docker_validation_failure = results.get('failed')
-#     algorithm.save(update_fields=['docker_image_id', 'docker_attrs', 'docker_validation_failure'])
-
-
-# @shared_task(time_limit=86400)
-# def validate_scoring(score_algorithm_id):
-#     from .helpers import _validate_docker
-
-#     score_algorithm = ScoreAlgorithm.objects.get(pk=score_algorithm_id)
-#     score_algorithm_file: FieldFile = score_algorithm.data
-#     results = _validate_docker(score_algorithm_file)
-#     score_algorithm.docker_image_id = results.get('docker_image_id')
-#     score_algorithm.docker_attrs = results.get('docker_attrs')
-#     score_algorithm.docker_validation_failure = results.get('failed')
-#     score_algorithm.save(
-#         update_fields=['docker_image_id', 'docker_attrs', 'docker_validation_failure']
-#     )
-
-
-# @shared_task(time_limit=86400)
-# def run_scoring(score_job_id, dry_run=False):
-#     from .helpers import _run_scoring
-
-#     score_job = ScoreJob.objects.get(pk=score_job_id)
-#     if not dry_run:
-#         score_job.status = ScoreJob.Status.RUNNING
-#         score_job.save(update_fields=['status'])
-#     score_job = _run_scoring(score_job)
-#     if not dry_run:
-#         score_job.save()
-#         # Notify
+import traceback
+from typing import Dict, List
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.db import transaction
+from rgd.models import ChecksumFile
+
+from . import helpers
+from ..models import (
+    RunStatus,
+    WorkflowRun,
+    WorkflowStepRun,
+    WorkflowStepRunPartition,
+    WorkflowStepRunPartitionInput,
+)
+
+logger = get_task_logger(__name__)
+
+UNFINISHED_STATUSES = [RunStatus.CREATED, RunStatus.QUEUED, RunStatus.RUNNING]
+
+
+def dispatch_ready_steps(run: WorkflowRun):
+    """
+    Queue every step of a workflow run whose parents have all succeeded.
+
+    Steps downstream of a failed step are skipped. Once no steps remain to be run, the status of
+    the workflow run itself is set. This is called each time a step finishes, so that independent
+    branches of the workflow run concurrently.
+    """
+    parents = run.direct_parents()
+    statuses: Dict[int, str] = dict(run.step_runs.values_list('step_id', 'status'))
+
+    # Propagate failures to all downstream steps
+    skipped = []
+    changed = True
+    while changed:
+        changed = False
+        for step_id, status in statuses.items():
+            if status == RunStatus.CREATED and any(
+                statuses[p] in (RunStatus.FAILED, RunStatus.SKIPPED) for p in parents[step_id]
+            ):
+                statuses[step_id] = RunStatus.SKIPPED
+                skipped.append(step_id)
+                changed = True
+
+    if skipped:
+        run.step_runs.filter(step_id__in=skipped, status=RunStatus.CREATED).update(
+            status=RunStatus.SKIPPED
+        )
+
+    # Dispatch any steps which are ready to run
+    for step_id, status in statuses.items():
+        if status != RunStatus.CREATED:
+            continue
+        if not all(statuses[p] == RunStatus.SUCCEEDED for p in parents[step_id]):
+            continue
+
+        # Only dispatch this step if no other worker has already done so
+        step_run_query = run.step_runs.filter(step_id=step_id, status=RunStatus.CREATED)
+        step_run_id = step_run_query.values_list('pk', flat=True).first()
+        if step_run_query.update(status=RunStatus.QUEUED):
+            run_workflow_step.delay(step_run_id)
+
+    # Set the final run status, if all steps have finished
+    if not run.step_runs.filter(status__in=UNFINISHED_STATUSES).exists():
+        failed = run.step_runs.filter(status=RunStatus.FAILED).exists()
+        WorkflowRun.objects.filter(pk=run.pk, status=RunStatus.RUNNING).update(
+            status=RunStatus.FAILED if failed else RunStatus.SUCCEEDED
+        )
+
+
+def dispatch_partitions(step_run: WorkflowStepRun, input_files: Dict[str, List[ChecksumFile]]):
+    """
+    Queue a container for each partition of the input files of a map step.
+
+    The input files are partitioned once, here, and the files of each partition are stored, so that
+    each partition's task only reads its own files.
+    """
+    partitions = step_run.step.partition(input_files)
+    with transaction.atomic():
+        WorkflowStepRunPartition.objects.bulk_create(
+            [
+                WorkflowStepRunPartition(step_run=step_run, key=key, status=RunStatus.QUEUED)
+                for key in partitions
+            ],
+            ignore_conflicts=True,
+        )
+        partition_ids = dict(step_run.partitions.values_list('key', 'pk'))
+        WorkflowStepRunPartitionInput.objects.bulk_create(
+            [
+                WorkflowStepRunPartitionInput(
+                    partition_id=partition_ids[key], checksum_file=f, directory=directory
+                )
+                for key, partition in partitions.items()
+                for directory, files in partition.items()
+                for f in files
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    # With nothing to map over, the step is trivially complete
+    if not partitions:
+        finish_map_step(step_run)
+        return
+
+    for partition_id in step_run.partitions.values_list('pk', flat=True):
+        run_workflow_step_partition.delay(partition_id)
+
+
+def finish_map_step(step_run: WorkflowStepRun):
+    """
+    Collect the outputs of all partitions of a map step, once every partition has finished.
+
+    This is called each time a partition finishes, and only the first call after all partitions
+    have finished completes the step run.
+    """
+    partitions = step_run.partitions.order_by('key')
+    if partitions.filter(status__in=UNFINISHED_STATUSES).exists():
+        return
+
+    with transaction.atomic():
+        failed = partitions.filter(status=RunStatus.FAILED).exists()
+        log = '\n'.join(f'==> {p.key} <==\n{p.output_log}' for p in partitions)
+        finished = WorkflowStepRun.objects.filter(pk=step_run.pk, status=RunStatus.RUNNING).update(
+            status=RunStatus.FAILED if failed else RunStatus.SUCCEEDED, output_log=log
+        )
+        if not finished:
+            return
+
+        step_run.output_files.set(
+            ChecksumFile.objects.filter(
+                workflow_step_run_partition_outputs__step_run=step_run
+            ).distinct()
+        )
+
+    dispatch_ready_steps(step_run.run)
+
+
+@shared_task(time_limit=86400)
+def run_workflow(workflow_run_id: int):
+    run: WorkflowRun = WorkflowRun.objects.select_related('workflow').get(pk=workflow_run_id)
+
+    # Create a pending run for every step in the workflow
+    WorkflowStepRun.objects.bulk_create(
+        [WorkflowStepRun(run=run, step=step) for step in run.workflow.workflow_steps.all()],
+        ignore_conflicts=True,
+    )
+
+    run.status = RunStatus.RUNNING
+    run.save(update_fields=['status'])
+
+    dispatch_ready_steps(run)
+
+
+@shared_task(time_limit=86400)
+def run_workflow_step(workflow_step_run_id: int):
+    step_run: WorkflowStepRun = WorkflowStepRun.objects.select_related(
+        'run', 'step__docker_image', 'step__workflow__collection'
+    ).get(pk=workflow_step_run_id)
+    step_run.status = RunStatus.RUNNING
+    step_run.save(update_fields=['status'])
+
+    try:
+        input_files = step_run.input_files()
+        step_run.cache_key = helpers._step_cache_key(step_run.step, input_files)
+        step_run.save(update_fields=['cache_key'])
+
+        # Reuse the outputs of an identical previous step run, if one exists
+        cached_run = step_run.cached_run() if step_run.run.use_cache else None
+        if cached_run is not None:
+            step_run.reused_from = cached_run
+            step_run.save(update_fields=['reused_from'])
+            exit_code, log, output_files = 0, cached_run.output_log, cached_run.output_files.all()
+        elif step_run.step.is_map_step:
+            # The step run is completed once all of its partitions have finished
+            dispatch_partitions(step_run, input_files)
+            return
+        else:
+            exit_code, log, output_files = helpers._run_step_container(step_run.step, input_files)
+    except Exception:
+        logger.exception(f'Internal error running workflow step run {step_run.pk}')
+        exit_code, log, output_files = 1, traceback.format_exc(), []
+
+    step_run.output_files.set(output_files)
+    step_run.output_log = log
+    step_run.status = RunStatus.SUCCEEDED if exit_code == 0 else RunStatus.FAILED
+    step_run.save(update_fields=['output_log', 'status'])
+
+    dispatch_ready_steps(step_run.run)
+
+
+@shared_task(time_limit=86400)
+def run_workflow_step_partition(partition_id: int):
+    partition: WorkflowStepRunPartition = WorkflowStepRunPartition.objects.select_related(
+        'step_run__run', 'step_run__step__docker_image', 'step_run__step__workflow__collection'
+    ).get(pk=partition_id)
+    partition.status = RunStatus.RUNNING
+    partition.save(update_fields=['status'])
+
+    try:
+        # Outputs of different partitions are merged, so each is named within its partition
+        exit_code, log, output_files = helpers._run_step_container(
+            partition.step_run.step,
+            partition.input_files_by_directory(),
+            output_prefix=partition.output_prefix,
+        )
+    except Exception:
+        logger.exception(f'Internal error running workflow step partition {partition.pk}')
+        exit_code, log, output_files = 1, traceback.format_exc(), []
+
+    partition.output_files.set(output_files)
+    partition.output_log = log
+    partition.status = RunStatus.SUCCEEDED if exit_code == 0 else RunStatus.FAILED
+    partition.save(update_fields=['output_log', 'status'])
+
+    finish_map_step(partition.step_run)
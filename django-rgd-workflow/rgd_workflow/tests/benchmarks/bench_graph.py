@@ -0,0 +1,81 @@
+from typing import List, Tuple
+
+import pytest
+from rgd_workflow.models import Workflow, WorkflowStep
+
+# Numbers of steps in each benchmarked workflow
+NUM_STEPS = [100, 300]
+
+
+def chain(docker_image, num_steps: int) -> Tuple[List[WorkflowStep], List[Tuple[str, str]]]:
+    """Return the steps and edges of a chain, in which every step also depends on the first."""
+    names = [f'step_{i}' for i in range(num_steps)]
+    steps = [WorkflowStep(name=name, docker_image=docker_image, command=[]) for name in names]
+    edges = list(zip(names, names[1:])) + [(names[0], name) for name in names[2:]]
+    return steps, edges
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_steps', NUM_STEPS)
+def test_import_graph(benchmark, workflow_factory, docker_image, num_steps):
+    def setup():
+        return (workflow_factory(), *chain(docker_image, num_steps)), {}
+
+    benchmark.pedantic(
+        lambda workflow, steps, edges: workflow.import_graph(steps, edges), setup=setup, rounds=3
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_steps', NUM_STEPS)
+def test_append_step(benchmark, workflow: Workflow, docker_image, num_steps):
+    steps, edges = chain(docker_image, num_steps)
+    workflow.import_graph(steps, edges)
+    last = steps[-1]
+    appended = iter(range(num_steps, num_steps * 2))
+
+    def setup():
+        step = WorkflowStep(
+            workflow=workflow, name=f'step_{next(appended)}', docker_image=docker_image, command=[]
+        )
+        return (step,), {}
+
+    # Each round appends to the end of the chain, lengthening it by one
+    def append(step: WorkflowStep):
+        nonlocal last
+        last = last.append_step(step)
+
+    benchmark.pedantic(append, setup=setup, rounds=10)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_steps', NUM_STEPS)
+def test_delete_step(benchmark, workflow_factory, docker_image, num_steps):
+    def setup():
+        steps, edges = chain(docker_image, num_steps)
+        workflow_factory().import_graph(steps, edges)
+        return (steps[num_steps // 2],), {}
+
+    # Deleting a step in the middle of the chain relinks every step after it
+    benchmark.pedantic(lambda step: step.delete(), setup=setup, rounds=3)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_steps', NUM_STEPS)
+def test_graph(benchmark, workflow: Workflow, docker_image, num_steps):
+    workflow.import_graph(*chain(docker_image, num_steps))
+
+    def load():
+        workflow.invalidate_graph()
+        return workflow.graph()
+
+    assert len(benchmark(load).steps) == num_steps
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_steps', NUM_STEPS)
+def test_repair_graph(benchmark, workflow: Workflow, docker_image, num_steps):
+    workflow.import_graph(*chain(docker_image, num_steps))
+
+    benchmark(workflow.repair_graph)
+    assert not workflow.check_graph()
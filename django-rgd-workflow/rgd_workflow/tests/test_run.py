@@ -0,0 +1,191 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+from rgd.models import ChecksumFile, FileSourceType
+from rgd_workflow.models import PartitionMode, RunStatus, Workflow, WorkflowRun, WorkflowStep
+from rgd_workflow.tasks import helpers
+from rgd_workflow.tasks.jobs import run_workflow
+
+
+@pytest.fixture
+def step_calls(mocker) -> List[WorkflowStep]:
+    """Replace the container runner, recording the order in which steps are run."""
+    calls: List[WorkflowStep] = []
+
+    def run_step_container(step, input_files, output_prefix=''):
+        calls.append(step)
+        return (1 if step.name.startswith('fail') else 0), f'Ran {step.name}', []
+
+    mocker.patch('rgd_workflow.tasks.helpers._run_step_container', side_effect=run_step_container)
+    mocker.patch('rgd_workflow.tasks.helpers._docker_image_digest', return_value='sha256:test')
+    return calls
+
+
+def create_url_files(names: List[str]) -> List[ChecksumFile]:
+    return ChecksumFile.objects.bulk_create(
+        [
+            ChecksumFile(
+                name=name, type=FileSourceType.URL, url=f'https://example.com/{name}', checksum=name
+            )
+            for name in names
+        ]
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workflow_run_dependency_order(workflow_graph_steps: Workflow, step_calls):
+    workflow_run: WorkflowRun = workflow_graph_steps.run()
+    workflow_run.refresh_from_db()
+
+    assert workflow_run.status == RunStatus.SUCCEEDED
+    assert all(sr.status == RunStatus.SUCCEEDED for sr in workflow_run.step_runs.all())
+
+    # Every step runs exactly once, after all of its parents
+    steps = workflow_graph_steps.steps()
+    assert sorted(s.pk for s in step_calls) == sorted(s.pk for s in steps)
+    for step in steps:
+        for parent in step.parents():
+            assert step_calls.index(parent) < step_calls.index(step)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workflow_run_failure_skips_children(workflow_graph_steps: Workflow, step_calls):
+    step_1, step_2, step_4, step_3, step_5, step_6 = workflow_graph_steps.steps()
+    step_2.name = 'fail-step-2'
+    step_2.save()
+
+    workflow_run: WorkflowRun = workflow_graph_steps.run()
+    workflow_run.refresh_from_db()
+
+    statuses = {sr.step_id: sr.status for sr in workflow_run.step_runs.all()}
+    assert workflow_run.status == RunStatus.FAILED
+    assert statuses[step_2.pk] == RunStatus.FAILED
+    assert statuses[step_3.pk] == statuses[step_5.pk] == RunStatus.SKIPPED
+    assert statuses[step_1.pk] == statuses[step_4.pk] == statuses[step_6.pk] == RunStatus.SUCCEEDED
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workflow_rerun_reuses_unchanged_steps(workflow_graph_steps: Workflow, step_calls):
+    step_1, step_2, step_4, step_3, step_5, step_6 = workflow_graph_steps.steps()
+    workflow_graph_steps.run()
+    step_calls.clear()
+
+    # Change step 4, so that only it and its children are recomputed
+    step_4.command = ['echo', 'changed']
+    step_4.save()
+
+    workflow_run: WorkflowRun = workflow_graph_steps.run()
+    workflow_run.refresh_from_db()
+    assert workflow_run.status == RunStatus.SUCCEEDED
+
+    # No outputs are produced by the mocked steps, so children of step 4 have unchanged inputs
+    assert step_calls == [step_4]
+
+    reused = {sr.step_id for sr in workflow_run.step_runs.all() if sr.reused_from is not None}
+    assert reused == {step_1.pk, step_2.pk, step_3.pk, step_5.pk, step_6.pk}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workflow_rerun_without_cache(workflow_graph_steps: Workflow, step_calls):
+    workflow_graph_steps.run()
+    step_calls.clear()
+
+    workflow_run = WorkflowRun.objects.create(workflow=workflow_graph_steps, use_cache=False)
+    run_workflow(workflow_run.pk)
+
+    assert len(step_calls) == len(workflow_graph_steps.steps())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workflow_map_step(workflow: Workflow, workflow_step_factory, step_calls, mocker):
+    map_step: WorkflowStep = workflow_step_factory(
+        workflow=workflow, partition_mode=PartitionMode.FOLDER
+    )
+    reduce_step: WorkflowStep = workflow_step_factory(workflow=workflow)
+    workflow.add_root_step(map_step)
+    map_step.append_step(reduce_step)
+
+    # Provide input files spread across two folders
+    names = ['tiles/a/1.tif', 'tiles/a/2.tif', 'tiles/b/3.tif']
+    input_files = create_url_files(names)
+    step_input_files = mocker.patch(
+        'rgd_workflow.models.run.WorkflowStepRun.input_files', return_value={'': input_files}
+    )
+
+    workflow_run: WorkflowRun = workflow.run()
+    workflow_run.refresh_from_db()
+    assert workflow_run.status == RunStatus.SUCCEEDED
+
+    # One container per folder, followed by the reduce step
+    assert step_calls == [map_step, map_step, reduce_step]
+    map_run = workflow_run.step_runs.get(step=map_step)
+    assert sorted(map_run.partitions.values_list('key', flat=True)) == ['tiles/a', 'tiles/b']
+    assert map_run.partitions.get(key='tiles/a').input_files_by_directory() == {'': input_files[:2]}
+    assert map_run.partitions.get(key='tiles/b').input_files_by_directory() == {'': input_files[2:]}
+
+    # The step inputs are read once per step, rather than by every partition
+    assert step_input_files.call_count == 2
+    assert all(p.status == RunStatus.SUCCEEDED for p in map_run.partitions.all())
+    assert 'tiles/a' in map_run.output_log and 'tiles/b' in map_run.output_log
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workflow_map_step_same_output_name(
+    workflow: Workflow, workflow_step_factory, step_calls, mocker, tmp_path: Path
+):
+    map_step: WorkflowStep = workflow_step_factory(
+        workflow=workflow, partition_mode=PartitionMode.FOLDER
+    )
+    reduce_step: WorkflowStep = workflow_step_factory(workflow=workflow)
+    workflow.add_root_step(map_step)
+    map_step.append_step(reduce_step)
+
+    input_files = create_url_files(['tiles/a/1.tif', 'tiles/b/2.tif'])
+    mocker.patch(
+        'rgd_workflow.models.run.WorkflowStepRun.input_files', return_value={'': input_files}
+    )
+
+    # Every partition writes an output file of the same name
+    def run_step_container(step, input_files, output_prefix=''):
+        output_dir = tmp_path / f'{step.name}-{output_prefix.replace("/", "-")}'
+        output_dir.mkdir()
+        (output_dir / 'result.txt').write_text(output_prefix)
+        output_files = helpers._upload_output_files(
+            output_dir, step.workflow.collection, output_prefix
+        )
+        return 0, '', output_files
+
+    mocker.patch('rgd_workflow.tasks.helpers._run_step_container', side_effect=run_step_container)
+
+    workflow_run: WorkflowRun = workflow.run()
+    workflow_run.refresh_from_db()
+    assert workflow_run.status == RunStatus.SUCCEEDED
+
+    # Assert the outputs of both partitions are kept, named within their partition
+    map_run = workflow_run.step_runs.get(step=map_step)
+    outputs = {f.name: f.file.read() for f in map_run.output_files.all()}
+    assert outputs == {'tiles/a/result.txt': b'tiles/a/', 'tiles/b/result.txt': b'tiles/b/'}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workflow_map_step_failure(workflow: Workflow, workflow_step_factory, step_calls, mocker):
+    map_step: WorkflowStep = workflow_step_factory(
+        workflow=workflow, name='fail-map', partition_mode=PartitionMode.FILE
+    )
+    reduce_step: WorkflowStep = workflow_step_factory(workflow=workflow)
+    workflow.add_root_step(map_step)
+    map_step.append_step(reduce_step)
+
+    input_files = create_url_files(['1.tif', '2.tif'])
+    mocker.patch(
+        'rgd_workflow.models.run.WorkflowStepRun.input_files', return_value={'': input_files}
+    )
+
+    workflow_run: WorkflowRun = workflow.run()
+    workflow_run.refresh_from_db()
+
+    # Every partition runs, but the reduce step is skipped
+    assert workflow_run.status == RunStatus.FAILED
+    assert step_calls == [map_step, map_step]
+    assert workflow_run.step_runs.get(step=reduce_step).status == RunStatus.SKIPPED
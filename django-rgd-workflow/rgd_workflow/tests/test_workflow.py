@@ -1,9 +1,12 @@
 from typing import List
 
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
 from django.db import models
 import pytest
-from rgd_workflow.models import Workflow, WorkflowStep
+from rgd.models import ChecksumFile, Collection
+from rgd_workflow.models import PartitionMode, Workflow, WorkflowStep
 from rgd_workflow.models.workflow import WorkflowStepDependency
 
 
@@ -244,3 +247,211 @@ def test_workflow_graph_parents(workflow_graph_steps: Workflow):
 
     # Assert root step parents
     assert step_1.parents() == []
+
+
+@pytest.mark.django_db
+def test_workflow_graph_snapshot(workflow_graph_steps: Workflow):
+    step_1, step_2, step_4, step_3, step_5, step_6 = workflow_graph_steps.steps()
+    graph = workflow_graph_steps.graph()
+
+    # Assert the snapshot agrees with the closure table queries
+    for step in [step_1, step_2, step_3, step_4, step_5, step_6]:
+        assert graph.parents(step.pk) == [p.pk for p in step.parents()]
+        assert graph.children(step.pk) == [c.pk for c in step.children()]
+        assert graph.parents(step.pk, depth=1) == [p.pk for p in step.parents(depth=1)]
+
+    assert graph.roots() == [step_1.pk]
+    assert graph.would_create_cycle(step_6.pk, step_1.pk)
+    assert not graph.would_create_cycle(step_3.pk, step_6.pk)
+
+    # Assert every step comes after all of its parents
+    order = graph.topological_order()
+    for step in [step_1, step_2, step_3, step_4, step_5, step_6]:
+        assert all(order.index(p.pk) < order.index(step.pk) for p in step.parents())
+
+
+@pytest.mark.django_db
+def test_workflow_graph_single_query(workflow_graph_steps: Workflow, django_assert_num_queries):
+    workflow = Workflow.objects.get(pk=workflow_graph_steps.pk)
+    with django_assert_num_queries(1):
+        graph = workflow.graph()
+        for step in graph.topological_order():
+            graph.parents(step)
+            graph.children(step)
+
+    # Assert the snapshot is cached until the workflow is modified
+    assert workflow.graph() is graph
+    workflow.invalidate_graph()
+    assert workflow.graph() is not graph
+
+
+@pytest.mark.django_db
+def test_workflow_steps_endpoint_no_collection(workflow_graph_steps: Workflow, api_client):
+    api_client.force_authenticate(user=User.objects.create_user(username='test'))
+    collections = Collection.objects.count()
+
+    r = api_client.get(f'/api/workflow/{workflow_graph_steps.pk}/steps/')
+    assert r.status_code == 200
+
+    # Assert listing steps doesn't create a collection, as constructing a Workflow would
+    assert Collection.objects.count() == collections
+
+
+@pytest.mark.django_db
+def test_workflow_step_link_existing_subgraph(workflow: Workflow, workflow_step_factory):
+    step_1: WorkflowStep = workflow_step_factory(workflow=workflow)
+    step_2: WorkflowStep = workflow_step_factory(workflow=workflow)
+    step_3: WorkflowStep = workflow_step_factory(workflow=workflow)
+
+    # Build 2 -> 3, then link 1 above it
+    workflow.add_root_step(step_1)
+    workflow.add_root_step(step_2)
+    step_2.append_step(step_3)
+    step_1.append_step(step_2)
+
+    # Assert the existing descendant is linked to the new ancestor
+    assert step_3.parents() == [step_2, step_1]
+    assert step_1.children() == [step_2, step_3]
+    assert workflow.root_steps() == [step_1]
+
+
+@pytest.mark.django_db
+def test_workflow_graph_import_export(workflow_graph_steps: Workflow, workflow_factory):
+    steps, edges = workflow_graph_steps.export_graph()
+
+    # Import the exported graph into a new workflow
+    workflow: Workflow = workflow_factory()
+    workflow.import_graph(
+        [WorkflowStep(name=s.name, docker_image=s.docker_image, command=s.command) for s in steps],
+        edges,
+    )
+
+    # Assert the imported workflow has the same structure
+    imported_steps, imported_edges = workflow.export_graph()
+    assert [s.name for s in imported_steps] == [s.name for s in steps]
+    assert sorted(imported_edges) == sorted(edges)
+    for step in workflow.steps():
+        original = WorkflowStep.objects.get(workflow=workflow_graph_steps, name=step.name)
+        assert [p.name for p in step.parents()] == [p.name for p in original.parents()]
+
+
+@pytest.mark.django_db
+def test_workflow_graph_import_circular(workflow: Workflow, docker_image):
+    steps = [WorkflowStep(name=name, docker_image=docker_image, command=[]) for name in 'abc']
+    with pytest.raises(ValidationError):
+        workflow.import_graph(steps, [('a', 'b'), ('b', 'c'), ('c', 'a')])
+
+    assert not workflow.steps()
+
+
+@pytest.mark.django_db
+def test_workflow_graph_import_redundant(workflow: Workflow, docker_image):
+    steps = [WorkflowStep(name=name, docker_image=docker_image, command=[]) for name in 'abc']
+
+    # Assert an edge which is implied by a longer path is rejected, since it can't be exported
+    with pytest.raises(ValidationError, match='a -> c'):
+        workflow.import_graph(steps, [('a', 'b'), ('b', 'c'), ('a', 'c')])
+
+    assert not workflow.steps()
+
+
+@pytest.mark.django_db
+def test_workflow_graph_import_bulk(
+    workflow: Workflow, docker_image, django_assert_max_num_queries
+):
+    # A chain of 200 steps
+    names = [f'step_{i}' for i in range(200)]
+    steps = [WorkflowStep(name=name, docker_image=docker_image, command=[]) for name in names]
+    edges = list(zip(names, names[1:]))
+
+    with django_assert_max_num_queries(40):
+        workflow.import_graph(steps, edges)
+
+    # Distances are the longest path between steps
+    last = WorkflowStep.objects.get(workflow=workflow, name=names[-1])
+    assert last.parents(depth=1) == [WorkflowStep.objects.get(workflow=workflow, name=names[-2])]
+    assert WorkflowStepDependency.objects.filter(child__workflow=workflow).count() == (
+        200 * 201 // 2
+    )
+    assert [s.name for s in workflow.steps()] == names
+
+
+@pytest.mark.django_db
+def test_workflow_delete(workflow_graph_steps: Workflow, mocker):
+    workflow_id = workflow_graph_steps.pk
+    update_links = mocker.spy(Workflow, '_update_links')
+    workflow_graph_steps.delete()
+
+    # Assert no links are adjusted while deleting each step
+    update_links.assert_not_called()
+    assert not WorkflowStep.objects.filter(workflow_id=workflow_id).exists()
+    assert not WorkflowStepDependency.objects.filter(child__workflow_id=workflow_id).exists()
+
+
+@pytest.mark.django_db
+def test_workflow_step_delete_diamond(workflow_graph_steps: Workflow):
+    step_1, step_2, step_4, step_3, step_5, step_6 = workflow_graph_steps.steps()
+    step_4.delete()
+
+    # Step 5 is still reachable from step 1 through step 2, so its distance is unchanged, while
+    # step 6 now runs directly after step 1
+    assert WorkflowStepDependency.objects.get(parent=step_1, child=step_5).distance == 2
+    assert step_6.parents() == [step_1]
+    assert step_5.parents() == [step_2, step_1]
+    assert workflow_graph_steps.check_graph() == []
+
+
+@pytest.mark.django_db
+def test_workflow_step_append_longest_distance(workflow: Workflow, workflow_step_factory):
+    step_1, step_2, step_3 = (workflow_step_factory(workflow=workflow) for _ in range(3))
+
+    # Link 1 -> 3 directly, before adding the longer path 1 -> 2 -> 3
+    workflow.add_root_step(step_1)
+    step_1.append_step(step_3)
+    step_1.append_step(step_2)
+    step_2.append_step(step_3)
+
+    assert WorkflowStepDependency.objects.get(parent=step_1, child=step_3).distance == 2
+    assert workflow.steps() == [step_1, step_2, step_3]
+    assert workflow.check_graph() == []
+
+
+@pytest.mark.django_db
+def test_workflow_check_graph(workflow_graph_steps: Workflow):
+    step_1, step_2, step_4, step_3, step_5, step_6 = workflow_graph_steps.steps()
+    assert workflow_graph_steps.check_graph() == []
+    call_command('check_workflow_graphs', workflow_graph_steps.pk)
+
+    # Corrupt the closure table
+    WorkflowStepDependency.objects.filter(parent=step_1, child=step_3).delete()
+    WorkflowStepDependency.objects.filter(parent=step_1, child=step_6).update(distance=5)
+    assert len(workflow_graph_steps.check_graph()) == 2
+    with pytest.raises(CommandError):
+        call_command('check_workflow_graphs', workflow_graph_steps.pk)
+
+    # Repair it
+    call_command('check_workflow_graphs', workflow_graph_steps.pk, repair=True)
+    assert workflow_graph_steps.check_graph() == []
+    assert WorkflowStepDependency.objects.get(parent=step_1, child=step_3).distance == 2
+    assert WorkflowStepDependency.objects.get(parent=step_1, child=step_6).distance == 2
+
+
+@pytest.mark.parametrize(
+    'partition_mode,partition_size,expected',
+    [
+        (PartitionMode.NONE, 1, {'': ['a/1.tif', 'a/2.tif', 'b/3.tif']}),
+        (
+            PartitionMode.FILE,
+            1,
+            {'a/1.tif': ['a/1.tif'], 'a/2.tif': ['a/2.tif'], 'b/3.tif': ['b/3.tif']},
+        ),
+        (PartitionMode.CHUNK, 2, {'0': ['a/1.tif', 'a/2.tif'], '1': ['b/3.tif']}),
+        (PartitionMode.FOLDER, 1, {'a': ['a/1.tif', 'a/2.tif'], 'b': ['b/3.tif']}),
+    ],
+)
+def test_workflow_step_partition(partition_mode, partition_size, expected):
+    step = WorkflowStep(partition_mode=partition_mode, partition_size=partition_size)
+    input_files = {'': [ChecksumFile(name=name) for name in ['b/3.tif', 'a/2.tif', 'a/1.tif']]}
+
+    partitions = step.partition(input_files)
+    assert {key: [f.name for f in files['']] for key, files in partitions.items()} == expected
@@ -4,7 +4,7 @@ from djproxy.urls import generate_routes
 from rest_framework_extensions.routers import ExtendedSimpleRouter
 
 from . import views
-from .views.workflow import WorkflowStepViewSet, WorkflowViewSet
+from .views.workflow import WorkflowRunViewSet, WorkflowStepViewSet, WorkflowViewSet
 
 router = ExtendedSimpleRouter()
 workflow_routes = router.register('api/workflow', WorkflowViewSet)
@@ -14,6 +14,7 @@ workflow_routes.register(
     basename='step',
     parents_query_lookups=[f'workflow__{WorkflowViewSet.lookup_field}'],
 )
+router.register('api/workflow_runs', WorkflowRunViewSet)
 
 admin.site.index_template = 'admin/add_links.html'
 urlpatterns = [
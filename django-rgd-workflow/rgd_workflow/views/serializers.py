@@ -1,5 +1,13 @@
 from rest_framework import serializers
-from rgd_workflow.models import DockerImage, Workflow, WorkflowStep
+from rgd.models import ChecksumFile
+from rgd_workflow.models import (
+    DockerImage,
+    Workflow,
+    WorkflowRun,
+    WorkflowStep,
+    WorkflowStepRun,
+    WorkflowStepRunPartition,
+)
 
 
 class DockerImageSerializer(serializers.ModelSerializer):
@@ -26,6 +34,11 @@ class WorkflowStepReturnSerializer(WorkflowStepSerializer):
     parents = serializers.SerializerMethodField()
 
     def get_parents(self, obj: WorkflowStep):
+        # Use the workflow graph snapshot if provided, to avoid a query per step
+        graph = self.context.get('workflow_graph')
+        if graph is not None:
+            return graph.parents(obj.pk, depth=1)
+
         return [p.pk for p in obj.parents(depth=1)]
 
 
@@ -38,3 +51,63 @@ class WorkflowStepCreateSerializer(serializers.ModelSerializer):
 class WorkflowStepLinkSerializer(serializers.Serializer):
     parent = serializers.IntegerField()
     child = serializers.IntegerField()
+
+
+class WorkflowGraphStepSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WorkflowStep
+        fields = ['name', 'docker_image', 'command', 'partition_mode', 'partition_size']
+
+
+class WorkflowGraphEdgeSerializer(serializers.Serializer):
+    parent = serializers.CharField()
+    child = serializers.CharField()
+
+
+class WorkflowGraphSerializer(serializers.Serializer):
+    steps = WorkflowGraphStepSerializer(many=True)
+    edges = WorkflowGraphEdgeSerializer(many=True, required=False, default=list)
+
+    def validate(self, attrs):
+        names = [step['name'] for step in attrs['steps']]
+        if len(set(names)) != len(names):
+            raise serializers.ValidationError({'steps': 'Step names must be unique.'})
+
+        unknown = {
+            name for edge in attrs['edges'] for name in (edge['parent'], edge['child'])
+        }.difference(names)
+        if unknown:
+            raise serializers.ValidationError(
+                {'edges': f'Edges reference unknown steps: {", ".join(sorted(unknown))}'}
+            )
+
+        return attrs
+
+
+class WorkflowStepRunPartitionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WorkflowStepRunPartition
+        exclude = ['step_run', 'output_log']
+
+
+class WorkflowStepRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WorkflowStepRun
+        exclude = ['run', 'output_log']
+
+    partitions = WorkflowStepRunPartitionSerializer(many=True, read_only=True)
+
+
+class WorkflowRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WorkflowRun
+        fields = '__all__'
+
+    step_runs = WorkflowStepRunSerializer(many=True, read_only=True)
+
+
+class WorkflowRunCreateSerializer(serializers.Serializer):
+    input_files = serializers.PrimaryKeyRelatedField(
+        queryset=ChecksumFile.objects.all(), many=True, required=False
+    )
+    use_cache = serializers.BooleanField(default=True)
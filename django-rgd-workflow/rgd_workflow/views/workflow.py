@@ -7,9 +7,13 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework_extensions.mixins import NestedViewSetMixin
-from rgd_workflow.models import Workflow, WorkflowStep
+from rgd_workflow.models import Workflow, WorkflowRun, WorkflowStep
+from rgd_workflow.models.graph import WorkflowGraph
 
 from .serializers import (
+    WorkflowGraphSerializer,
+    WorkflowRunCreateSerializer,
+    WorkflowRunSerializer,
     WorkflowSerializer,
     WorkflowStepCreateSerializer,
     WorkflowStepLinkSerializer,
@@ -23,6 +27,60 @@ class WorkflowViewSet(ModelViewSet):
     serializer_class = WorkflowSerializer
     pagination_class = LimitOffsetPagination
 
+    @swagger_auto_schema(
+        request_body=WorkflowRunCreateSerializer(), responses={200: WorkflowRunSerializer()}
+    )
+    @action(detail=True, methods=['POST'])
+    def run(self, request, pk: str):
+        """Run the workflow, returning the workflow run."""
+        serializer = WorkflowRunCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        workflow: Workflow = get_object_or_404(Workflow, pk=pk)
+        workflow_run = workflow.run(
+            serializer.validated_data.get('input_files'),
+            use_cache=serializer.validated_data['use_cache'],
+        )
+
+        return Response(WorkflowRunSerializer(workflow_run).data)
+
+    @swagger_auto_schema(method='GET', responses={200: WorkflowGraphSerializer()})
+    @swagger_auto_schema(
+        method='POST',
+        request_body=WorkflowGraphSerializer(),
+        responses={200: WorkflowGraphSerializer()},
+    )
+    @action(detail=True, methods=['GET', 'POST'])
+    def graph(self, request, pk: str):
+        """Export the workflow's steps and edges, or import a graph of new steps."""
+        workflow: Workflow = get_object_or_404(Workflow, pk=pk)
+
+        if request.method == 'POST':
+            serializer = WorkflowGraphSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+
+            steps = [WorkflowStep(**step) for step in serializer.validated_data['steps']]
+            edges = [(edge['parent'], edge['child']) for edge in serializer.validated_data['edges']]
+            try:
+                workflow.import_graph(steps, edges)
+            except ValidationError as e:
+                return Response(e.messages, status=HTTP_400_BAD_REQUEST)
+
+        steps, edges = workflow.export_graph()
+        data = {
+            'steps': steps,
+            'edges': [{'parent': parent, 'child': child} for parent, child in edges],
+        }
+        return Response(WorkflowGraphSerializer(data).data)
+
+
+class WorkflowRunViewSet(ReadOnlyModelViewSet):
+    queryset = WorkflowRun.objects.all().prefetch_related(
+        'input_files', 'step_runs__output_files', 'step_runs__partitions__output_files'
+    )
+    serializer_class = WorkflowRunSerializer
+    pagination_class = LimitOffsetPagination
+
 
 class WorkflowStepViewSet(NestedViewSetMixin, ReadOnlyModelViewSet):
     serializer_class = WorkflowStepReturnSerializer
@@ -35,6 +93,16 @@ class WorkflowStepViewSet(NestedViewSetMixin, ReadOnlyModelViewSet):
         workflow: Workflow = get_object_or_404(Workflow, pk=workflow_pk)
         return workflow._steps_queryset(None)
 
+    def get_serializer_context(self):
+        """Include a workflow graph snapshot, to serialize parents without a query per step."""
+        context = super().get_serializer_context()
+        workflow_pk = self.kwargs.get('parent_lookup_workflow__pk')
+        if workflow_pk is not None:
+            # Constructing a Workflow would create a default collection, so load the graph by ID
+            context['workflow_graph'] = WorkflowGraph.from_workflow(workflow_pk)
+
+        return context
+
     @swagger_auto_schema(
         request_body=WorkflowStepCreateSerializer(), responses={200: WorkflowStepSerializer()}
     )
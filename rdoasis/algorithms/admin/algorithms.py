@@ -1,7 +1,13 @@
 from django.contrib import admin
 from girder_utils.admin import ReadonlyTabularInline
 
-from rdoasis.algorithms.models import Algorithm, AlgorithmTask, Dataset, DockerImage
+from rdoasis.algorithms.models import (
+    Algorithm,
+    AlgorithmTask,
+    AlgorithmTaskShard,
+    Dataset,
+    DockerImage,
+)
 
 
 class AlgorithmTaskInline(ReadonlyTabularInline):
@@ -24,8 +30,15 @@ class DatasetAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'size', 'created', 'modified']
 
 
+class AlgorithmTaskShardInline(ReadonlyTabularInline):
+    model = AlgorithmTaskShard
+    exclude = ['input_files']
+
+
 @admin.register(AlgorithmTask)
 class AlgorithmTaskAdmin(admin.ModelAdmin):
+    inlines = [AlgorithmTaskShardInline]
+    readonly_fields = ['timeline']
     list_display = [
         'id',
         'algorithm',
@@ -0,0 +1,63 @@
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import List
+
+from django.core.management.base import BaseCommand
+from rgd.models import ChecksumFile
+
+from rdoasis.algorithms.utils.transfer import TransferEngine
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the transfer engine against the configured storage '
+        '(MinIO, in the development environment).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=20, help='Number of files to transfer')
+        parser.add_argument('--size', type=int, default=1024 * 1024, help='Size of each file')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            nargs='+',
+            default=[1, 4, 8],
+            help='Numbers of concurrent downloads to benchmark',
+        )
+
+    def report(self, label: str, num_bytes: int, seconds: float):
+        megabytes = num_bytes / (1024 * 1024)
+        self.stdout.write(
+            f'{label:<16} {megabytes:.1f} MB in {seconds:.2f}s ({megabytes / seconds:.1f} MB/s)'
+        )
+
+    def handle(self, *args, **options):
+        total = options['files'] * options['size']
+        uploaded: List[ChecksumFile] = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root_dir = Path(tmpdir)
+
+            # Random content, so that no file is linked to an existing one
+            source_dir = root_dir / 'source'
+            source_dir.mkdir()
+            for index in range(options['files']):
+                (source_dir / f'benchmark-{index}.bin').write_bytes(os.urandom(options['size']))
+
+            try:
+                engine = TransferEngine()
+                start = time.monotonic()
+                for path in sorted(source_dir.iterdir()):
+                    uploaded.append(engine.upload(path, f'benchmark/{path.name}')[0])
+                self.report('upload', total, time.monotonic() - start)
+
+                for workers in options['workers']:
+                    engine = TransferEngine(max_workers=workers)
+                    start = time.monotonic()
+                    for _ in engine.download_all(uploaded, root_dir / f'download-{workers}'):
+                        pass
+                    self.report(f'download (x{workers})', total, time.monotonic() - start)
+            finally:
+                for checksum_file in uploaded:
+                    checksum_file.delete()
@@ -0,0 +1,107 @@
+from typing import Dict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rdoasis.algorithms.utils.load import (
+    DEFAULT_MIX,
+    LoadGenerator,
+    create_synthetic_data,
+    delete_synthetic_data,
+)
+
+
+def parse_mix(values) -> Dict[str, int]:
+    """Parse endpoint weights given as `endpoint=weight`, over the default mix."""
+    mix = dict(DEFAULT_MIX)
+    for value in values:
+        endpoint, _, weight = value.partition('=')
+        if endpoint not in DEFAULT_MIX or not weight.isdigit():
+            raise CommandError(
+                f'Invalid mix "{value}", expected <endpoint>=<weight>, with an endpoint of: '
+                f'{", ".join(DEFAULT_MIX)}'
+            )
+        mix[endpoint] = int(weight)
+
+    return {endpoint: weight for endpoint, weight in mix.items() if weight}
+
+
+class Command(BaseCommand):
+    help = (
+        'Create synthetic datasets, algorithms and tasks, then drive a mix of REST API traffic '
+        'against a running deployment, reporting latency percentiles and throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://localhost:8000', help='Base URL of the deployment'
+        )
+        parser.add_argument('--datasets', type=int, default=10, help='Number of datasets')
+        parser.add_argument('--files', type=int, default=1000, help='Number of files per dataset')
+        parser.add_argument('--file-size', type=int, default=1024, help='Size of each file')
+        parser.add_argument('--algorithms', type=int, default=2, help='Number of algorithms')
+        parser.add_argument('--tasks', type=int, default=100, help='Number of finished tasks')
+        parser.add_argument('--log-lines', type=int, default=1000, help='Log lines per task')
+        parser.add_argument(
+            '--concurrency', type=int, default=8, help='Number of concurrent clients'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=60, help='Seconds to send requests for'
+        )
+        parser.add_argument(
+            '--requests', type=int, help='Number of requests to send, instead of a duration'
+        )
+        parser.add_argument(
+            '--mix',
+            nargs='+',
+            default=[],
+            metavar='ENDPOINT=WEIGHT',
+            help=(
+                f'Relative weights of endpoints, overriding the default mix of '
+                f'{" ".join(f"{k}={v}" for k, v in DEFAULT_MIX.items())}'
+            ),
+        )
+        parser.add_argument(
+            '--keep', action='store_true', help="Don't delete the synthetic data afterwards"
+        )
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        if not mix:
+            raise CommandError('At least one endpoint must have a non-zero weight.')
+
+        self.stdout.write('Creating synthetic data...')
+        data = create_synthetic_data(
+            num_datasets=options['datasets'],
+            num_files=options['files'],
+            num_algorithms=options['algorithms'],
+            num_tasks=options['tasks'],
+            log_lines=options['log_lines'],
+            file_size=options['file_size'],
+        )
+
+        try:
+            generator = LoadGenerator(
+                options['url'], data, mix=mix, concurrency=options['concurrency']
+            )
+            self.stdout.write(f'Sending requests with {options["concurrency"]} clients...')
+            if options['requests'] is not None:
+                elapsed = generator.run(num_requests=options['requests'])
+            else:
+                elapsed = generator.run(duration=options['duration'])
+
+            self.stdout.write(
+                f'{"endpoint":<10} {"requests":>8} {"errors":>6} {"req/s":>8} '
+                f'{"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}'
+            )
+            for row in generator.stats.summary(elapsed):
+                self.stdout.write(
+                    f'{row["endpoint"]:<10} {row["requests"]:>8} {row["errors"]:>6} '
+                    f'{row["rps"]:>8.1f} {row["p50"] * 1000:>8.1f} {row["p90"] * 1000:>8.1f} '
+                    f'{row["p99"] * 1000:>8.1f} {row["max"] * 1000:>8.1f}'
+                )
+        finally:
+            if options['keep']:
+                self.stdout.write(f'Synthetic data kept, with the prefix "{data.prefix}".')
+            else:
+                self.stdout.write('Deleting synthetic data...')
+                delete_synthetic_data(data.prefix)
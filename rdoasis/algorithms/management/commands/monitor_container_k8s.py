@@ -1,6 +1,13 @@
 from django.core.management.base import BaseCommand
 
 from rdoasis.algorithms.management.utils.k8s import KubernetesContainerMonitor
+from rdoasis.algorithms.utils.metrics import push_metrics
+from rdoasis.algorithms.utils.tracing import (
+    attach_env_trace_context,
+    configure_tracing,
+    flush_tracing,
+    tracer,
+)
 
 
 class Command(BaseCommand):
@@ -8,4 +15,13 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         # TODO: use post_start lifecycle hook to build local image if necessary
-        KubernetesContainerMonitor.from_env().monitor_container()
+        # Continue the trace of the celery task which created this container
+        configure_tracing('rdoasis-sidecar')
+        attach_env_trace_context()
+        try:
+            with tracer.start_as_current_span('monitor_container_k8s'):
+                KubernetesContainerMonitor.from_env().monitor_container()
+        finally:
+            # This container exits before it could be scraped
+            push_metrics('monitor_container_k8s')
+            flush_tracing()
@@ -1,10 +1,26 @@
 from django.core.management.base import BaseCommand
 
 from rdoasis.algorithms.management.utils.k8s import KubernetesContainerMonitor
+from rdoasis.algorithms.utils.metrics import push_metrics
+from rdoasis.algorithms.utils.tracing import (
+    attach_env_trace_context,
+    configure_tracing,
+    flush_tracing,
+    tracer,
+)
 
 
 class Command(BaseCommand):
     help = 'Monitor a K8s container and return files, status, etc.'
 
     def handle(self, *args, **options):
-        KubernetesContainerMonitor.from_env().download_input_dataset()
+        # Continue the trace of the celery task which created this container
+        configure_tracing('rdoasis-sidecar')
+        attach_env_trace_context()
+        try:
+            with tracer.start_as_current_span('setup_container_k8s'):
+                KubernetesContainerMonitor.from_env().download_input_dataset()
+        finally:
+            # This container exits before it could be scraped
+            push_metrics('setup_container_k8s')
+            flush_tracing()
@@ -1,13 +1,16 @@
 import os
 from pathlib import Path
 import time
-from typing import List, Optional, Set, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
-from django.core.files.uploadedfile import SimpleUploadedFile
 from kubernetes import client, config
 from rgd.models.file import ChecksumFile
 
-from rdoasis.algorithms.models import Algorithm, AlgorithmTask, Dataset
+from rdoasis.algorithms.models import Algorithm, AlgorithmTask, AlgorithmTaskShard
+from rdoasis.algorithms.utils.metrics import K8S_API_SECONDS, LOG_FLUSH_CHARACTERS, LOG_FLUSHES
+from rdoasis.algorithms.utils.timeline import Timeline
+from rdoasis.algorithms.utils.transfer import TransferEngine
+from rdoasis.algorithms.utils.watcher import OutputWatcher
 
 try:
     config.load_incluster_config()
@@ -40,7 +43,10 @@ class KubernetesContainerMonitor:
         if '' in env_vars.values():
             raise Exception('Not all env vars specified.')
 
-        return KubernetesContainerMonitor(**env_vars)
+        # Only set for sharded tasks
+        shard_id = os.getenv('SHARD_ID') or None
+
+        return KubernetesContainerMonitor(**env_vars, shard_id=shard_id)
 
     def __init__(
         self,
@@ -48,6 +54,7 @@ class KubernetesContainerMonitor:
         container_name: str,
         task_id: Union[str, int],
         temp_dir: str,
+        shard_id: Optional[Union[str, int]] = None,
     ) -> None:
         self.job_name = job_name
         self.container_name = container_name
@@ -59,11 +66,20 @@ class KubernetesContainerMonitor:
         ).get(pk=self.task_id)
         self.algorithm: Algorithm = self.algorithm_task.algorithm
 
+        # Fetch the shard of the task being run, if any
+        self.algorithm_task_shard: Optional[AlgorithmTaskShard] = None
+        if shard_id is not None:
+            self.algorithm_task_shard = self.algorithm_task.shards.get(pk=int(shard_id))
+
         # Setup paths
         self.temp_dir = Path(temp_dir)
         self.input_dir = self.temp_dir / 'input'
         self.output_dir = self.temp_dir / 'output'
 
+        # Setup the engine transferring input and output, and the timeline recording both
+        self.transfer = TransferEngine.from_settings()
+        self.timeline = Timeline(self.log_target)
+
         # Fetch pod
         self.pod_name = self.get_main_pod_name()
 
@@ -73,23 +89,32 @@ class KubernetesContainerMonitor:
 
     def download_input_dataset(self):
         self.ensure_directories()
+        self.timeline.record_queue_wait()
 
-        # Download dataset
-        files: List[ChecksumFile] = list(self.algorithm_task.input_dataset.files.all())
-        for checksum_file in files:
-            checksum_file.download_to_local_path(str(self.input_dir))
+        # Download dataset, or only this shard's files
+        if self.algorithm_task_shard is not None:
+            files: List[ChecksumFile] = list(self.algorithm_task_shard.input_files.all())
+        else:
+            files = list(self.algorithm_task.input_dataset.files.all())
+        with self.timeline.phase('input_download'):
+            for _ in self.transfer.download_all(files, self.input_dir):
+                pass
+
+        self.timeline.record_downloads(self.transfer.metrics)
 
     def get_main_pod_name(self) -> str:
-        pods: client.V1PodList = coreapi.list_namespaced_pod(
-            namespace='default', label_selector=f'job-name={self.job_name}'
-        )
+        with K8S_API_SECONDS.labels('list_namespaced_pod').time():
+            pods: client.V1PodList = coreapi.list_namespaced_pod(
+                namespace='default', label_selector=f'job-name={self.job_name}'
+            )
         pod = pods.items[0]  # type: ignore
         return pod.metadata.name
 
     def poll_container(self) -> InProgressStateAndLog:
-        pod: client.V1Pod = coreapi.read_namespaced_pod_status(
-            name=self.pod_name, namespace='default'
-        )
+        with K8S_API_SECONDS.labels('read_namespaced_pod_status').time():
+            pod: client.V1Pod = coreapi.read_namespaced_pod_status(
+                name=self.pod_name, namespace='default'
+            )
 
         log = ''
         running_state = None
@@ -104,40 +129,28 @@ class KubernetesContainerMonitor:
             termination_state = container.state.terminated  # type: ignore
             running_state = container.state.running  # type: ignore
             if running_state or termination_state:
-                log = coreapi.read_namespaced_pod_log(
-                    name=self.pod_name,
-                    container=self.container_name,
-                    namespace='default',
-                )
+                with K8S_API_SECONDS.labels('read_namespaced_pod_log').time():
+                    log = coreapi.read_namespaced_pod_log(
+                        name=self.pod_name,
+                        container=self.container_name,
+                        namespace='default',
+                    )
         except (AttributeError, StopIteration):
             pass
 
         return termination_state, log
 
     def upload_result_files(self):
-        """Upload any new files to the output dataset."""
-        new_checksum_files: List[ChecksumFile] = []
-        existing_filenames: Set[str] = {
-            file.name for file in self.algorithm_task.input_dataset.files.all()
-        }
-        for path, _, files in os.walk(self.output_dir):
-            fixed_filenames = {os.path.join(path, file) for file in files}
-            new_filenames = fixed_filenames - existing_filenames
-
-            for f in new_filenames:
-                relative_filename = Path(f).relative_to(self.output_dir)
-                checksum_file = ChecksumFile(name=relative_filename)
+        """Upload any output files which haven't yet been uploaded to the output dataset."""
+        with self.timeline.phase('final_upload'):
+            self.output_watcher.stop()
 
-                with open(f, 'rb') as file_contents:
-                    checksum_file.file = SimpleUploadedFile(
-                        name=str(relative_filename), content=file_contents.read()
-                    )
+        self.timeline.record_uploads(self.transfer.metrics)
 
-                checksum_file.save()
-                new_checksum_files.append(checksum_file)
-                existing_filenames.add(f)
-
-        self.algorithm_task.output_dataset.files.add(*new_checksum_files)
+    @property
+    def log_target(self) -> Union[AlgorithmTask, AlgorithmTaskShard]:
+        """Return the object whose output log and status reflect this container."""
+        return self.algorithm_task_shard or self.algorithm_task
 
     def container_result(self) -> FinalStateAndLog:
         log: str = ''
@@ -145,8 +158,10 @@ class KubernetesContainerMonitor:
         while termination_state is None:
             termination_state, log = self.poll_container()
             if log:
-                self.algorithm_task.output_log = log
-                self.algorithm_task.save()
+                self.log_target.output_log = log
+                self.log_target.save(update_fields=['output_log'])
+                LOG_FLUSHES.labels('k8s').inc()
+                LOG_FLUSH_CHARACTERS.labels('k8s').inc(len(log))
 
             # Wait at least 1 second
             time.sleep(1)
@@ -154,19 +169,36 @@ class KubernetesContainerMonitor:
         return termination_state, log
 
     def monitor_container(self):
-        termination_state, log = self.container_result()
+        # Add to the timeline recorded by the setup container
+        self.log_target.refresh_from_db(fields=['timeline'])
 
-        # Update task
-        self.algorithm_task.output_log = log
-        self.algorithm_task.status = (
+        # Upload results as they're written, and any remaining once the container exits
+        self.ensure_directories()
+        shard = self.algorithm_task_shard
+        self.output_watcher = OutputWatcher(
+            self.output_dir,
+            self.algorithm_task.get_output_dataset,
+            engine=self.transfer,
+            prefix=shard.output_prefix if shard is not None else '',
+            link_from=self.algorithm_task.input_dataset.files.all(),
+        )
+        self.output_watcher.start()
+        try:
+            termination_state, log = self.container_result()
+        finally:
+            self.upload_result_files()
+
+        # Resource usage isn't available from the k8s API, only the container runtime
+        if termination_state.started_at and termination_state.finished_at:
+            runtime = termination_state.finished_at - termination_state.started_at
+            self.timeline.record(container_seconds=runtime.total_seconds())
+
+        # Update task, or shard. Sharded tasks share an output dataset, created with the shards.
+        self.algorithm_task.get_output_dataset()
+        self.log_target.output_log = log
+        status = (
             AlgorithmTask.Status.SUCCEEDED
             if termination_state.exit_code == 0
             else AlgorithmTask.Status.FAILED
         )
-        self.algorithm_task.output_dataset = Dataset.objects.create(
-            name=f'Algorithm {self.algorithm.pk}, Task {self.algorithm_task.pk} (Output)'
-        )
-        self.algorithm_task.save()
-
-        # Upload results
-        self.upload_result_files()
+        self.algorithm_task.set_result(status, shard=self.algorithm_task_shard)
@@ -0,0 +1,84 @@
+# Generated by Django 4.0.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rgd', '0009_alter_checksumfile_collection_and_more'),
+        ('algorithms', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='algorithm',
+            name='num_shards',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='AlgorithmTaskShard',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                (
+                    'created',
+                    django_extensions.db.fields.CreationDateTimeField(
+                        auto_now_add=True, verbose_name='created'
+                    ),
+                ),
+                (
+                    'modified',
+                    django_extensions.db.fields.ModificationDateTimeField(
+                        auto_now=True, verbose_name='modified'
+                    ),
+                ),
+                ('index', models.PositiveIntegerField()),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('created', 'Created but not queued'),
+                            ('queued', 'Queued for processing'),
+                            ('running', 'Running'),
+                            ('failed', 'Failed'),
+                            ('success', 'Succeeded'),
+                        ],
+                        default='queued',
+                        max_length=16,
+                    ),
+                ),
+                ('output_log', models.TextField(blank=True, default='')),
+                (
+                    'input_files',
+                    models.ManyToManyField(
+                        related_name='algorithm_task_shards', to='rgd.checksumfile'
+                    ),
+                ),
+                (
+                    'task',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='shards',
+                        to='algorithms.algorithmtask',
+                    ),
+                ),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='algorithmtaskshard',
+            constraint=models.UniqueConstraint(
+                fields=('task', 'index'), name='unique_task_shard_index'
+            ),
+        ),
+    ]
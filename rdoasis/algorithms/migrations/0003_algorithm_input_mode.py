@@ -0,0 +1,25 @@
+# Generated by Django 4.0.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('algorithms', '0002_algorithm_num_shards_algorithmtaskshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='algorithm',
+            name='input_mode',
+            field=models.CharField(
+                choices=[
+                    ('download', 'Download all input files before running'),
+                    ('fuse', 'Read input files lazily, through a FUSE mount'),
+                ],
+                default='download',
+                max_length=16,
+            ),
+        ),
+    ]
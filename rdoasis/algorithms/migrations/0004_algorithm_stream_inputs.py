@@ -0,0 +1,18 @@
+# Generated by Django 4.0.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('algorithms', '0003_algorithm_input_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='algorithm',
+            name='stream_inputs',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('algorithms', '0004_algorithm_stream_inputs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='algorithmtask',
+            name='timeline',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='algorithmtaskshard',
+            name='timeline',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
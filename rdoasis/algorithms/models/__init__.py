@@ -1,17 +1,27 @@
-from typing import Dict, Generator, Union
+import re
+from typing import Dict, Generator, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlparse
 from zipfile import ZIP_DEFLATED
 
 import celery
 from django.conf import settings
-from django.db import models
-from django.db.models.functions import Length
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce, Length
 from django.dispatch import receiver
 from django.http.response import StreamingHttpResponse
 from django.utils.translation import gettext_lazy as _
 from django_extensions.db.models import TimeStampedModel
 from rgd.models import ChecksumFile, FileSourceType
+from rgd.models.mixins import Status
 import zipstream
 
+from rdoasis.algorithms.utils.metrics import (
+    DATASET_SIZE_SECONDS,
+    TASK_DISPATCH_SECONDS,
+    TASKS_DISPATCHED,
+    ZIP_STREAM_BYTES,
+)
+from rdoasis.algorithms.utils.tracing import inject_trace_context, tracer
 from rdoasis.algorithms.utils.zip import StreamingZipFile
 
 # Register length transform
@@ -48,6 +58,39 @@ class DockerImage(TimeStampedModel):
         ]
 
 
+def manifest_entry_to_checksum_file(entry: Dict, created_by=None) -> ChecksumFile:
+    """Construct (but don't save) a ChecksumFile from a dataset manifest entry."""
+    s3_key = entry.get('s3_key')
+    url = entry.get('url')
+    checksum = entry.get('checksum') or ''
+
+    return ChecksumFile(
+        # Default to the full key or URL path, so that files in different folders never collide
+        name=entry.get('name') or s3_key or urlparse(url).path.lstrip('/'),
+        type=FileSourceType.FILE_FIELD if s3_key else FileSourceType.URL,
+        file=s3_key,
+        url=url,
+        checksum=checksum,
+        # Files with a known checksum have no post save work to do
+        status=Status.SKIPPED if checksum else Status.CREATED,
+        created_by=created_by,
+    )
+
+
+def compute_checksums(checksum_file_ids: List[int]):
+    """Dispatch the rgd checksum task for each of the provided files."""
+    from rgd.tasks import task_checksum_file_post_save
+
+    for checksum_file_id in checksum_file_ids:
+        task_checksum_file_post_save.delay(checksum_file_id)
+
+
+def glob_to_regex(pattern: str) -> str:
+    """Convert a glob pattern (supporting `*` and `?`) to an anchored regular expression."""
+    translated = {'*': '.*', '?': '.'}
+    return '^' + ''.join(translated.get(char, re.escape(char)) for char in pattern) + '$'
+
+
 class Dataset(TimeStampedModel):
     """A collection of multiple ChecksumFiles."""
 
@@ -57,13 +100,195 @@ class Dataset(TimeStampedModel):
 
     def compute_size(self):
         """Compute the total size of all files in this dataset."""
-        self.size = sum(
-            (file.file.size for file in self.files.all() if file.type == FileSourceType.FILE_FIELD)
-        )
-        self.save()
+        with DATASET_SIZE_SECONDS.time():
+            self.size = sum(
+                (
+                    file.file.size
+                    for file in self.files.all()
+                    if file.type == FileSourceType.FILE_FIELD
+                )
+            )
+            self.save()
 
         return self.size
 
+    def apply_file_changes(
+        self, changes: Iterable[Tuple[Iterable[int], Iterable[int]]], batch_size: int = 1000
+    ):
+        """
+        Insert and delete files, from a sequence of (insert, delete) ID chunks, atomically.
+
+        All chunks are applied in a single transaction, with inserts applied before deletes within
+        each chunk. The m2m table is modified directly, so the dataset size is recomputed just once,
+        after the transaction commits. Raises ChecksumFile.DoesNotExist if any inserted file
+        doesn't exist, in which case no changes are made.
+        """
+        through = Dataset.files.through
+
+        def batches(ids: Iterable[int]):
+            ids = list(ids)
+            for start in range(0, len(ids), batch_size):
+                yield ids[start : start + batch_size]
+
+        with transaction.atomic():
+            for insert, delete in changes:
+                for batch in batches(insert):
+                    found = set(
+                        ChecksumFile.objects.filter(pk__in=batch).values_list('pk', flat=True)
+                    )
+                    missing = set(batch) - found
+                    if missing:
+                        raise ChecksumFile.DoesNotExist(
+                            f'ChecksumFiles do not exist: {sorted(missing)}'
+                        )
+
+                    through.objects.bulk_create(
+                        [through(dataset_id=self.pk, checksumfile_id=pk) for pk in found],
+                        ignore_conflicts=True,
+                    )
+
+                for batch in batches(delete):
+                    through.objects.filter(dataset_id=self.pk, checksumfile_id__in=batch).delete()
+
+            transaction.on_commit(lambda: compute_dataset_size.delay(self.pk))
+
+    def update_files(self, insert: Iterable[int] = (), delete: Iterable[int] = ()):
+        """Insert and delete files atomically. See `apply_file_changes`."""
+        self.apply_file_changes([(insert, delete)])
+
+    def register_files(self, manifest: Iterable[Dict], batch_size: int = 1000, created_by=None):
+        """
+        Create ChecksumFiles from a manifest and add them to this dataset, in bulk.
+
+        Each manifest entry must contain either an `s3_key` (a key in the configured storage
+        bucket) or a `url`, and may contain a `name` (defaulting to the key or URL path), `size`
+        and `checksum`. Files are created and attached in batches within a single transaction,
+        bypassing per-file signals. The dataset size is incremented using the sizes in the
+        manifest, rather than fetching the size of each file from storage.
+
+        Returns the number of files registered.
+        """
+        through = Dataset.files.through
+        entries = list(manifest)
+
+        # Only stored files are included in the dataset size (see compute_size)
+        stored_sizes = [entry.get('size') for entry in entries if entry.get('s3_key')]
+
+        unchecked_file_ids: List[int] = []
+        with transaction.atomic():
+            for start in range(0, len(entries), batch_size):
+                checksum_files = ChecksumFile.objects.bulk_create(
+                    [
+                        manifest_entry_to_checksum_file(entry, created_by=created_by)
+                        for entry in entries[start : start + batch_size]
+                    ]
+                )
+                through.objects.bulk_create(
+                    [through(dataset_id=self.pk, checksumfile_id=f.pk) for f in checksum_files]
+                )
+                unchecked_file_ids.extend(f.pk for f in checksum_files if not f.checksum)
+
+            if None in stored_sizes:
+                # Fall back to computing the size from storage
+                transaction.on_commit(lambda: compute_dataset_size.delay(self.pk))
+            else:
+                Dataset.objects.filter(pk=self.pk).update(
+                    size=Coalesce(models.F('size'), 0) + sum(stored_sizes)
+                )
+
+            # Let rgd compute any missing checksums, as it would have if each file were saved
+            if unchecked_file_ids:
+                transaction.on_commit(lambda: compute_checksums(unchecked_file_ids))
+
+        self.refresh_from_db(fields=['size'])
+        return len(entries)
+
+    @staticmethod
+    def set_operation_files(
+        source_ids: List[int],
+        operation: str = 'union',
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+    ) -> models.QuerySet:
+        """
+        Return a queryset of the files resulting from a set operation over several datasets.
+
+        The operation is one of `union`, `intersection` or `difference` (the files of the first
+        dataset, minus those in any of the others). The result may then be restricted to files
+        whose name matches any of the `include` glob patterns, and none of the `exclude` ones.
+        """
+        through = Dataset.files.through
+
+        def in_datasets(dataset_ids):
+            return models.Exists(
+                through.objects.filter(
+                    dataset_id__in=dataset_ids, checksumfile_id=models.OuterRef('pk')
+                )
+            )
+
+        queryset = ChecksumFile.objects.all()
+        if operation == 'union':
+            queryset = queryset.filter(in_datasets(source_ids))
+        elif operation == 'intersection':
+            for source_id in source_ids:
+                queryset = queryset.filter(in_datasets([source_id]))
+        elif operation == 'difference':
+            queryset = queryset.filter(in_datasets(source_ids[:1]))
+            if source_ids[1:]:
+                queryset = queryset.exclude(in_datasets(source_ids[1:]))
+        else:
+            raise ValueError(f'Unknown set operation: {operation}')
+
+        if include:
+            query = models.Q()
+            for pattern in include:
+                query |= models.Q(name__regex=glob_to_regex(pattern))
+            queryset = queryset.filter(query)
+
+        for pattern in exclude or []:
+            queryset = queryset.exclude(name__regex=glob_to_regex(pattern))
+
+        return queryset
+
+    def insert_files_from_queryset(self, queryset: models.QuerySet) -> int:
+        """
+        Add all files in a ChecksumFile queryset to this dataset, using a single query.
+
+        The files are inserted with `INSERT ... SELECT`, so they're never loaded into memory. This
+        does not send m2m_changed signals. Returns the number of files added.
+        """
+        through = Dataset.files.through
+        quote_name = connection.ops.quote_name
+
+        select_sql, select_params = queryset.values('pk').query.sql_with_params()
+        sql = (
+            f'INSERT INTO {quote_name(through._meta.db_table)}'
+            f' ({quote_name(through._meta.get_field("dataset").column)},'
+            f' {quote_name(through._meta.get_field("checksumfile").column)})'
+            f' SELECT %s, selected.{quote_name(ChecksumFile._meta.pk.column)}'
+            f' FROM ({select_sql}) AS selected'
+            ' ON CONFLICT DO NOTHING'
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.pk, *select_params])
+            return cursor.rowcount
+
+    @classmethod
+    def derive(cls, name: str, source_ids: List[int], **kwargs) -> 'Dataset':
+        """
+        Create a new dataset from a set operation over existing datasets.
+
+        See `set_operation_files` for the accepted arguments. The new dataset's size is computed
+        once, after the files have been inserted.
+        """
+        queryset = cls.set_operation_files(source_ids, **kwargs)
+        with transaction.atomic():
+            dataset = cls.objects.create(name=name)
+            dataset.insert_files_from_queryset(queryset)
+
+        return dataset
+
     def file_object_generator(self, compress_type=None) -> Generator[Dict, None, None]:
         """Yield zipstream arguments from this dataset's files."""
         for file in self.files.all():
@@ -87,8 +312,13 @@ class Dataset(TimeStampedModel):
     def streamed_zip_response(self, filename=None) -> StreamingHttpResponse:
         download_file_name = filename or f'{self.name}.zip'
 
+        def count_bytes(chunks):
+            for chunk in chunks:
+                ZIP_STREAM_BYTES.inc(len(chunk))
+                yield chunk
+
         z = self.streamed_zip()
-        res = StreamingHttpResponse(z, content_type='application/zip')
+        res = StreamingHttpResponse(count_bytes(z), content_type='application/zip')
         res['Content-Disposition'] = f'attachment; filename="{download_file_name}"'
 
         return res
@@ -108,14 +338,14 @@ def update_dataset_size(sender, instance: Dataset, action: str, reverse: bool, *
         and instance.pk is not None
         and action in ('post_add', 'post_remove', 'post_clear')
     ):
-        compute_dataset_size.delay(instance.pk)  # type: ignore
+        transaction.on_commit(lambda: compute_dataset_size.delay(instance.pk))  # type: ignore
 
 
 @receiver(models.signals.post_save, sender=Dataset)
 def init_dataset_size(sender, instance: Dataset, **kwargs):
     """Compute the dataset size if it's not been set yet."""
     if instance.pk is not None and instance.size is None:
-        compute_dataset_size.delay(instance.pk)  # type: ignore
+        transaction.on_commit(lambda: compute_dataset_size.delay(instance.pk))  # type: ignore
 
 
 class AlgorithmTask(TimeStampedModel):
@@ -128,6 +358,8 @@ class AlgorithmTask(TimeStampedModel):
         FAILED = 'failed', _('Failed')
         SUCCEEDED = 'success', _('Succeeded')
 
+    FINISHED_STATUSES = [Status.FAILED, Status.SUCCEEDED]
+
     algorithm = models.ForeignKey('Algorithm', related_name='tasks', on_delete=models.CASCADE)
     status = models.CharField(choices=Status.choices, default=Status.QUEUED, max_length=16)
     output_log = models.TextField(null=True, blank=True, default='')
@@ -138,6 +370,91 @@ class AlgorithmTask(TimeStampedModel):
         Dataset, blank=True, null=True, on_delete=models.RESTRICT, related_name='output_tasks'
     )
 
+    # The duration of each phase of the run, and the resources used, as recorded by Timeline
+    timeline = models.JSONField(default=dict, blank=True)
+
+    def create_shards(self, num_shards: int) -> List['AlgorithmTaskShard']:
+        """
+        Split the input dataset of this task into shards, to be run in parallel.
+
+        Input files are distributed between shards in turn, ordered by name. The output dataset is
+        created up front, so that every shard uploads its results into it, under the shard's
+        `output_prefix`, so that files of the same name written by different shards don't collide.
+        """
+        file_ids = list(
+            self.input_dataset.files.order_by('name', 'pk').values_list('pk', flat=True)
+        )
+        num_shards = max(1, min(num_shards, len(file_ids)))
+
+        with transaction.atomic():
+            self.status = AlgorithmTask.Status.RUNNING
+            self.output_dataset = Dataset.objects.create(
+                name=f'Algorithm {self.algorithm_id}, Task {self.pk} (Output)'
+            )
+            self.save(update_fields=['status', 'output_dataset'])
+
+            shards = AlgorithmTaskShard.objects.bulk_create(
+                [AlgorithmTaskShard(task=self, index=index) for index in range(num_shards)]
+            )
+            AlgorithmTaskShard.input_files.through.objects.bulk_create(
+                [
+                    AlgorithmTaskShard.input_files.through(
+                        algorithmtaskshard_id=shards[i % num_shards].pk, checksumfile_id=file_id
+                    )
+                    for i, file_id in enumerate(file_ids)
+                ],
+                batch_size=1000,
+            )
+
+        return shards
+
+    def get_output_dataset(self) -> Dataset:
+        """Return the output dataset of this task, creating it if necessary."""
+        if self.output_dataset is None:
+            self.output_dataset = Dataset.objects.create(
+                name=f'Algorithm {self.algorithm_id}, Task {self.pk} (Output)'
+            )
+            self.save(update_fields=['output_dataset'])
+
+        return self.output_dataset
+
+    def set_result(self, status: str, shard: Optional['AlgorithmTaskShard'] = None):
+        """
+        Save the status and log of a finished run of this task, or of one of its shards.
+
+        Once every shard has finished, the result of the task is merged from its shards.
+        """
+        target = shard or self
+        target.status = status
+        target.save()
+
+        if shard is not None:
+            self.finish_shards()
+
+    def finish_shards(self):
+        """
+        Set the status and log of this task from its shards, once every shard has finished.
+
+        The task fails if any shard failed. The log reports which shards failed, followed by the
+        log of each shard.
+        """
+        shards = list(self.shards.order_by('index'))
+        if any(shard.status not in AlgorithmTask.FINISHED_STATUSES for shard in shards):
+            return
+
+        failed = [shard.index for shard in shards if shard.status == AlgorithmTask.Status.FAILED]
+        summary = f'{len(failed)} of {len(shards)} shards failed'
+        if failed:
+            summary += f' (shards {", ".join(map(str, failed))})'
+
+        logs = [
+            f'==> Shard {shard.index}: {shard.status} <==\n{shard.output_log}' for shard in shards
+        ]
+        AlgorithmTask.objects.filter(pk=self.pk, status=AlgorithmTask.Status.RUNNING).update(
+            status=AlgorithmTask.Status.FAILED if failed else AlgorithmTask.Status.SUCCEEDED,
+            output_log='\n'.join([f'{summary}.', *logs]),
+        )
+
     def output_dataset_zip(self) -> zipstream.ZipFile:
         """
         Return the files in this task's output dataset, as a streamed zip file.
@@ -151,9 +468,36 @@ class AlgorithmTask(TimeStampedModel):
         return z
 
 
+class AlgorithmTaskShard(TimeStampedModel):
+    """The run of an algorithm task over a subset of its input dataset."""
+
+    task = models.ForeignKey(AlgorithmTask, related_name='shards', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField()
+    status = models.CharField(
+        choices=AlgorithmTask.Status.choices, default=AlgorithmTask.Status.QUEUED, max_length=16
+    )
+    output_log = models.TextField(blank=True, default='')
+    input_files = models.ManyToManyField(ChecksumFile, related_name='algorithm_task_shards')
+    timeline = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'index'], name='unique_task_shard_index')
+        ]
+
+    @property
+    def output_prefix(self) -> str:
+        """The folder of the shared output dataset that this shard's output files are placed in."""
+        return f'shard-{self.index}/'
+
+
 class Algorithm(TimeStampedModel):
     """An algorithm to run."""
 
+    class InputMode(models.TextChoices):
+        DOWNLOAD = 'download', _('Download all input files before running')
+        FUSE = 'fuse', _('Read input files lazily, through a FUSE mount')
+
     # The name of the Algorithm
     name = models.CharField(max_length=255)
 
@@ -174,6 +518,19 @@ class Algorithm(TimeStampedModel):
     # Whether the GPU should be requested or not
     gpu = models.BooleanField(default=False, blank=True)
 
+    # The number of shards to split the input dataset into, each run in its own container
+    num_shards = models.PositiveIntegerField(default=1)
+
+    # How input files are provided to the container. Files are downloaded if they can't be
+    # provided through FUSE (e.g. no FUSE mount is available, as on Kubernetes).
+    input_mode = models.CharField(
+        choices=InputMode.choices, default=InputMode.DOWNLOAD, max_length=16
+    )
+
+    # Whether the algorithm may start before all input files are present. Such algorithms should
+    # process files as they are listed in `input/.manifest`, until `input/.ready` is created.
+    stream_inputs = models.BooleanField(default=False)
+
     class Meta:
         constraints = [
             # Enforce that top level is an object
@@ -196,8 +553,24 @@ class Algorithm(TimeStampedModel):
                 run_algorithm_task_docker if settings.DOCKER_TASK_RUNNER else run_algorithm_task_k8s
             )
 
-        # Create algorithm task and dispatch
-        task = AlgorithmTask.objects.create(algorithm=self, input_dataset_id=dataset_id)
-        celery_task.delay(algorithm_task_id=task.pk)  # type: ignore
+        # Create algorithm task and dispatch, continuing the current trace in each run
+        runner = celery_task.name.rsplit('.', 1)[-1]
+        with TASK_DISPATCH_SECONDS.time(), tracer.start_as_current_span(
+            'Algorithm.run', attributes={'algorithm.id': self.pk}
+        ) as span:
+            task = AlgorithmTask.objects.create(algorithm=self, input_dataset_id=dataset_id)
+            span.set_attribute('algorithm_task.id', task.pk)
+
+            if self.num_shards > 1:
+                runs = [
+                    {'algorithm_task_id': task.pk, 'shard_id': shard.pk}
+                    for shard in task.create_shards(self.num_shards)
+                ]
+            else:
+                runs = [{'algorithm_task_id': task.pk}]
+
+            for kwargs in runs:
+                celery_task.apply_async(kwargs=kwargs, headers=inject_trace_context())
+                TASKS_DISPATCHED.labels(runner).inc()
 
         return task
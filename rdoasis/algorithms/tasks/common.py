@@ -1,49 +1,152 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
 import os
 from pathlib import Path
 import shutil
 import tempfile
-from typing import List, Set
+import time
+import traceback
+from typing import List, Optional, Union
 
 from billiard.einfo import ExceptionInfo
 import celery
-from django.core.files.uploadedfile import SimpleUploadedFile
-from rgd.models.common import ChecksumFile
+from celery.utils.log import get_task_logger
+from django.db import connection
+from opentelemetry import context, trace
+from rgd.models import ChecksumFile, FileSourceType
 
-from rdoasis.algorithms.models import Algorithm, AlgorithmTask, Dataset
+from rdoasis.algorithms.models import Algorithm, AlgorithmTask, AlgorithmTaskShard
+from rdoasis.algorithms.utils.fuse import url_to_fuse_path
+from rdoasis.algorithms.utils.metrics import TASK_QUEUE_SECONDS, TASK_RUN_SECONDS, TASKS_FINISHED
+from rdoasis.algorithms.utils.timeline import Timeline
+from rdoasis.algorithms.utils.tracing import celery_trace_context, tracer
+from rdoasis.algorithms.utils.transfer import TransferEngine
+from rdoasis.algorithms.utils.watcher import OutputWatcher
+
+logger = get_task_logger(__name__)
+
+# Files written to the input dir of algorithms which stream their input. Each input file is listed
+# in the manifest once it is completely written, and the ready file is created once all input files
+# are present. If providing the input fails, the error file is created instead.
+INPUT_MANIFEST_FILENAME = '.manifest'
+INPUT_READY_FILENAME = '.ready'
+INPUT_ERROR_FILENAME = '.error'
+
+# Seconds between scans of the output dir for completed files to upload
+OUTPUT_SCAN_INTERVAL = 5
 
 
 class ManagedTask(celery.Task):
+    # Whether to get the algorithm's docker image during setup, pulling it if it isn't present.
+    # Set by passing `pull_docker_image=True` to the task decorator.
+    pull_docker_image = False
+
+    @property
+    def log_target(self) -> Union[AlgorithmTask, AlgorithmTaskShard]:
+        """Return the object whose output log and status reflect this run."""
+        return getattr(self, 'algorithm_task_shard', None) or self.algorithm_task
+
+    def _start_output_upload(self):
+        """Start uploading output files to the output dataset, as they are written."""
+        self.output_watcher = OutputWatcher(
+            self.output_dir,
+            self.algorithm_task.get_output_dataset,
+            engine=self.transfer,
+            interval=OUTPUT_SCAN_INTERVAL,
+            prefix=self.algorithm_task_shard.output_prefix if self.algorithm_task_shard else '',
+            link_from=self.algorithm_task.input_dataset.files.all(),
+        )
+        self.output_watcher.start()
+
     def _upload_result_files(self):
-        """Upload any new files to the output dataset."""
-        new_checksum_files: List[ChecksumFile] = []
-        existing_filenames: Set[str] = {
-            file.name for file in self.algorithm_task.input_dataset.files.all()
-        }
-        for path, _, files in os.walk(self.output_dir):
-            fixed_filenames = {os.path.join(path, file) for file in files}
-            new_filenames = fixed_filenames - existing_filenames
-
-            for f in new_filenames:
-                relative_filename = Path(f).relative_to(self.output_dir)
-                checksum_file = ChecksumFile(name=relative_filename)
-
-                with open(f, 'rb') as file_contents:
-                    checksum_file.file = SimpleUploadedFile(
-                        name=relative_filename, content=file_contents.read()
-                    )
-
-                checksum_file.save()
-                new_checksum_files.append(checksum_file)
-                existing_filenames.add(f)
-
-        self.algorithm_task.output_dataset.files.add(*new_checksum_files)
-
-    def _download_input_dataset(self):
-        """Download the input dataset."""
+        """Upload any output files which haven't yet been uploaded to the output dataset."""
+        with self.timeline.phase('final_upload'):
+            self.output_watcher.stop()
+
+        self.timeline.record_uploads(self.transfer.metrics)
+
+    def _link_fuse_input_file(self, checksum_file: ChecksumFile) -> Optional[Path]:
+        """Link an input file to its path within the FUSE mount, returning the link if possible."""
+        # Stored files are only reachable through presigned URLs, which expire, so only link URL
+        # files; anything else is downloaded
+        if checksum_file.type != FileSourceType.URL:
+            return None
+
+        fuse_path = url_to_fuse_path(checksum_file.url)
+        if fuse_path is None:
+            return None
+
+        path = self.input_dir / checksum_file.name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.symlink_to(fuse_path)
+        self.fuse_inputs = True
+
+        return path
+
+    def _add_input_path(self, path: Path):
+        """Record a file placed in the input dir, listing it in the manifest if streaming."""
+        self.input_dataset_paths.append(path)
+        if self.algorithm.stream_inputs:
+            with open(self.input_dir / INPUT_MANIFEST_FILENAME, 'a') as manifest:
+                manifest.write(f'{path.relative_to(self.input_dir)}\n')
+
+    def _download_input_dataset(self, files: List[ChecksumFile]):
+        """Download the input dataset, or link it through FUSE if the algorithm requests it."""
+        use_fuse = self.algorithm.input_mode == Algorithm.InputMode.FUSE
+        stream = self.algorithm.stream_inputs
+        try:
+            with self.timeline.phase('input_download'):
+                downloads: List[ChecksumFile] = []
+                for checksum_file in files:
+                    path = self._link_fuse_input_file(checksum_file) if use_fuse else None
+                    if path is None:
+                        downloads.append(checksum_file)
+                    else:
+                        self._add_input_path(path)
+
+                # Download outside of the input dir and move each file into place, so that
+                # partially downloaded files are never visible to the algorithm
+                for _, partial_path in self.transfer.download_all(downloads, self.partial_dir):
+                    path = self.input_dir / partial_path.relative_to(self.partial_dir)
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(partial_path, path)
+                    self._add_input_path(path)
+
+            self.timeline.record_downloads(self.transfer.metrics)
+        except Exception:
+            if stream:
+                (self.input_dir / INPUT_ERROR_FILENAME).write_text(traceback.format_exc())
+            raise
+        finally:
+            # This runs in its own thread, with its own database connection
+            connection.close()
+
+        if stream:
+            (self.input_dir / INPUT_READY_FILENAME).touch()
+
+    def _start_input_download(self):
+        """Start providing the input dataset in the background."""
         self.input_dataset_paths: List[Path] = []
-        files: List[ChecksumFile] = list(self.algorithm_task.input_dataset.files.all())
-        for checksum_file in files:
-            self.input_dataset_paths.append(checksum_file.download_to_local_path(self.input_dir))
+        self.fuse_inputs = False
+
+        if self.algorithm_task_shard is not None:
+            files: List[ChecksumFile] = list(self.algorithm_task_shard.input_files.all())
+        else:
+            files = list(self.algorithm_task.input_dataset.files.all())
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        # Continue the trace of this run in the download thread
+        self.input_download: Optional[Future] = executor.submit(
+            contextvars.copy_context().run, self._download_input_dataset, files
+        )
+        executor.shutdown(wait=False)
+
+    def wait_for_inputs(self):
+        """Wait for the input dataset to be provided, raising any error encountered."""
+        input_download = getattr(self, 'input_download', None)
+        if input_download is not None:
+            self.input_download = None
+            input_download.result()
 
     def _maybe_download_docker_image_file(self):
         """Download the uploaded docker image file, if it exists."""
@@ -72,6 +175,25 @@ class ManagedTask(celery.Task):
         # Set ID of loaded docker image
         self.docker_image_file_id = result[0].id
 
+    def _maybe_pull_docker_image(self):
+        """Get the docker image to run, pulling it from its registry if it isn't present."""
+        self.docker_image = None
+        if not self.pull_docker_image:
+            return
+
+        # Import docker
+        import docker
+        from docker.errors import ImageNotFound
+
+        # An image loaded from a file is always present
+        client = docker.from_env()
+        image_id = self.docker_image_file_id or self.algorithm.docker_image.image_id
+        try:
+            self.docker_image = client.images.get(image_id)
+        except ImageNotFound:
+            logger.info(f'Pulling {image_id}. This may take a while...')
+            self.docker_image = client.images.pull(image_id)
+
     def _create_directories(self):
         # Create root dir
         self.root_dir = Path(tempfile.mkdtemp())
@@ -84,60 +206,138 @@ class ManagedTask(celery.Task):
         self.output_dir = self.root_dir / 'output'
         self.output_dir.mkdir()
 
+        # Create dir for input files which are still being downloaded
+        self.partial_dir = self.root_dir / 'partial'
+        self.partial_dir.mkdir()
+
     def _setup(self, **kwargs):
         # Set algorithm task and update status
         self.algorithm_task: AlgorithmTask = AlgorithmTask.objects.select_related(
             'algorithm', 'input_dataset', 'output_dataset'
         ).get(pk=kwargs['algorithm_task_id'])
-        self.algorithm_task.status = AlgorithmTask.Status.RUNNING
-        self.algorithm_task.save()
 
-        # Set algorithm
+        # Only run a single shard of the task, if one is provided
+        self.algorithm_task_shard: Optional[AlgorithmTaskShard] = None
+        if kwargs.get('shard_id') is not None:
+            self.algorithm_task_shard = self.algorithm_task.shards.get(pk=kwargs['shard_id'])
+            self.algorithm_task_shard.status = AlgorithmTask.Status.RUNNING
+            self.algorithm_task_shard.save(update_fields=['status'])
+        else:
+            self.algorithm_task.status = AlgorithmTask.Status.RUNNING
+            self.algorithm_task.save()
+
+        # Set algorithm, and the engine transferring its input and output
         self.algorithm: Algorithm = self.algorithm_task.algorithm
-
-        # Ensure necessary files and directories exist
-        self._create_directories()
-
-        # Download input
-        self._download_input_dataset()
-
-        # Download uploaded docker image if necessary
-        self._maybe_download_docker_image_file()
+        self.transfer = TransferEngine.from_settings()
+
+        # Record the timeline of this run, starting with how long it was queued
+        self.run_start = time.monotonic()
+        self.timeline = Timeline(self.log_target)
+        TASK_QUEUE_SECONDS.observe(self.timeline.record_queue_wait())
+
+        with self.timeline.phase('setup'):
+            # Ensure necessary files and directories exist
+            self._create_directories()
+
+            # Download input in the background, while loading or pulling the docker image
+            self._start_input_download()
+            try:
+                with self.timeline.phase('image_load'):
+                    self._maybe_download_docker_image_file()
+                    self._maybe_pull_docker_image()
+            finally:
+                # Only algorithms which stream their input may start before it is all present
+                if not self.algorithm.stream_inputs:
+                    self.wait_for_inputs()
 
     def _cleanup(self):
         """Perform any necessary cleanup."""
+        # Ensure input is no longer being written, and output no longer being read
+        try:
+            self.wait_for_inputs()
+        except Exception:
+            pass
+
+        if getattr(self, 'output_watcher', None) is not None:
+            self.output_watcher.stop(upload=False)
+            self.output_watcher = None
+
         # Remove dirs
         shutil.rmtree(self.root_dir, ignore_errors=True)
 
-    def on_failure(self, exc, task_id, args, kwargs, einfo: ExceptionInfo):
-        if not self.algorithm_task.output_log:
-            self.algorithm_task.output_log = ''
+        self._end_span()
+
+    def _observe_run(self, status: str):
+        """Count this run as finished with a status, and record its duration."""
+        TASKS_FINISHED.labels(status).inc()
+        run_start = getattr(self, 'run_start', None)
+        if run_start is not None:
+            TASK_RUN_SECONDS.labels(status).observe(time.monotonic() - run_start)
 
-        self.algorithm_task.output_log += einfo.traceback
-        self.algorithm_task.status = AlgorithmTask.Status.FAILED
-        self.algorithm_task.save()
+    def on_failure(self, exc, task_id, args, kwargs, einfo: ExceptionInfo):
+        if getattr(self, 'span', None) is not None:
+            self.span.record_exception(exc)
+            self.span.set_status(trace.Status(trace.StatusCode.ERROR))
+
+        target = self.log_target
+        if not target.output_log:
+            target.output_log = ''
+
+        # Keep any output produced before the failure, if possible
+        if getattr(self, 'output_watcher', None) is not None:
+            try:
+                self._upload_result_files()
+            except Exception:
+                logger.exception(f'Error uploading output files of {target}')
+                target.output_log += f'Error uploading output files:\n{traceback.format_exc()}'
+
+        target.output_log += einfo.traceback
+        self.algorithm_task.set_result(
+            AlgorithmTask.Status.FAILED, shard=getattr(self, 'algorithm_task_shard', None)
+        )
+        self._observe_run(AlgorithmTask.Status.FAILED)
 
         self._cleanup()
 
     def on_success(self, retval, task_id, args, kwargs):
-        # Create output dataset
-        self.algorithm_task.output_dataset = Dataset.objects.create(
-            name=f'Algorithm {self.algorithm.pk}, Task {self.algorithm_task.pk} (Output)'
-        )
-
+        # Ensure the output dataset exists, even if there is no output. Sharded tasks share an
+        # output dataset, created with the shards.
         self._upload_result_files()
+        self.algorithm_task.get_output_dataset()
 
-        # Check for nonzero exit code
+        # Mark task status and save logs, checking for nonzero exit code
         status = AlgorithmTask.Status.FAILED if retval else AlgorithmTask.Status.SUCCEEDED
-
-        # Mark task status and save logs
-        self.algorithm_task.status = status
-        self.algorithm_task.save()
+        self.algorithm_task.set_result(status, shard=self.algorithm_task_shard)
+        self._observe_run(status)
 
         self._cleanup()
 
+    def _start_span(self, **kwargs):
+        """Trace this run, continuing the trace it was dispatched in, until it's cleaned up."""
+        self.span = tracer.start_span(
+            self.name,
+            context=celery_trace_context(self.request),
+            attributes={
+                'algorithm_task.id': kwargs['algorithm_task_id'],
+                'algorithm_task_shard.id': kwargs.get('shard_id') or 0,
+            },
+        )
+        self.trace_token = context.attach(trace.set_span_in_context(self.span))
+
+    def _end_span(self):
+        if getattr(self, 'span', None) is not None:
+            self.span.end()
+            context.detach(self.trace_token)
+            self.span = None
+
     def __call__(self, **kwargs):
+        self._start_span(**kwargs)
         self._setup(**kwargs)
 
-        # Run task
-        return self.run(**kwargs)
+        # Run task, uploading output as it's written, and ensuring any input still being provided
+        # was provided successfully
+        self._start_output_upload()
+        with tracer.start_as_current_span('run'):
+            result = self.run(**kwargs)
+        self.wait_for_inputs()
+        return result
@@ -1,15 +1,41 @@
+import threading
+import time
+from typing import Dict
+
 import celery
 from celery.utils.log import get_task_logger
 
+from rdoasis.algorithms.models import Algorithm
 from rdoasis.algorithms.tasks.common import ManagedTask
+from rdoasis.algorithms.utils.fuse import FUSE_ROOT
+from rdoasis.algorithms.utils.metrics import LOG_FLUSH_CHARACTERS, LOG_FLUSHES
 
 logger = get_task_logger(__name__)
 
 
+def _record_container_stats(container, stats: Dict[str, float], stopped: threading.Event):
+    """Record the peak memory and total CPU time used by a container, until it's stopped."""
+    try:
+        for sample in container.stats(stream=True, decode=True):
+            memory = sample.get('memory_stats', {}).get('usage')
+            if memory:
+                stats['memory_peak_bytes'] = max(stats.get('memory_peak_bytes', 0), memory)
+
+            cpu = sample.get('cpu_stats', {}).get('cpu_usage', {}).get('total_usage')
+            if cpu:
+                stats['cpu_seconds'] = round(cpu / 1e9, 3)
+
+            if stopped.is_set():
+                break
+    except Exception:
+        # Stats are best effort, and end with an error if the container is removed first
+        pass
+
+
 def _run_algorithm_task_docker(self: ManagedTask, *args, **kwargs):
     # Import docker here so django can import task without docker
     import docker
-    from docker.errors import DockerException, ImageNotFound
+    from docker.errors import DockerException
     from docker.models.containers import Container
     from docker.types import DeviceRequest, Mount
 
@@ -17,6 +43,13 @@ def _run_algorithm_task_docker(self: ManagedTask, *args, **kwargs):
     paths_to_mount = (self.input_dir, self.output_dir)
     mounts = [Mount(target=str(path), source=str(path), type='bind') for path in paths_to_mount]
 
+    # Input files linked through FUSE point into the FUSE mount, which must also be visible. This
+    # is decided up front, as input may still be provided after the container starts.
+    if self.algorithm.input_mode == Algorithm.InputMode.FUSE and FUSE_ROOT.is_dir():
+        mounts.append(
+            Mount(target=str(FUSE_ROOT), source=str(FUSE_ROOT), type='bind', read_only=True)
+        )
+
     device_requests = []
     if self.algorithm.gpu:
         device_requests.append(DeviceRequest(count=-1, capabilities=[['gpu']]))
@@ -24,18 +57,10 @@ def _run_algorithm_task_docker(self: ManagedTask, *args, **kwargs):
     # Instantiate docker client
     client = docker.from_env()
 
-    # Get or pull image
-    image_id = self.docker_image_file_id or self.algorithm.docker_image.image_id
-    try:
-        image = client.images.get(image_id)
-    except ImageNotFound:
-        logger.info(f'Pulling {image_id}. This may take a while...')
-        image = client.images.pull(image_id)
-
-    # Run container
+    # Run container, with the image pulled during setup
     try:
         container: Container = client.containers.run(
-            image,
+            self.docker_image,
             command=self.algorithm.command,
             entrypoint=self.algorithm.entrypoint,
             environment=self.algorithm.environment,
@@ -46,29 +71,47 @@ def _run_algorithm_task_docker(self: ManagedTask, *args, **kwargs):
         )
     except DockerException as e:
         # Replace null characters with �
-        self.algorithm_task.output_log = str(e).replace('\x00', '\uFFFD')
-        self.algorithm_task.save()
+        self.log_target.output_log = str(e).replace('\x00', '\uFFFD')
+        self.log_target.save()
         return e.status_code
 
-    # Capture live logs
-    self.algorithm_task.output_log = ''
+    # Sample resource usage while the container runs
+    container_start = time.monotonic()
+    stats: Dict[str, float] = {}
+    stopped = threading.Event()
+    stats_thread = threading.Thread(
+        target=_record_container_stats, args=(container, stats, stopped), daemon=True
+    )
+    stats_thread.start()
+
+    # Capture live logs, into the shard being run if the task is sharded
+    log_target = self.log_target
+    log_target.output_log = ''
     output_generator = container.logs(stream=True)
     for log in output_generator:
         # TODO: Probably inefficient, fix
 
         # Replace null characters with �
-        self.algorithm_task.output_log += log.decode('utf-8').replace('\x00', '\uFFFD')
-        self.algorithm_task.save(update_fields=['output_log'])
+        log_target.output_log += log.decode('utf-8').replace('\x00', '\uFFFD')
+        log_target.save(update_fields=['output_log'])
+        LOG_FLUSHES.labels('docker').inc()
+        LOG_FLUSH_CHARACTERS.labels('docker').inc(len(log_target.output_log))
 
     # Wait for container to exit and remove
     res = container.wait()
+    stopped.set()
+    stats_thread.join(timeout=5)
     container.remove()
 
+    self.timeline.record(
+        container_seconds=round(time.monotonic() - container_start, 3), **dict(stats)
+    )
+
     # Return status code
     return res['StatusCode']
 
 
-@celery.shared_task(base=ManagedTask, bind=True)
+@celery.shared_task(base=ManagedTask, bind=True, pull_docker_image=True)
 def run_algorithm_task_docker(self: ManagedTask, *args, **kwargs):
     """
     Run an algorithm task.
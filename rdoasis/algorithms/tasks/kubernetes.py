@@ -3,13 +3,16 @@ from pathlib import Path
 import re
 import shlex
 import tempfile
+from typing import Optional
 
 import boto3
 import celery
 from celery.utils.log import get_task_logger
 from django.conf import settings
 
-from rdoasis.algorithms.models import Algorithm, AlgorithmTask
+from rdoasis.algorithms.models import Algorithm, AlgorithmTask, AlgorithmTaskShard
+from rdoasis.algorithms.utils.metrics import K8S_API_SECONDS
+from rdoasis.algorithms.utils.tracing import celery_trace_context, trace_context_env, tracer
 
 logger = get_task_logger(__name__)
 
@@ -18,7 +21,8 @@ def generate_kube_config_dict():
     # Will read AWS env vars
     client = boto3.client('eks')
 
-    cluster = client.describe_cluster(name=settings.K8S_CLUSTER_NAME)
+    with K8S_API_SECONDS.labels('describe_cluster').time():
+        cluster = client.describe_cluster(name=settings.K8S_CLUSTER_NAME)
     cluster_arn = cluster['cluster']['arn']  # type: ignore
     cert_auth_data = cluster['cluster']['certificateAuthority']['data']  # type: ignore
     cluster_endpoint = cluster['cluster']['endpoint']  # type: ignore
@@ -72,8 +76,16 @@ class ManagedK8sTask(celery.Task):
         self.algorithm_task: AlgorithmTask = AlgorithmTask.objects.select_related(
             'algorithm', 'input_dataset', 'output_dataset'
         ).get(pk=kwargs['algorithm_task_id'])
-        self.algorithm_task.status = AlgorithmTask.Status.RUNNING
-        self.algorithm_task.save()
+
+        # Only run a single shard of the task, if one is provided
+        self.algorithm_task_shard: Optional[AlgorithmTaskShard] = None
+        if kwargs.get('shard_id') is not None:
+            self.algorithm_task_shard = self.algorithm_task.shards.get(pk=kwargs['shard_id'])
+            self.algorithm_task_shard.status = AlgorithmTask.Status.RUNNING
+            self.algorithm_task_shard.save(update_fields=['status'])
+        else:
+            self.algorithm_task.status = AlgorithmTask.Status.RUNNING
+            self.algorithm_task.save()
 
         # Set algorithm
         self.algorithm: Algorithm = self.algorithm_task.algorithm
@@ -81,6 +93,8 @@ class ManagedK8sTask(celery.Task):
         # Define job vars
         self.temp_path = Path(tempfile.mkdtemp())
         self.job_name = f'algorithm-{self.algorithm.pk}-task-{self.algorithm_task.pk}'
+        if self.algorithm_task_shard is not None:
+            self.job_name += f'-shard-{self.algorithm_task_shard.index}'
         self.image_id = self.algorithm_task.algorithm.docker_image.image_id
         self.main_container_name = re.sub(r'[^a-zA-Z\d-]', '-', self.image_id.lower())
 
@@ -94,9 +108,11 @@ class ManagedK8sTask(celery.Task):
         db = settings.DATABASES['default']
         db_url = f'postgres://{db["USER"]}:{db["PASSWORD"]}@{db["HOST"]}:{db["PORT"]}/{db["NAME"]}'
 
-        # Pass env vars to containers
+        # Pass env vars to containers, including the configuration of trace exporters
         django_environ = {
-            k: v for k, v in os.environ.items() if k.startswith('DJANGO') or k.startswith('AWS')
+            k: v
+            for k, v in os.environ.items()
+            if k.startswith('DJANGO') or k.startswith('AWS') or k.startswith('OTEL')
         }
         pass_through_env_vars = [
             client.V1EnvVar(name=key, value=value)
@@ -130,7 +146,14 @@ class ManagedK8sTask(celery.Task):
             client.V1EnvVar(name='JOB_NAME', value=self.job_name),
             client.V1EnvVar(name='CONTAINER_NAME', value=self.main_container_name),
             client.V1EnvVar(name='TASK_ID', value=str(self.algorithm_task.pk)),
+            client.V1EnvVar(
+                name='SHARD_ID',
+                value=str(self.algorithm_task_shard.pk) if self.algorithm_task_shard else '',
+            ),
             client.V1EnvVar(name='TEMP_DIR', value=str(self.temp_path)),
+            #
+            # Continue the trace of this run in the sidecars
+            *(client.V1EnvVar(name=key, value=value) for key, value in trace_context_env().items()),
         ]
 
     def _construct_job(self):
@@ -199,8 +222,17 @@ class ManagedK8sTask(celery.Task):
         )
 
     def __call__(self, *args, **kwargs):
-        self._setup(**kwargs)
-        return super().__call__(*args, **kwargs)
+        # Trace this run, continuing the trace it was dispatched in
+        with tracer.start_as_current_span(
+            self.name,
+            context=celery_trace_context(self.request),
+            attributes={
+                'algorithm_task.id': kwargs['algorithm_task_id'],
+                'algorithm_task_shard.id': kwargs.get('shard_id') or 0,
+            },
+        ):
+            self._setup(**kwargs)
+            return super().__call__(*args, **kwargs)
 
     def run_algorithm_task_k8s(self, *args, **kwargs):
         # Import kubernetes here so django can import task
@@ -212,7 +244,8 @@ class ManagedK8sTask(celery.Task):
 
         api = client.BatchV1Api()
         job: client.V1Job = self._construct_job()
-        job: client.V1Job = api.create_namespaced_job(namespace='default', body=job)
+        with K8S_API_SECONDS.labels('create_namespaced_job').time():
+            job: client.V1Job = api.create_namespaced_job(namespace='default', body=job)
 
 
 @celery.shared_task(base=ManagedK8sTask, bind=True)
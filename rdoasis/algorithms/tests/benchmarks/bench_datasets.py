@@ -0,0 +1,42 @@
+import pytest
+
+from rdoasis.algorithms.models import Dataset
+
+from .conftest import large
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_files', [10_000, 100_000, pytest.param(1_000_000, marks=large)])
+@pytest.mark.parametrize('path_prefix', ['', 'folder-1/'])
+def test_tree(benchmark, authenticated_api_client, url_dataset_factory, num_files, path_prefix):
+    dataset: Dataset = url_dataset_factory(num_files)
+
+    r = benchmark(
+        authenticated_api_client.get,
+        f'/api/datasets/{dataset.pk}/tree/',
+        {'path_prefix': path_prefix},
+    )
+    assert r.status_code == 200
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_files', [100, 1000])
+def test_compute_size(benchmark, stored_dataset_factory, num_files):
+    dataset: Dataset = stored_dataset_factory(num_files, 1024)
+
+    assert benchmark(dataset.compute_size) == num_files * 1024
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    'num_files,file_size', [(1000, 1024), (100, 1024 * 1024), (10, 10 * 1024 * 1024)]
+)
+def test_streamed_zip(benchmark, stored_dataset_factory, num_files, file_size):
+    dataset: Dataset = stored_dataset_factory(num_files, file_size)
+    benchmark.extra_info['bytes'] = num_files * file_size
+
+    def stream() -> int:
+        return sum(len(chunk) for chunk in dataset.streamed_zip())
+
+    # Random content doesn't compress, so the zip is at least as large as its contents
+    assert benchmark(stream) >= num_files * file_size
@@ -0,0 +1,24 @@
+import pytest
+
+from rdoasis.algorithms.models import AlgorithmTask
+
+LOG_LINE = 'x' * 99 + '\n'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_lines', [100, 1000])
+def test_log_persistence(benchmark, algorithm_task: AlgorithmTask, num_lines):
+    """Persist a log one line at a time, as the docker runner does while a container is running."""
+    benchmark.extra_info['characters'] = num_lines * len(LOG_LINE)
+
+    def reset():
+        algorithm_task.output_log = ''
+
+    def persist():
+        for _ in range(num_lines):
+            algorithm_task.output_log += LOG_LINE
+            algorithm_task.save(update_fields=['output_log'])
+
+    benchmark.pedantic(persist, setup=reset, rounds=3)
+    algorithm_task.refresh_from_db()
+    assert len(algorithm_task.output_log) == num_lines * len(LOG_LINE)
@@ -0,0 +1,51 @@
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+
+from rdoasis.algorithms.models import Dataset
+from rdoasis.algorithms.utils.transfer import TransferEngine
+from rdoasis.algorithms.utils.watcher import OutputWatcher
+
+# The file counts and sizes transferred, each totalling 10 MB
+TRANSFER_SIZES = [(1000, 10 * 1024), (100, 100 * 1024), (10, 1024 * 1024)]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('num_files,file_size', TRANSFER_SIZES)
+@pytest.mark.parametrize('max_workers', [1, 4, 8])
+def test_download_input_dataset(
+    benchmark, stored_dataset_factory, tmp_path: Path, num_files, file_size, max_workers
+):
+    dataset: Dataset = stored_dataset_factory(num_files, file_size)
+    files = list(dataset.files.all())
+    engine = TransferEngine(max_workers=max_workers)
+    benchmark.extra_info['bytes'] = num_files * file_size
+
+    def download(directory: str):
+        for _ in engine.download_all(files, Path(directory)):
+            pass
+
+    # Download into a new directory each round
+    benchmark.pedantic(download, setup=lambda: ((tempfile.mkdtemp(dir=tmp_path),), {}), rounds=5)
+    assert engine.metrics.files_downloaded == num_files * 5
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('num_files,file_size', TRANSFER_SIZES)
+def test_upload_result_files(benchmark, dataset: Dataset, tmp_path: Path, num_files, file_size):
+    benchmark.extra_info['bytes'] = num_files * file_size
+
+    def write_output():
+        # Random content, so that no file is linked to one uploaded in a previous round
+        output_dir = Path(tempfile.mkdtemp(dir=tmp_path))
+        for index in range(num_files):
+            (output_dir / f'output-{index}.bin').write_bytes(os.urandom(file_size))
+
+        return (OutputWatcher(output_dir, lambda: dataset),), {}
+
+    def upload(watcher: OutputWatcher):
+        assert len(watcher.stop()) == num_files
+
+    benchmark.pedantic(upload, setup=write_output, rounds=3)
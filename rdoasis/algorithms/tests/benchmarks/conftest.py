@@ -0,0 +1,61 @@
+import hashlib
+import os
+from typing import Callable
+
+import pytest
+from rgd.models.common import ChecksumFile
+
+from rdoasis.algorithms.models import Dataset
+
+# Benchmarks over a million files take several minutes to set up, so only run when requested
+LARGE_BENCHMARKS = bool(os.environ.get('RDOASIS_LARGE_BENCHMARKS'))
+large = pytest.mark.skipif(not LARGE_BENCHMARKS, reason='RDOASIS_LARGE_BENCHMARKS is not set')
+
+
+@pytest.fixture
+def url_dataset_factory(dataset_factory) -> Callable[[int], Dataset]:
+    """Return a function creating a dataset of URL files, spread across 100 folders."""
+
+    def create(num_files: int) -> Dataset:
+        dataset: Dataset = dataset_factory()
+        dataset.files.clear()
+        dataset.register_files(
+            {
+                'url': f'https://example.com/folder-{index % 100}/file-{index}.txt',
+                'name': f'folder-{index % 100}/file-{index}.txt',
+                'checksum': f'{index:0128x}',
+            }
+            for index in range(num_files)
+        )
+        return dataset
+
+    return create
+
+
+@pytest.fixture
+def stored_dataset_factory(dataset_factory, checksum_file_factory) -> Callable[[int, int], Dataset]:
+    """
+    Return a function creating a dataset of stored files.
+
+    Every file in the dataset refers to the same stored object, so that large datasets can be
+    created without uploading each file.
+    """
+
+    def create(num_files: int, file_size: int) -> Dataset:
+        data = os.urandom(file_size)
+        stored: ChecksumFile = checksum_file_factory(file__data=data)
+        dataset: Dataset = dataset_factory()
+        dataset.files.clear()
+        dataset.register_files(
+            {
+                's3_key': stored.file.name,
+                'name': f'file-{index}.bin',
+                'size': file_size,
+                'checksum': hashlib.sha512(data).hexdigest(),
+            }
+            for index in range(num_files)
+        )
+        dataset.refresh_from_db()
+        return dataset
+
+    return create
@@ -1,7 +1,11 @@
+import json
 from pathlib import Path
 
 import pytest
-from rgd.models import ChecksumFile
+from rgd.models import ChecksumFile, FileSourceType
+
+from rdoasis.algorithms.models import Dataset
+from rdoasis.algorithms.views.serializers import DatasetFileSerializer
 
 
 @pytest.mark.django_db(transaction=True)
@@ -112,3 +116,189 @@ def test_rest_dataset_tree(dataset, checksum_file_factory, admin_api_client):
     assert files[Path(file4.name).name]['id'] == file4.id
     assert files[Path(file5.name).name]['id'] == file5.id
     assert files[Path(file6.name).name]['id'] == file6.id
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_files_cursor_pagination(dataset, authenticated_api_client):
+    """Test that keyset pagination walks every file in primary key order."""
+    expected_ids = sorted(f.id for f in dataset.files.all())
+
+    r = authenticated_api_client.get(
+        f'/api/datasets/{dataset.id}/files/', {'pagination': 'cursor', 'limit': 2}
+    )
+    assert r.status_code == 200
+    assert 'count' not in r.json()
+
+    file_ids = []
+    while True:
+        page = r.json()
+        assert len(page['results']) <= 2
+        file_ids.extend(f['id'] for f in page['results'])
+        if page['next'] is None:
+            break
+
+        r = authenticated_api_client.get(page['next'])
+
+    assert file_ids == expected_ids
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_register_files(dataset, checksum_file_factory, authenticated_api_client):
+    """Test that files are created from a manifest, and the size is taken from the manifest."""
+    stored_file: ChecksumFile = checksum_file_factory()
+    dataset.refresh_from_db()
+    initial_size = dataset.size
+    initial_count = dataset.files.count()
+
+    manifest = [
+        {'name': 'stored/a.txt', 's3_key': stored_file.file.name, 'size': 10, 'checksum': 'abc'},
+        {'url': 'https://example.com/data/b.tif', 'size': 20},
+    ]
+    r = authenticated_api_client.post(
+        f'/api/datasets/{dataset.id}/files/bulk/', {'files': manifest}, format='json'
+    )
+
+    assert r.status_code == 200
+    assert r.json()['num_files'] == initial_count + 2
+    assert r.json()['size'] == initial_size + 10
+
+    names = set(dataset.files.values_list('name', flat=True))
+    assert {'stored/a.txt', 'data/b.tif'} <= names
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_register_files_invalid(dataset, authenticated_api_client):
+    """Each manifest entry must have exactly one source."""
+    initial_count = dataset.files.count()
+    r = authenticated_api_client.post(
+        f'/api/datasets/{dataset.id}/files/bulk/',
+        {'files': [{'name': 'a.txt', 's3_key': 'a.txt', 'url': 'https://example.com/a.txt'}]},
+        format='json',
+    )
+
+    assert r.status_code == 400
+    assert dataset.files.count() == initial_count
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize(
+    'operation,expected', [('union', {1, 2, 3}), ('intersection', {2}), ('difference', {1})]
+)
+def test_rest_dataset_derive(
+    dataset_factory, checksum_file_factory, authenticated_api_client, operation, expected
+):
+    files = {i: checksum_file_factory(name=f'{i}.txt') for i in (1, 2, 3)}
+    dataset_a = dataset_factory()
+    dataset_a.files.set([files[1], files[2]])
+    dataset_b = dataset_factory()
+    dataset_b.files.set([files[2], files[3]])
+
+    r = authenticated_api_client.post(
+        '/api/datasets/derive/',
+        {'name': 'derived', 'sources': [dataset_a.id, dataset_b.id], 'operation': operation},
+        format='json',
+    )
+    assert r.status_code == 200
+    assert r.json()['num_files'] == len(expected)
+
+    derived = Dataset.objects.get(id=r.json()['id'])
+    assert {f.id for f in derived.files.all()} == {files[i].id for i in expected}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_derive_filter(dataset, checksum_file_factory, authenticated_api_client):
+    tif = checksum_file_factory(name='a/image.tif')
+    aux = checksum_file_factory(name='a/image.tif.aux.xml')
+    dataset.files.set([tif, aux])
+
+    r = authenticated_api_client.post(
+        '/api/datasets/derive/',
+        {'name': 'filtered', 'sources': [dataset.id], 'exclude': ['*.aux.xml']},
+        format='json',
+    )
+    assert r.status_code == 200
+
+    derived = Dataset.objects.get(id=r.json()['id'])
+    assert list(derived.files.all()) == [tif]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_update_files_atomic(dataset, authenticated_api_client):
+    """An invalid insert should prevent any deletes from being applied."""
+    file_ids = {f.id for f in dataset.files.all()}
+    r = authenticated_api_client.put(
+        f'/api/datasets/{dataset.id}/files/',
+        {'insert': [-1], 'delete': list(file_ids)},
+        format='json',
+    )
+
+    assert r.status_code == 400
+    assert {f.id for f in dataset.files.all()} == file_ids
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_stream_update_files(dataset, checksum_file_factory, authenticated_api_client):
+    new_files = checksum_file_factory.create_batch(3)
+    file_ids = [f.id for f in dataset.files.all()]
+
+    lines = [
+        {'insert': [new_files[0].id, new_files[1].id]},
+        {'insert': [new_files[2].id], 'delete': file_ids[:2]},
+    ]
+    r = authenticated_api_client.put(
+        f'/api/datasets/{dataset.id}/files/stream/',
+        '\n'.join(json.dumps(line) for line in lines),
+        content_type='application/x-ndjson',
+    )
+
+    assert r.status_code == 200
+    assert {f.id for f in dataset.files.all()} == set(file_ids[2:]) | {f.id for f in new_files}
+    assert r.json()['num_files'] == len(file_ids) - 2 + 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_files_presigned(dataset, authenticated_api_client):
+    r = authenticated_api_client.get(f'/api/datasets/{dataset.id}/files/', {'limit': 10})
+    assert r.status_code == 200
+
+    # Assert each stored file is signed once, for both of its URLs
+    for f in r.json()['results']:
+        # The size of each file isn't included, since it would be requested from storage
+        assert set(f) == {*DatasetFileSerializer().fields, 'download_url'}
+        assert 'size' not in f
+        assert f['download_url'] == f['file']
+        assert ChecksumFile.objects.get(pk=f['id']).file.name in f['download_url']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rest_dataset_manifest(dataset, authenticated_api_client):
+    dataset.register_files(
+        [{'url': 'https://example.com/remote.txt', 'name': 'remote.txt', 'checksum': 'a' * 128}]
+    )
+    url_file = ChecksumFile.objects.get(name='remote.txt', type=FileSourceType.URL)
+
+    r = authenticated_api_client.get(
+        f'/api/datasets/{dataset.id}/manifest/', {'pagination': 'cursor', 'limit': 2}
+    )
+    entries = []
+    while True:
+        assert r.status_code == 200
+        page = r.json()
+        entries.extend(page['results'])
+        if page['next'] is None:
+            break
+
+        r = authenticated_api_client.get(page['next'])
+
+    assert [entry['id'] for entry in entries] == sorted(f.id for f in dataset.files.all())
+    for entry in entries:
+        checksum_file = ChecksumFile.objects.get(pk=entry['id'])
+        assert entry['name'] == checksum_file.name
+        assert entry['checksum'] == checksum_file.checksum
+
+        # Stored files are presigned, and URL files are given as is
+        if checksum_file == url_file:
+            assert entry['url'] == url_file.url
+        else:
+            assert checksum_file.file.name in entry['url']
+            assert 'Signature' in entry['url']
@@ -0,0 +1,51 @@
+from django.core.management import CommandError
+import pytest
+
+from rdoasis.algorithms.management.commands.load_test import parse_mix
+from rdoasis.algorithms.models import AlgorithmTask, Dataset
+from rdoasis.algorithms.utils.load import (
+    DEFAULT_MIX,
+    LoadGenerator,
+    create_synthetic_data,
+    delete_synthetic_data,
+    percentile,
+)
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([1.0], 90) == 1
+
+
+def test_parse_mix():
+    mix = parse_mix(['run=0', 'logs=50'])
+    assert 'run' not in mix
+    assert mix['logs'] == 50
+
+    with pytest.raises(CommandError):
+        parse_mix(['unknown=1'])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_generator(live_server):
+    data = create_synthetic_data(
+        num_datasets=2, num_files=20, num_algorithms=1, num_tasks=2, log_lines=10
+    )
+
+    # Running algorithms would run containers
+    mix = {endpoint: weight for endpoint, weight in DEFAULT_MIX.items() if endpoint != 'run'}
+    generator = LoadGenerator(live_server.url, data, mix=mix, concurrency=2)
+    elapsed = generator.run(num_requests=20)
+
+    rows = {row['endpoint']: row for row in generator.stats.summary(elapsed)}
+    assert rows['total']['requests'] == 20
+    assert rows['total']['errors'] == 0
+    assert set(rows) <= {*mix, 'total'}
+
+    # Assert all synthetic data is removed
+    delete_synthetic_data(data.prefix)
+    assert not Dataset.objects.filter(name__startswith=data.prefix).exists()
+    assert not AlgorithmTask.objects.filter(pk__in=data.tasks).exists()
@@ -0,0 +1,43 @@
+from prometheus_client import REGISTRY
+import pytest
+
+from rdoasis.algorithms.models import AlgorithmTask
+
+
+@pytest.mark.django_db(transaction=True)
+def test_metrics_task_counts(algorithm_task_factory, api_client, user_factory):
+    algorithm_task_factory.create_batch(2, status=AlgorithmTask.Status.RUNNING)
+    algorithm_task_factory(status=AlgorithmTask.Status.FAILED)
+
+    api_client.force_login(user_factory(is_staff=True))
+    r = api_client.get('/metrics')
+    assert r.status_code == 200
+
+    metrics = r.content.decode()
+    assert 'rdoasis_tasks{status="running"} 2.0' in metrics
+    assert 'rdoasis_tasks{status="failed"} 1.0' in metrics
+    assert 'rdoasis_tasks{status="success"} 0.0' in metrics
+
+
+@pytest.mark.django_db(transaction=True)
+def test_metrics_zip_stream_bytes(dataset, authenticated_api_client):
+    before = REGISTRY.get_sample_value('rdoasis_zip_stream_bytes_total')
+
+    r = authenticated_api_client.get(f'/api/datasets/{dataset.pk}/download/')
+    content = b''.join(r.streaming_content)
+
+    after = REGISTRY.get_sample_value('rdoasis_zip_stream_bytes_total')
+    assert after - before == len(content)
+
+
+@pytest.mark.django_db
+def test_metrics_access(api_client, user, settings):
+    settings.METRICS_TOKEN = 'secret'
+
+    # Assert metrics are only served to staff, or with the metrics token
+    assert api_client.get('/metrics').status_code == 403
+    assert api_client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code == 403
+    assert api_client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code == 200
+
+    api_client.force_login(user)
+    assert api_client.get('/metrics').status_code == 403
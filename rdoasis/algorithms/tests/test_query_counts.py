@@ -0,0 +1,79 @@
+"""Ensure that list endpoints issue a constant number of queries, regardless of page size."""
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import pytest
+
+
+def count_queries(client, url: str, params=None) -> int:
+    with CaptureQueriesContext(connection) as context:
+        r = client.get(url, params)
+
+    assert r.status_code == 200
+    return len(context.captured_queries)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dataset_list_query_count(dataset_factory, authenticated_api_client):
+    dataset_factory.create_batch(2)
+    few = count_queries(authenticated_api_client, '/api/datasets/')
+
+    dataset_factory.create_batch(4)
+    many = count_queries(authenticated_api_client, '/api/datasets/')
+
+    assert few == many
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dataset_list_num_files(dataset, checksum_file_factory, authenticated_api_client):
+    dataset.files.add(checksum_file_factory())
+    r = authenticated_api_client.get('/api/datasets/')
+
+    results = {d['id']: d for d in r.json()['results']}
+    assert results[dataset.id]['num_files'] == dataset.files.count()
+    assert 'files' not in results[dataset.id]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dataset_files_query_count(dataset, checksum_file_factory, authenticated_api_client):
+    url = f'/api/datasets/{dataset.id}/files/'
+    few = count_queries(authenticated_api_client, url)
+
+    dataset.files.add(*checksum_file_factory.create_batch(5))
+    many = count_queries(authenticated_api_client, url)
+
+    assert few == many
+
+
+@pytest.mark.django_db(transaction=True)
+def test_algorithm_task_list_query_count(algorithm_task_factory, authenticated_api_client):
+    algorithm_task_factory.create_batch(2)
+    few = count_queries(authenticated_api_client, '/api/algorithm_tasks/')
+
+    algorithm_task_factory.create_batch(4)
+    many = count_queries(authenticated_api_client, '/api/algorithm_tasks/')
+
+    assert few == many
+
+
+@pytest.mark.django_db(transaction=True)
+def test_algorithm_tasks_query_count(algorithm, algorithm_task_factory, authenticated_api_client):
+    url = f'/api/algorithms/{algorithm.id}/tasks/'
+    algorithm_task_factory.create_batch(2, algorithm=algorithm)
+    few = count_queries(authenticated_api_client, url)
+
+    algorithm_task_factory.create_batch(4, algorithm=algorithm)
+    many = count_queries(authenticated_api_client, url)
+
+    assert few == many
+
+
+@pytest.mark.django_db(transaction=True)
+def test_algorithm_list_query_count(algorithm_factory, authenticated_api_client):
+    algorithm_factory.create_batch(2)
+    few = count_queries(authenticated_api_client, '/api/algorithms/')
+
+    algorithm_factory.create_batch(4)
+    many = count_queries(authenticated_api_client, '/api/algorithms/')
+
+    assert few == many
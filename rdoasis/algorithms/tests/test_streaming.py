@@ -0,0 +1,91 @@
+import io
+import zipfile
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import AsyncClient
+import pytest
+
+from rdoasis.algorithms.models import AlgorithmTask, Dataset
+from rdoasis.algorithms.views import streaming
+
+
+async def read_async_content(response) -> bytes:
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dataset_download_asgi(dataset: Dataset, user):
+    client = AsyncClient()
+    client.force_login(user)
+    response = async_to_sync(client.get)(f'/api/datasets/{dataset.pk}/download/')
+    assert response.status_code == 200
+
+    # Assert the zip is streamed asynchronously, instead of being buffered
+    assert response.is_async
+    content = async_to_sync(read_async_content)(response)
+    with zipfile.ZipFile(io.BytesIO(content)) as z:
+        assert set(z.namelist()) == set(dataset.files.values_list('name', flat=True))
+
+
+@pytest.mark.django_db
+def test_task_logs_follow(algorithm_task: AlgorithmTask, authenticated_api_client, mocker):
+    algorithm_task.output_log = 'a\nb\n'
+    algorithm_task.status = AlgorithmTask.Status.RUNNING
+    algorithm_task.save()
+
+    # Log more output while the client waits, and then finish the task
+    def run_task(_):
+        AlgorithmTask.objects.filter(pk=algorithm_task.pk).update(
+            output_log='a\nb\nc\n', status=AlgorithmTask.Status.SUCCEEDED
+        )
+
+    mocker.patch.object(streaming.time, 'sleep', side_effect=run_task)
+
+    r = authenticated_api_client.get(
+        f'/api/algorithm_tasks/{algorithm_task.pk}/logs/', {'tail': 1, 'follow': True}
+    )
+    assert r.status_code == 200
+    assert b''.join(r.streaming_content) == b'b\nc\n'
+
+
+@pytest.mark.django_db
+def test_task_logs_follow_head(algorithm_task: AlgorithmTask, authenticated_api_client):
+    r = authenticated_api_client.get(
+        f'/api/algorithm_tasks/{algorithm_task.pk}/logs/', {'head': 1, 'follow': True}
+    )
+    assert r.status_code == 400
+
+
+@pytest.mark.django_db
+def test_follow_log_max_duration(algorithm_task: AlgorithmTask, mocker):
+    algorithm_task.status = AlgorithmTask.Status.RUNNING
+    algorithm_task.save()
+
+    # Assert a task that never finishes is only followed until the maximum duration
+    mocker.patch.object(streaming, 'LOG_FOLLOW_MAX_DURATION', 0)
+    sleep = mocker.patch.object(streaming.time, 'sleep')
+    assert list(streaming.follow_log(algorithm_task.pk, 0)) == []
+    sleep.assert_not_called()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_afollow_log(algorithm_task: AlgorithmTask, mocker):
+    algorithm_task.output_log = 'a\n'
+    algorithm_task.status = AlgorithmTask.Status.RUNNING
+    algorithm_task.save()
+
+    # Log more output while following, and then finish the task
+    async def run_task(_):
+        await sync_to_async(
+            AlgorithmTask.objects.filter(pk=algorithm_task.pk).update, thread_sensitive=False
+        )(output_log='a\nb\n', status=AlgorithmTask.Status.SUCCEEDED)
+
+    mocker.patch.object(streaming, 'asyncio').sleep.side_effect = run_task
+    close_old_connections = mocker.spy(streaming, 'close_old_connections')
+
+    async def follow():
+        return [log async for log in streaming.afollow_log(algorithm_task.pk, 2)]
+
+    # Assert only new output is yielded, with connections closed around each read in a thread
+    assert async_to_sync(follow)() == ['b\n']
+    assert close_old_connections.call_count == 4
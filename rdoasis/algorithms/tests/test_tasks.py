@@ -1,13 +1,28 @@
+import os
 import pathlib
+import shutil
+import time
 from typing import List
 
 import celery
+from django.db.models.fields.files import FieldFile
 from faker import Faker
+from opentelemetry import context, trace
 import pytest
-from rgd.models.common import ChecksumFile
+from rgd.models import ChecksumFile, FileSourceType
 
-from rdoasis.algorithms.models import AlgorithmTask
-from rdoasis.algorithms.tasks.common import ManagedTask
+from rdoasis.algorithms.models import Algorithm, AlgorithmTask
+from rdoasis.algorithms.tasks import common
+from rdoasis.algorithms.tasks.common import (
+    INPUT_MANIFEST_FILENAME,
+    INPUT_READY_FILENAME,
+    ManagedTask,
+)
+from rdoasis.algorithms.utils import fuse, transfer
+from rdoasis.algorithms.utils.checksum import compute_checksum
+from rdoasis.algorithms.utils.tracing import extract_trace_context, inject_trace_context
+
+from .factories import DATA_DIR
 
 
 def write_to_test_file(path: str):
@@ -56,6 +71,57 @@ def failing_task(self, *args, **kwargs):
     raise Exception('Task failed')
 
 
+@celery.shared_task(base=ManagedTask, bind=True)
+def failing_odd_shard_task(self, *args, **kwargs):
+    if self.algorithm_task_shard.index % 2:
+        raise Exception('Shard failed')
+
+    (self.output_dir / f'shard-{self.algorithm_task_shard.index}.txt').write_text('Shard Output')
+
+
+@celery.shared_task(base=ManagedTask, bind=True)
+def streaming_task(self, *args, **kwargs):
+    # Wait for all input to arrive, then record the manifest
+    deadline = time.monotonic() + 30
+    while not (self.input_dir / INPUT_READY_FILENAME).exists():
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+    manifest = (self.input_dir / INPUT_MANIFEST_FILENAME).read_text()
+    (self.output_dir / 'manifest.txt').write_text(manifest)
+
+
+@celery.shared_task(base=ManagedTask, bind=True)
+def incremental_output_task(self, *args, **kwargs):
+    # Wait for the first file to be uploaded before writing the second
+    (self.output_dir / 'first.txt').write_text('First Output')
+    deadline = time.monotonic() + 30
+    while self.algorithm_task.output_dataset is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+    (self.output_dir / 'second.txt').write_text('Second Output')
+
+
+@celery.shared_task(base=ManagedTask, bind=True)
+def partial_output_task(self, *args, **kwargs):
+    (self.output_dir / 'partial.txt').write_text('Partial Output')
+    raise Exception('Task failed')
+
+
+@celery.shared_task(base=ManagedTask, bind=True)
+def passthrough_task(self, *args, **kwargs):
+    # Copy all input to the output unchanged, along with a renamed copy of one input file
+    shutil.copytree(self.input_dir, self.output_dir, dirs_exist_ok=True)
+    shutil.copy(self.input_dataset_paths[0], self.output_dir / 'renamed.txt')
+
+
+@celery.shared_task(base=ManagedTask, bind=True)
+def trace_id_task(self, *args, **kwargs):
+    trace_id = trace.get_current_span().get_span_context().trace_id
+    (self.output_dir / 'trace_id.txt').write_text(trace.format_trace_id(trace_id))
+
+
 @pytest.mark.django_db(transaction=True)
 def test_successful_task(algorithm_task: AlgorithmTask):
     succeeding_task.delay(algorithm_task_id=algorithm_task.pk)
@@ -72,6 +138,36 @@ def test_successful_task(algorithm_task: AlgorithmTask):
     assert file.file.read() == b'Test Output'
 
 
+@pytest.mark.django_db(transaction=True)
+def test_task_timeline(algorithm_task: AlgorithmTask):
+    succeeding_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert each phase of the run, and the files transferred, are recorded
+    timeline = algorithm_task.timeline
+    for phase in ['queue', 'setup', 'input_download', 'image_load', 'final_upload']:
+        assert timeline[f'{phase}_seconds'] >= 0
+
+    assert timeline['input_files'] == algorithm_task.input_dataset.files.count()
+    assert (
+        timeline['input_bytes'] == timeline['input_files'] * (DATA_DIR / 'test.txt').stat().st_size
+    )
+    assert timeline['output_files'] == 1
+    assert timeline['output_bytes'] == len(b'Test Output')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_task_timeline_image_pull(algorithm_task: AlgorithmTask, mocker):
+    mocker.patch.object(
+        ManagedTask, '_maybe_pull_docker_image', side_effect=lambda: time.sleep(0.1)
+    )
+    succeeding_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert the time taken to pull the docker image is recorded as loading the image
+    assert algorithm_task.timeline['image_load_seconds'] >= 0.1
+
+
 @pytest.mark.django_db(transaction=True)
 def test_sucessful_task_complex_files(algorithm_task: AlgorithmTask):
     """Test that no input files are duplicated in output, and that all output is present."""
@@ -109,6 +205,64 @@ def test_failed_task(algorithm_task: AlgorithmTask):
     assert algorithm_task.output_dataset is None
 
 
+@pytest.mark.django_db(transaction=True)
+def test_incremental_output_upload(algorithm_task: AlgorithmTask, mocker):
+    mocker.patch.object(common, 'OUTPUT_SCAN_INTERVAL', 0.1)
+
+    incremental_output_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert files uploaded while running and after exiting are both present
+    assert algorithm_task.status == AlgorithmTask.Status.SUCCEEDED
+    assert {f.name for f in algorithm_task.output_dataset.files.all()} == {
+        'first.txt',
+        'second.txt',
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_task_partial_output(algorithm_task: AlgorithmTask):
+    partial_output_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert output written before the failure is kept
+    assert algorithm_task.status == AlgorithmTask.Status.FAILED
+    partial = algorithm_task.output_dataset.files.get(name='partial.txt')
+    assert partial.file.read() == b'Partial Output'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_task_output_upload_error(algorithm_task: AlgorithmTask, mocker):
+    mocker.patch.object(ManagedTask, '_upload_result_files', side_effect=OSError('Upload failed'))
+    partial_output_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert the error uploading output is logged, along with the error that failed the task
+    assert algorithm_task.status == AlgorithmTask.Status.FAILED
+    assert 'OSError: Upload failed' in algorithm_task.output_log
+    assert 'Exception: Task failed' in algorithm_task.output_log
+
+
+@pytest.mark.django_db(transaction=True)
+def test_output_deduplicated(algorithm_task: AlgorithmTask, mocker):
+    algorithm_task.input_dataset.files.update(checksum=compute_checksum(DATA_DIR / 'test.txt'))
+    input_files = list(algorithm_task.input_dataset.files.all())
+    save = mocker.spy(FieldFile, 'save')
+
+    passthrough_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+    assert algorithm_task.status == AlgorithmTask.Status.SUCCEEDED
+
+    # Assert unchanged input files are linked, not uploaded again
+    output_files = {f.name: f for f in algorithm_task.output_dataset.files.all()}
+    assert {f.pk for f in input_files} < {f.pk for f in output_files.values()}
+
+    # Assert only the renamed copy is uploaded, since stored objects are deleted with their file
+    save.assert_called_once()
+    renamed = output_files['renamed.txt']
+    assert renamed.file.name not in {f.file.name for f in input_files}
+
+
 @pytest.mark.django_db(transaction=True)
 def test_managed_task_setup(algorithm_task: AlgorithmTask):
     base_task = ManagedTask()
@@ -148,3 +302,178 @@ def test_managed_task_cleanup(algorithm_task: AlgorithmTask):
     # Assert cleanup succeeded
     assert not any([p.exists() for p in input_dataset_paths])
     assert not output_dir.is_dir()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sharded_task(algorithm_task: AlgorithmTask):
+    shards = algorithm_task.create_shards(2)
+    for shard in shards:
+        succeeding_task.delay(algorithm_task_id=algorithm_task.pk, shard_id=shard.pk)
+    algorithm_task.refresh_from_db()
+
+    assert algorithm_task.status == AlgorithmTask.Status.SUCCEEDED
+    assert algorithm_task.output_log.startswith('0 of 2 shards failed.')
+
+    # Assert every input file is in exactly one shard
+    shard_files = [set(shard.input_files.values_list('pk', flat=True)) for shard in shards]
+    assert sorted(len(files) for files in shard_files) == [2, 3]
+    assert set.union(*shard_files) == set(
+        algorithm_task.input_dataset.files.values_list('pk', flat=True)
+    )
+
+    # Assert the outputs of all shards are merged into the output dataset, with the file written
+    # by both shards kept separately for each shard
+    assert sorted(algorithm_task.output_dataset.files.values_list('name', flat=True)) == [
+        'shard-0/test.txt',
+        'shard-1/test.txt',
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sharded_task_partial_failure(algorithm_task: AlgorithmTask):
+    for shard in algorithm_task.create_shards(3):
+        failing_odd_shard_task.delay(algorithm_task_id=algorithm_task.pk, shard_id=shard.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert the failed shard is reported, and the other shards' outputs are kept
+    assert algorithm_task.status == AlgorithmTask.Status.FAILED
+    assert algorithm_task.output_log.startswith('1 of 3 shards failed (shards 1).')
+    assert 'Shard failed' in algorithm_task.output_log
+    assert {f.name for f in algorithm_task.output_dataset.files.all()} == {
+        'shard-0/shard-0.txt',
+        'shard-2/shard-2.txt',
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_managed_task_setup_fuse(algorithm_task: AlgorithmTask, tmp_path, mocker):
+    algorithm_task.algorithm.input_mode = Algorithm.InputMode.FUSE
+    algorithm_task.algorithm.save()
+
+    # Make every input file but the first a URL file
+    stored_file, *url_files = algorithm_task.input_dataset.files.order_by('pk')
+    for checksum_file in url_files:
+        ChecksumFile.objects.filter(pk=checksum_file.pk).update(
+            type=FileSourceType.URL, url=f'https://host/{checksum_file.pk}'
+        )
+
+    # Pretend that the https scheme is mounted
+    mocker.patch.object(fuse, 'FUSE_ROOT', tmp_path)
+    mocker.patch('os.path.ismount', side_effect=lambda path: path == tmp_path / 'https')
+
+    base_task = ManagedTask()
+    base_task._setup(algorithm_task_id=algorithm_task.pk)
+
+    # Assert URL files are linked into the FUSE mount, instead of downloaded
+    assert base_task.fuse_inputs
+    for checksum_file in url_files:
+        path = base_task.input_dir / checksum_file.name
+        assert path.is_symlink()
+        assert (
+            pathlib.Path(os.readlink(path)) == tmp_path / 'https' / 'host' / f'{checksum_file.pk}..'
+        )
+
+    # Assert stored files are downloaded, since their presigned URLs expire
+    path = base_task.input_dir / stored_file.name
+    assert path.exists() and not path.is_symlink()
+
+    base_task._cleanup()
+
+
+def test_url_to_fuse_path(tmp_path, mocker):
+    mocker.patch.object(fuse, 'FUSE_ROOT', tmp_path)
+    mocker.patch('os.path.ismount', side_effect=lambda path: path == tmp_path / 'https')
+
+    assert (
+        fuse.url_to_fuse_path('https://host/a/b.tif')
+        == tmp_path / 'https' / 'host' / 'a' / 'b.tif..'
+    )
+    assert fuse.url_to_fuse_path('http://host/a/b.tif') is None
+
+    # Assert paths with a component longer than NAME_MAX are rejected
+    assert fuse.url_to_fuse_path(f'https://host/{"x" * fuse.NAME_MAX}') is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_managed_task_setup_fuse_unavailable(algorithm_task: AlgorithmTask):
+    algorithm_task.algorithm.input_mode = Algorithm.InputMode.FUSE
+    algorithm_task.algorithm.save()
+
+    base_task = ManagedTask()
+    base_task._setup(algorithm_task_id=algorithm_task.pk)
+
+    # Assert input files are downloaded, when no FUSE mount is available
+    assert not base_task.fuse_inputs
+    assert all(p.exists() and not p.is_symlink() for p in base_task.input_dataset_paths)
+
+    base_task._cleanup()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_streaming_task(algorithm_task: AlgorithmTask):
+    algorithm_task.algorithm.stream_inputs = True
+    algorithm_task.algorithm.save()
+
+    streaming_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+    assert algorithm_task.status == AlgorithmTask.Status.SUCCEEDED
+
+    # Assert every input file was listed in the manifest
+    manifest = algorithm_task.output_dataset.files.get(name='manifest.txt')
+    assert sorted(manifest.file.read().decode().splitlines()) == sorted(
+        algorithm_task.input_dataset.files.values_list('name', flat=True)
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_task_input_download_failure(algorithm_task: AlgorithmTask, mocker):
+    mocker.patch.object(transfer, 'download_with_checksum', side_effect=OSError('Failed'))
+
+    succeeding_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert the error raised while downloading in the background fails the task
+    assert algorithm_task.status == AlgorithmTask.Status.FAILED
+    assert 'OSError: Failed' in algorithm_task.output_log
+
+
+@pytest.mark.django_db(transaction=True)
+def test_task_input_checksum(algorithm_task: AlgorithmTask):
+    algorithm_task.input_dataset.files.update(checksum='')
+
+    succeeding_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+    assert algorithm_task.status == AlgorithmTask.Status.SUCCEEDED
+
+    # Assert the checksums computed while downloading were saved
+    checksum = compute_checksum(DATA_DIR / 'test.txt')
+    assert set(algorithm_task.input_dataset.files.values_list('checksum', flat=True)) == {checksum}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_task_input_checksum_mismatch(algorithm_task: AlgorithmTask):
+    algorithm_task.input_dataset.files.update(checksum='0' * 128)
+
+    succeeding_task.delay(algorithm_task_id=algorithm_task.pk)
+    algorithm_task.refresh_from_db()
+
+    # Assert a corrupted download fails the task
+    assert algorithm_task.status == AlgorithmTask.Status.FAILED
+    assert 'Checksum mismatch' in algorithm_task.output_log
+
+
+@pytest.mark.django_db(transaction=True)
+def test_task_trace_context(algorithm_task: AlgorithmTask):
+    trace_id = 'ab' * 16
+    token = context.attach(extract_trace_context({'traceparent': f'00-{trace_id}-{"cd" * 8}-01'}))
+    try:
+        trace_id_task.apply_async(
+            kwargs={'algorithm_task_id': algorithm_task.pk}, headers=inject_trace_context()
+        )
+    finally:
+        context.detach(token)
+
+    # Assert the task continued the trace it was dispatched in
+    algorithm_task.refresh_from_db()
+    output = algorithm_task.output_dataset.files.get(name='trace_id.txt')
+    assert output.file.read().decode() == trace_id
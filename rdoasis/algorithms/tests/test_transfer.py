@@ -0,0 +1,153 @@
+import io
+from pathlib import Path
+
+import pytest
+from rgd.models import FileSourceType
+from rgd.models.common import ChecksumFile
+
+from rdoasis.algorithms.models import Dataset
+from rdoasis.algorithms.utils import checksum, transfer
+from rdoasis.algorithms.utils.checksum import compute_checksum, download_with_checksum
+from rdoasis.algorithms.utils.transfer import TransferEngine
+from rdoasis.algorithms.utils.watcher import OutputWatcher
+
+from .factories import DATA_DIR
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_download_all(dataset: Dataset, tmp_path: Path, max_workers: int):
+    engine = TransferEngine(max_workers=max_workers)
+    downloaded = dict(engine.download_all(dataset.files.all(), tmp_path))
+
+    # Assert every file is downloaded intact
+    assert {f.pk for f in downloaded} == set(dataset.files.values_list('pk', flat=True))
+    for checksum_file, path in downloaded.items():
+        assert path == tmp_path / checksum_file.name
+        assert path.read_bytes() == (DATA_DIR / 'test.txt').read_bytes()
+
+    assert engine.metrics.files_downloaded == dataset.files.count()
+
+
+@pytest.mark.django_db
+def test_download_url_file(tmp_path: Path):
+    url_file = ChecksumFile.objects.create(
+        name='url/test.txt', type=FileSourceType.URL, url=(DATA_DIR / 'test.txt').as_uri()
+    )
+    path = download_with_checksum(url_file, tmp_path)
+    assert path == tmp_path / 'url' / 'test.txt'
+    assert path.read_bytes() == (DATA_DIR / 'test.txt').read_bytes()
+
+    # Assert the checksum computed while downloading is saved
+    url_file.refresh_from_db()
+    assert url_file.checksum == compute_checksum(DATA_DIR / 'test.txt')
+
+
+@pytest.mark.django_db
+def test_download_s3_url_file(tmp_path: Path, mocker):
+    s3 = mocker.patch.object(checksum, 'get_s3_client').return_value
+    s3.get_object.return_value = {'Body': io.BytesIO((DATA_DIR / 'test.txt').read_bytes())}
+    url_file = ChecksumFile.objects.create(
+        name='test.txt', type=FileSourceType.URL, url='s3://bucket/path/test.txt'
+    )
+
+    # Assert the S3 object is streamed, instead of being opened with urllib
+    path = download_with_checksum(url_file, tmp_path)
+    assert path.read_bytes() == (DATA_DIR / 'test.txt').read_bytes()
+    s3.get_object.assert_called_once_with(
+        Bucket='bucket', Key='path/test.txt', RequestPayer='requester'
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_download_retries(checksum_file: ChecksumFile, tmp_path: Path, mocker):
+    download = mocker.patch.object(
+        transfer,
+        'download_with_checksum',
+        side_effect=[OSError('Failed'), tmp_path / 'test.txt'],
+    )
+    (tmp_path / 'test.txt').write_text('Test')
+
+    engine = TransferEngine(retries=1, retry_delay=0)
+    assert engine.download(checksum_file, tmp_path) == tmp_path / 'test.txt'
+    assert download.call_count == 2
+    assert engine.metrics.retries == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_download_cache(checksum_file: ChecksumFile, tmp_path: Path, mocker):
+    engine = TransferEngine(cache_dir=tmp_path / 'cache')
+    engine.download(checksum_file, tmp_path / 'first')
+
+    # Assert the second download is linked from the cache
+    download = mocker.spy(transfer, 'download_with_checksum')
+    path = engine.download(checksum_file, tmp_path / 'second')
+    download.assert_not_called()
+    assert path.read_bytes() == (DATA_DIR / 'test.txt').read_bytes()
+    assert engine.metrics.cache_hits == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_upload_links_identical_file(checksum_file: ChecksumFile, tmp_path: Path):
+    checksum_file.checksum = compute_checksum(DATA_DIR / 'test.txt')
+    checksum_file.save()
+
+    path = tmp_path / 'test.txt'
+    path.write_bytes((DATA_DIR / 'test.txt').read_bytes())
+
+    engine = TransferEngine()
+    link_from = ChecksumFile.objects.filter(pk=checksum_file.pk)
+    assert engine.upload(path, checksum_file.name, link_from=link_from) == (checksum_file, False)
+
+    # Assert files outside of those searched are never linked
+    uploaded, was_uploaded = engine.upload(path, checksum_file.name)
+    assert was_uploaded
+    assert uploaded.pk != checksum_file.pk
+
+    # Assert different content under the same name is uploaded
+    path.write_text('Changed')
+    uploaded, was_uploaded = engine.upload(path, checksum_file.name, link_from=link_from)
+    assert was_uploaded
+    assert uploaded.pk != checksum_file.pk
+    assert uploaded.checksum == compute_checksum(path)
+    assert engine.metrics.as_dict()['files_linked'] == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_watcher_retries_files_not_added(dataset: Dataset, tmp_path: Path, mocker):
+    (tmp_path / 'output.txt').write_text('Output')
+    output_dataset = mocker.Mock(side_effect=[OSError('Failed'), dataset])
+    watcher = OutputWatcher(tmp_path, output_dataset)
+
+    # Assert a file uploaded by a failed scan isn't recorded, and is added by the next scan
+    with pytest.raises(OSError):
+        watcher.scan(final=True)
+    assert not watcher.uploaded
+
+    added = watcher.scan(final=True)
+    assert [f.name for f in added] == ['output.txt']
+    assert dataset.files.filter(name='output.txt').exists()
+
+    # Assert the file is uploaded again into the same checksum file
+    assert watcher.engine.metrics.files_uploaded == 2
+    assert ChecksumFile.objects.filter(name='output.txt').count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_watcher_removes_deleted_files(dataset: Dataset, tmp_path: Path):
+    (tmp_path / 'kept.txt').write_text('Kept')
+    (tmp_path / 'temp.txt').write_text('Temporary')
+    watcher = OutputWatcher(tmp_path, lambda: dataset)
+
+    # Files are uploaded once unchanged between two scans
+    watcher.scan()
+    assert len(watcher.scan()) == 2
+    temp = dataset.files.get(name='temp.txt')
+
+    # Assert a file deleted after being uploaded is removed once the watcher stops
+    (tmp_path / 'temp.txt').unlink()
+    watcher.stop()
+    assert set(dataset.files.values_list('name', flat=True)) >= {'kept.txt'}
+    assert not dataset.files.filter(name='temp.txt').exists()
+    assert not ChecksumFile.objects.filter(pk=temp.pk).exists()
+    assert tmp_path / 'temp.txt' not in watcher.uploaded
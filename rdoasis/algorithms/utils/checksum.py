@@ -0,0 +1,76 @@
+import contextlib
+import hashlib
+from pathlib import Path
+from typing import BinaryIO, Iterator, Union
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from django.db.models import Q
+from rgd.models import ChecksumFile
+from rgd.utility import get_s3_client
+
+# The size of the chunks files are read in
+CHUNK_SIZE = 1024 * 1024
+
+
+class ChecksumMismatchError(ValueError):
+    """Raised when a downloaded file doesn't match its recorded checksum."""
+
+
+def compute_checksum(path: Union[str, Path]) -> str:
+    """Return the SHA-512 hex digest of a local file, matching the checksums computed by rgd."""
+    sha512 = hashlib.sha512()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha512.update(chunk)
+
+    return sha512.hexdigest()
+
+
+@contextlib.contextmanager
+def open_url(url: str) -> Iterator[BinaryIO]:
+    """
+    Open a stream of the content of a URL.
+
+    Along with the schemes supported by urllib, `s3://` URLs are read from S3, as rgd reads them.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 's3':
+        body = get_s3_client().get_object(
+            Bucket=parsed.netloc, Key=parsed.path.lstrip('/'), RequestPayer='requester'
+        )['Body']
+        with contextlib.closing(body):
+            yield body
+    else:
+        with urlopen(url) as response:
+            yield response
+
+
+def download_with_checksum(checksum_file: ChecksumFile, directory: Union[str, Path]) -> Path:
+    """
+    Download a checksum file into a directory, verifying its checksum as it's downloaded.
+
+    The file is streamed directly from its URL, and hashed in the same pass. If the file has no
+    checksum yet, the computed checksum is saved. Returns the path of the downloaded file.
+    """
+    path = Path(directory) / checksum_file.name
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    sha512 = hashlib.sha512()
+    with open_url(checksum_file.get_url(internal=True)) as response, open(path, 'wb') as f:
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            sha512.update(chunk)
+            f.write(chunk)
+
+    checksum = sha512.hexdigest()
+    if checksum_file.checksum and checksum_file.checksum != checksum:
+        path.unlink()
+        raise ChecksumMismatchError(f'Checksum mismatch downloading {checksum_file.name}')
+
+    if not checksum_file.checksum:
+        checksum_file.checksum = checksum
+        ChecksumFile.objects.filter(
+            Q(checksum='') | Q(checksum__isnull=True), pk=checksum_file.pk
+        ).update(checksum=checksum)
+
+    return path
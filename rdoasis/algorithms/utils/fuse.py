@@ -0,0 +1,32 @@
+import os
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+# The root of the simple_httpfs mounts, as created by fuse.sh
+FUSE_ROOT = Path('/tmp/rgd')
+
+# The longest file name allowed in a single path component
+NAME_MAX = 255
+
+
+def url_to_fuse_path(url: str) -> Optional[Path]:
+    """
+    Return the path of a URL within the simple_httpfs mounts, if its scheme is mounted.
+
+    Reads from the returned path are served with ranged requests as they occur, through the block
+    cache of simple_httpfs, instead of downloading the whole file up front. The URL must not
+    expire while the path is in use, and no component of the path may exceed ``NAME_MAX`` bytes,
+    otherwise ``None`` is returned.
+    """
+    parsed = urlparse(url)
+    mount = FUSE_ROOT / parsed.scheme
+    if not parsed.scheme or not os.path.ismount(mount):
+        return None
+
+    # simple_httpfs identifies files by a trailing '..'
+    path = mount / f'{url.split("://", 1)[1]}..'
+    if any(len(part.encode()) > NAME_MAX for part in path.parts):
+        return None
+
+    return path
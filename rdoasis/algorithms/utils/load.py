@@ -0,0 +1,280 @@
+"""Generate synthetic traffic against the REST API, and summarize its latency."""
+
+import base64
+from collections import defaultdict
+import hashlib
+import json
+import math
+import os
+import random
+import secrets
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import transaction
+from rgd.models import ChecksumFile
+
+from rdoasis.algorithms.models import Algorithm, AlgorithmTask, Dataset, DockerImage
+
+# The relative weight of each endpoint in the default traffic mix
+DEFAULT_MIX = {
+    'datasets': 20,
+    'tree': 20,
+    'files': 20,
+    'download': 5,
+    'logs': 30,
+    'run': 5,
+}
+
+# The number of top level folders the files of each synthetic dataset are spread across
+NUM_FOLDERS = 10
+
+
+class SyntheticData(NamedTuple):
+    prefix: str
+    username: str
+    password: str
+    datasets: List[int]
+    algorithms: List[int]
+    tasks: List[int]
+
+
+def create_synthetic_data(
+    num_datasets: int,
+    num_files: int,
+    num_algorithms: int,
+    num_tasks: int,
+    log_lines: int = 1000,
+    file_size: int = 1024,
+) -> SyntheticData:
+    """
+    Create a user, and datasets, algorithms and finished tasks for it to request.
+
+    The files of every dataset refer to a single stored object, so that large datasets can be
+    created without uploading each file. All objects are named with a common random prefix, which
+    `delete_synthetic_data` uses to find them, including any tasks later created by the traffic.
+    """
+    prefix = f'load-test-{secrets.token_hex(4)}'
+    password = secrets.token_urlsafe()
+    user = User.objects.create_user(
+        username=prefix, email=f'{prefix}@example.com', password=password
+    )
+
+    data = os.urandom(file_size)
+    stored = ChecksumFile.objects.create(
+        name=f'{prefix}/file.bin', file=ContentFile(data, name=f'{prefix}.bin')
+    )
+    checksum = hashlib.sha512(data).hexdigest()
+
+    with transaction.atomic():
+        datasets: List[Dataset] = []
+        for index in range(num_datasets):
+            # The size is maintained by register_files, so is never computed from storage
+            dataset = Dataset.objects.create(name=f'{prefix}-dataset-{index}', size=0)
+            dataset.register_files(
+                (
+                    {
+                        's3_key': stored.file.name,
+                        'name': f'folder-{i % NUM_FOLDERS}/file-{i}.bin',
+                        'size': file_size,
+                        'checksum': checksum,
+                    }
+                    for i in range(num_files)
+                ),
+                created_by=user,
+            )
+            datasets.append(dataset)
+
+        docker_image = DockerImage.objects.create(name=prefix, image_id='hello-world')
+        algorithms = [
+            Algorithm.objects.create(name=f'{prefix}-algorithm-{index}', docker_image=docker_image)
+            for index in range(num_algorithms)
+        ]
+
+        log = ''.join(f'Synthetic log line {line}\n' for line in range(log_lines))
+        tasks = AlgorithmTask.objects.bulk_create(
+            [
+                AlgorithmTask(
+                    algorithm=algorithms[index % num_algorithms],
+                    input_dataset=datasets[index % num_datasets],
+                    status=AlgorithmTask.Status.SUCCEEDED,
+                    output_log=log,
+                )
+                for index in range(num_tasks)
+            ]
+        )
+
+    return SyntheticData(
+        prefix=prefix,
+        username=user.username,
+        password=password,
+        datasets=[dataset.pk for dataset in datasets],
+        algorithms=[algorithm.pk for algorithm in algorithms],
+        tasks=[task.pk for task in tasks],
+    )
+
+
+def delete_synthetic_data(prefix: str):
+    """Delete all objects created by `create_synthetic_data` with the given prefix."""
+    tasks = AlgorithmTask.objects.filter(algorithm__name__startswith=prefix)
+    dataset_ids = set(Dataset.objects.filter(name__startswith=prefix).values_list('pk', flat=True))
+    dataset_ids.update(tasks.exclude(output_dataset=None).values_list('output_dataset', flat=True))
+    tasks.delete()
+
+    # Output files may have been linked to existing files, which must be kept if used elsewhere
+    ChecksumFile.objects.filter(datasets__in=dataset_ids).exclude(
+        datasets__in=Dataset.objects.exclude(pk__in=dataset_ids)
+    ).distinct().delete()
+    Dataset.objects.filter(pk__in=dataset_ids).delete()
+    ChecksumFile.objects.filter(name__startswith=f'{prefix}/').delete()
+    DockerImage.objects.filter(name=prefix).delete()
+    User.objects.filter(username=prefix).delete()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the q-th percentile of sorted values, by the nearest rank method."""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class LatencyStats:
+    """Thread-safe collection of the latency of each request, by endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def add(self, endpoint: str, seconds: float, ok: bool = True):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, elapsed: float) -> List[Dict]:
+        """Return the request count, error count, throughput and latency of each endpoint."""
+        latencies = dict(self.latencies)
+        latencies['total'] = [seconds for values in self.latencies.values() for seconds in values]
+        errors = dict(self.errors, total=sum(self.errors.values()))
+
+        rows = []
+        for endpoint, values in latencies.items():
+            if not values:
+                continue
+
+            values = sorted(values)
+            rows.append(
+                {
+                    'endpoint': endpoint,
+                    'requests': len(values),
+                    'errors': errors.get(endpoint, 0),
+                    'rps': len(values) / elapsed,
+                    'p50': percentile(values, 50),
+                    'p90': percentile(values, 90),
+                    'p99': percentile(values, 99),
+                    'max': values[-1],
+                }
+            )
+
+        return rows
+
+
+class LoadGenerator:
+    """Send a weighted mix of API requests for synthetic data, from concurrent workers."""
+
+    def __init__(
+        self,
+        base_url: str,
+        data: SyntheticData,
+        mix: Optional[Dict[str, int]] = None,
+        concurrency: int = 8,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.data = data
+        self.mix = mix if mix is not None else DEFAULT_MIX
+        self.concurrency = concurrency
+        self.stats = LatencyStats()
+
+        credentials = base64.b64encode(f'{data.username}:{data.password}'.encode()).decode()
+        self.headers = {'Authorization': f'Basic {credentials}'}
+
+    def request(self, endpoint: str) -> Request:
+        """Return a request to a random synthetic object, of the given kind."""
+        dataset = random.choice(self.data.datasets)
+        if endpoint == 'datasets':
+            return self._get('/api/datasets/', limit=100)
+        if endpoint == 'tree':
+            folder = random.choice(['', *(f'folder-{i}/' for i in range(NUM_FOLDERS))])
+            return self._get(f'/api/datasets/{dataset}/tree/', path_prefix=folder)
+        if endpoint == 'files':
+            return self._get(f'/api/datasets/{dataset}/files/', limit=100)
+        if endpoint == 'download':
+            return self._get(f'/api/datasets/{dataset}/download/')
+        if endpoint == 'logs':
+            task = random.choice(self.data.tasks)
+            return self._get(f'/api/algorithm_tasks/{task}/logs/', tail=100)
+        if endpoint == 'run':
+            algorithm = random.choice(self.data.algorithms)
+            return Request(
+                f'{self.base_url}/api/algorithms/{algorithm}/run/',
+                data=json.dumps({'input_dataset': dataset}).encode(),
+                headers={**self.headers, 'Content-Type': 'application/json'},
+                method='POST',
+            )
+
+        raise ValueError(f'Unknown endpoint: {endpoint}')
+
+    def _get(self, path: str, **params) -> Request:
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        return Request(f'{self.base_url}{path}?{query}', headers=self.headers)
+
+    def send(self, endpoint: str):
+        """Send a request, recording the time taken to read the entire response."""
+        start = time.monotonic()
+        try:
+            with urlopen(self.request(endpoint)) as response:
+                while response.read(1024 * 1024):
+                    pass
+            ok = True
+        except (HTTPError, URLError):
+            ok = False
+
+        self.stats.add(endpoint, time.monotonic() - start, ok)
+
+    def run(self, duration: Optional[float] = None, num_requests: Optional[int] = None) -> float:
+        """
+        Send requests until the duration has elapsed or the number of requests has been sent.
+
+        Returns the elapsed time, in seconds.
+        """
+        if duration is None and num_requests is None:
+            raise ValueError('Either a duration or a number of requests is required.')
+
+        endpoints = list(self.mix)
+        weights = [self.mix[endpoint] for endpoint in endpoints]
+        remaining = num_requests
+        lock = threading.Lock()
+        start = time.monotonic()
+
+        def worker():
+            nonlocal remaining
+            while duration is None or time.monotonic() - start < duration:
+                if remaining is not None:
+                    with lock:
+                        if remaining <= 0:
+                            return
+                        remaining -= 1
+
+                self.send(random.choices(endpoints, weights)[0])
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return time.monotonic() - start
@@ -0,0 +1,94 @@
+import os
+
+from django.conf import settings
+from django.db.models import Count
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.exposition import push_to_gateway, start_http_server
+
+# Buckets for durations ranging from seconds to hours, such as waiting for and running tasks
+LONG_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 21600, float('inf'))
+
+TASKS_DISPATCHED = Counter(
+    'rdoasis_tasks_dispatched', 'Algorithm task runs dispatched, by runner', ['runner']
+)
+TASK_DISPATCH_SECONDS = Histogram(
+    'rdoasis_task_dispatch_seconds', 'Time taken to create an algorithm task and dispatch its runs'
+)
+TASK_QUEUE_SECONDS = Histogram(
+    'rdoasis_task_queue_seconds',
+    'Time between an algorithm task run being dispatched and starting',
+    buckets=LONG_BUCKETS,
+)
+TASKS_FINISHED = Counter(
+    'rdoasis_tasks_finished', 'Algorithm task runs finished, by status', ['status']
+)
+TASK_RUN_SECONDS = Histogram(
+    'rdoasis_task_run_seconds',
+    'Duration of algorithm task runs, by status',
+    ['status'],
+    buckets=LONG_BUCKETS,
+)
+TRANSFER_BYTES = Counter(
+    'rdoasis_transfer_bytes', 'Bytes of task input and output transferred', ['direction']
+)
+TRANSFER_SECONDS = Histogram(
+    'rdoasis_transfer_seconds', 'Duration of task input and output file transfers', ['direction']
+)
+# Each save writes the whole log, so this grows with the square of the log length
+LOG_FLUSH_CHARACTERS = Counter(
+    'rdoasis_log_flush_characters',
+    'Characters of algorithm output logs written to the database, by runner',
+    ['runner'],
+)
+LOG_FLUSHES = Counter(
+    'rdoasis_log_flushes', 'Saves of algorithm output logs, by runner', ['runner']
+)
+ZIP_STREAM_BYTES = Counter('rdoasis_zip_stream_bytes', 'Bytes of zipped datasets streamed')
+DATASET_SIZE_SECONDS = Histogram(
+    'rdoasis_dataset_size_seconds', 'Duration of dataset size computations'
+)
+K8S_API_SECONDS = Histogram('rdoasis_k8s_api_seconds', 'Latency of k8s API calls', ['call'])
+
+
+class TaskStatusCollector:
+    """Report the number of algorithm tasks in each status, counted when metrics are collected."""
+
+    def collect(self):
+        # Prevent circular import
+        from rdoasis.algorithms.models import AlgorithmTask
+
+        counts = dict(
+            AlgorithmTask.objects.order_by().values_list('status').annotate(count=Count('pk'))
+        )
+        tasks = GaugeMetricFamily('rdoasis_tasks', 'Algorithm tasks, by status', labels=['status'])
+        for status in AlgorithmTask.Status.values:
+            tasks.add_metric([status], counts.get(status, 0))
+
+        yield tasks
+
+
+def get_registry() -> CollectorRegistry:
+    """
+    Return the registry of metrics to expose.
+
+    If PROMETHEUS_MULTIPROC_DIR is set, as is required for multiple gunicorn or celery worker
+    processes, this collects the metrics of every process. Otherwise, only those of this process.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def start_metrics_server(port: int):
+    """Expose metrics over HTTP from a background thread, such as for a celery worker."""
+    start_http_server(port, registry=get_registry())
+
+
+def push_metrics(job: str):
+    """Push the metrics of this process to the configured pushgateway, if any."""
+    if settings.METRICS_PUSHGATEWAY_URL:
+        push_to_gateway(settings.METRICS_PUSHGATEWAY_URL, job=job, registry=REGISTRY)
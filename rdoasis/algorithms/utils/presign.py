@@ -0,0 +1,14 @@
+from typing import Dict, Iterable
+
+from rgd.models import ChecksumFile
+
+
+def presign_keys(keys: Iterable[str]) -> Dict[str, str]:
+    """
+    Return a presigned download URL for each of the given keys in the file storage.
+
+    URLs are signed locally by the storage backend, with a single storage instance, so no request
+    is made to the storage service and no file object is constructed for each key.
+    """
+    storage = ChecksumFile._meta.get_field('file').storage
+    return {key: storage.url(key) for key in keys}
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+import threading
+import time
+from typing import Iterator, Union
+
+from django.utils import timezone
+
+from rdoasis.algorithms.models import AlgorithmTask, AlgorithmTaskShard
+from rdoasis.algorithms.utils.tracing import tracer
+from rdoasis.algorithms.utils.transfer import TransferMetrics
+
+
+class Timeline:
+    """
+    Record where the time of a task run goes, in the timeline of the task or shard being run.
+
+    Each phase is recorded as its duration in seconds, under `<phase>_seconds`, alongside other
+    measurements such as the number of bytes transferred. Every recording is saved immediately, so
+    that runs split between processes (such as the k8s sidecars) each add to the same timeline.
+    """
+
+    def __init__(self, target: Union[AlgorithmTask, AlgorithmTaskShard]):
+        self.target = target
+        self._lock = threading.Lock()
+
+    def record(self, **values):
+        with self._lock:
+            self.target.timeline.update(values)
+            self.target.save(update_fields=['timeline'])
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Record the duration of a phase, which is also traced as a span."""
+        start = time.monotonic()
+        try:
+            with tracer.start_as_current_span(name):
+                yield
+        finally:
+            self.record(**{f'{name}_seconds': round(time.monotonic() - start, 3)})
+
+    def record_queue_wait(self) -> float:
+        """Record the time between the creation of the task or shard, and the start of its run."""
+        queued = (timezone.now() - self.target.created).total_seconds()
+        self.record(queue_seconds=round(queued, 3))
+        return queued
+
+    def record_downloads(self, metrics: TransferMetrics):
+        self.record(
+            input_files=metrics.files_downloaded + metrics.cache_hits,
+            input_bytes=metrics.bytes_downloaded,
+            input_cache_hits=metrics.cache_hits,
+        )
+
+    def record_uploads(self, metrics: TransferMetrics):
+        # Output is uploaded while the algorithm runs, so this overlaps the container runtime
+        self.record(
+            output_files=metrics.files_uploaded,
+            output_linked_files=metrics.files_linked,
+            output_bytes=metrics.bytes_uploaded,
+            output_upload_seconds=round(metrics.upload_seconds, 3),
+        )
@@ -0,0 +1,83 @@
+import os
+from typing import Dict, Mapping, Optional
+
+from opentelemetry import context, propagate, trace
+from opentelemetry.context import Context
+
+# The environment variables carrying trace context into the k8s sidecar containers
+TRACE_CONTEXT_ENV_VARS = {'traceparent': 'TRACEPARENT', 'tracestate': 'TRACESTATE'}
+
+tracer = trace.get_tracer('rdoasis.algorithms')
+
+
+def configure_tracing(service_name: str):
+    """
+    Export spans over OTLP, if the OpenTelemetry SDK is installed and an endpoint is configured.
+
+    The exporter is configured by the standard OTEL_EXPORTER_OTLP_* environment variables. Without
+    them, spans are not recorded, and only trace context is propagated.
+    """
+    if not os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT'):
+        return
+
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        return
+
+    provider = TracerProvider(resource=Resource.create({'service.name': service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+def flush_tracing():
+    """Export any pending spans, before a short lived process exits."""
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, 'force_flush'):
+        provider.force_flush()
+
+
+def inject_trace_context() -> Dict[str, str]:
+    """Return the current trace context, as headers to propagate it with."""
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract_trace_context(carrier: Optional[Mapping[str, str]]) -> Context:
+    return propagate.extract(dict(carrier or {}))
+
+
+def celery_trace_context(request) -> Context:
+    """Return the trace context propagated in the headers of a celery task request."""
+    # Custom headers are set as attributes of the request, or kept in its headers when run eagerly
+    carrier = dict(getattr(request, 'headers', None) or {})
+    for header in TRACE_CONTEXT_ENV_VARS:
+        value = getattr(request, header, None)
+        if value:
+            carrier[header] = value
+
+    return extract_trace_context(carrier)
+
+
+def trace_context_env() -> Dict[str, str]:
+    """Return the current trace context, as environment variables for a sidecar container."""
+    carrier = inject_trace_context()
+    return {
+        env_var: carrier[header]
+        for header, env_var in TRACE_CONTEXT_ENV_VARS.items()
+        if header in carrier
+    }
+
+
+def attach_env_trace_context():
+    """Continue the trace propagated to this process in its environment variables."""
+    carrier = {
+        header: os.environ[env_var]
+        for header, env_var in TRACE_CONTEXT_ENV_VARS.items()
+        if os.environ.get(env_var)
+    }
+    context.attach(extract_trace_context(carrier))
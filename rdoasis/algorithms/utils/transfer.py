@@ -0,0 +1,227 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar, Union
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.files import File
+from django.db import connection
+from django.db.models import QuerySet
+from rgd.models import ChecksumFile, FileSourceType
+from rgd.models.mixins import Status
+
+from rdoasis.algorithms.utils.checksum import (
+    ChecksumMismatchError,
+    compute_checksum,
+    download_with_checksum,
+)
+from rdoasis.algorithms.utils.metrics import TRANSFER_BYTES, TRANSFER_SECONDS
+
+logger = get_task_logger(__name__)
+
+T = TypeVar('T')
+
+
+class TransferMetrics:
+    """Totals of the transfers performed by a transfer engine, safe to update from any thread."""
+
+    FIELDS = (
+        'files_downloaded',
+        'bytes_downloaded',
+        'download_seconds',
+        'files_uploaded',
+        'bytes_uploaded',
+        'upload_seconds',
+        'files_linked',
+        'cache_hits',
+        'retries',
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, **amounts: Union[int, float]):
+        with self._lock:
+            for field, amount in amounts.items():
+                setattr(self, field, getattr(self, field) + amount)
+
+    def as_dict(self) -> Dict[str, Union[int, float]]:
+        with self._lock:
+            return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class TransferEngine:
+    """
+    Move checksum files between storage and the local disk, for the algorithm task runners.
+
+    Downloads are verified against the checksum of each file, and may be run concurrently. Failed
+    transfers are retried with exponential backoff. If a cache dir is set, downloaded files are
+    kept there by checksum, and later downloads of the same content are linked from it. Uploads of
+    content already stored under the same name are linked to the existing checksum file instead.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        retries: int = 2,
+        retry_delay: float = 1,
+        cache_dir: Optional[Union[str, Path]] = None,
+        metrics: Optional[TransferMetrics] = None,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.metrics = metrics if metrics is not None else TransferMetrics()
+
+    @classmethod
+    def from_settings(cls, metrics: Optional[TransferMetrics] = None) -> 'TransferEngine':
+        """Return a transfer engine configured by the TRANSFER_* settings."""
+        return cls(
+            max_workers=settings.TRANSFER_MAX_WORKERS,
+            retries=settings.TRANSFER_RETRIES,
+            retry_delay=settings.TRANSFER_RETRY_DELAY,
+            cache_dir=settings.TRANSFER_CACHE_DIR,
+            metrics=metrics,
+        )
+
+    def _with_retries(self, func: Callable[[], T], description: str) -> T:
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except (OSError, ChecksumMismatchError) as e:
+                if attempt >= self.retries:
+                    raise
+
+                delay = self.retry_delay * 2**attempt
+                logger.warning(f'Retrying {description} in {delay}s, after error: {e}')
+                self.metrics.add(retries=1)
+                time.sleep(delay)
+                attempt += 1
+
+    def _cache_path(self, checksum: str) -> Path:
+        return self.cache_dir / checksum[:2] / checksum
+
+    @staticmethod
+    def _link(source: Path, destination: Path):
+        """Hard link a file, falling back to a copy across file systems."""
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+    def download(self, checksum_file: ChecksumFile, directory: Union[str, Path]) -> Path:
+        """Download a checksum file into a directory, returning the path of the downloaded file."""
+        if self.cache_dir is not None and checksum_file.checksum:
+            cached = self._cache_path(checksum_file.checksum)
+            if cached.is_file():
+                path = Path(directory) / checksum_file.name
+                self._link(cached, path)
+                self.metrics.add(cache_hits=1)
+                return path
+
+        start = time.monotonic()
+        path = self._with_retries(
+            lambda: download_with_checksum(checksum_file, directory), f'download of {checksum_file}'
+        )
+        size, seconds = path.stat().st_size, time.monotonic() - start
+        self.metrics.add(files_downloaded=1, bytes_downloaded=size, download_seconds=seconds)
+        TRANSFER_BYTES.labels('download').inc(size)
+        TRANSFER_SECONDS.labels('download').observe(seconds)
+
+        if self.cache_dir is not None:
+            cached = self._cache_path(checksum_file.checksum)
+            if not cached.exists():
+                # Link into place atomically, since other tasks may share the cache
+                partial = cached.with_name(f'{cached.name}.{threading.get_ident()}.partial')
+                self._link(path, partial)
+                os.replace(partial, cached)
+
+        return path
+
+    def _download_in_thread(self, checksum_file: ChecksumFile, directory: Union[str, Path]) -> Path:
+        try:
+            return self.download(checksum_file, directory)
+        finally:
+            # Each worker thread has its own database connection
+            connection.close()
+
+    def download_all(
+        self, files: Iterable[ChecksumFile], directory: Union[str, Path]
+    ) -> Iterator[Tuple[ChecksumFile, Path]]:
+        """
+        Download checksum files into a directory, yielding each file and its path once downloaded.
+
+        Files are downloaded by up to `max_workers` threads, and yielded in order of completion.
+        """
+        if self.max_workers == 1:
+            for checksum_file in files:
+                yield checksum_file, self.download(checksum_file, directory)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._download_in_thread, checksum_file, directory): checksum_file
+                for checksum_file in files
+            }
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                # Don't start any remaining downloads if one failed
+                for future in futures:
+                    future.cancel()
+
+    def upload(
+        self,
+        path: Path,
+        name: str,
+        replace: Optional[ChecksumFile] = None,
+        link_from: Optional[QuerySet] = None,
+    ) -> Tuple[ChecksumFile, bool]:
+        """
+        Upload a local file as a checksum file, unless identical content is already stored.
+
+        A checksum file of `link_from` with the same name and checksum is returned in place of
+        uploading. Only these files are searched, since checksums aren't indexed. Otherwise, the
+        contents of `replace` are replaced if it's provided, or a new checksum file is created.
+        Returns the checksum file, and whether the file was uploaded.
+        """
+        checksum = compute_checksum(path)
+        if link_from is not None:
+            existing = (
+                link_from.filter(name=name, checksum=checksum, type=FileSourceType.FILE_FIELD)
+                .order_by('pk')
+                .first()
+            )
+            if existing is not None:
+                self.metrics.add(files_linked=1)
+                return existing, False
+
+        checksum_file = replace if replace is not None else ChecksumFile(name=name)
+
+        def upload():
+            with open(path, 'rb') as f:
+                checksum_file.file.save(name, File(f), save=False)
+
+        start = time.monotonic()
+        self._with_retries(upload, f'upload of {name}')
+
+        # The checksum is already known, so there is no post save work to do
+        checksum_file.checksum = checksum
+        checksum_file.status = Status.SKIPPED
+        checksum_file.save()
+
+        size, seconds = path.stat().st_size, time.monotonic() - start
+        self.metrics.add(files_uploaded=1, bytes_uploaded=size, upload_seconds=seconds)
+        TRANSFER_BYTES.labels('upload').inc(size)
+        TRANSFER_SECONDS.labels('upload').observe(seconds)
+        return checksum_file, True
@@ -0,0 +1,178 @@
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from celery.utils.log import get_task_logger
+from django.db import connection
+from django.db.models import QuerySet
+from rgd.models import ChecksumFile
+
+from rdoasis.algorithms.models import Dataset
+from rdoasis.algorithms.utils.transfer import TransferEngine
+
+logger = get_task_logger(__name__)
+
+# The size and modification time of a file
+FileState = Tuple[int, int]
+
+
+class UploadedFile(NamedTuple):
+    checksum_file: ChecksumFile
+    state: FileState
+
+    # Whether the checksum file was created by this watcher, rather than linked to an existing one
+    owned: bool
+
+
+class OutputWatcher:
+    """
+    Upload the files written to an output directory as they are completed.
+
+    While running, the directory is scanned periodically in a background thread, and each file is
+    uploaded once its size and modification time are unchanged between two scans. Stopping the
+    watcher performs a final scan, which uploads all remaining files, re-uploads any that were
+    modified after being uploaded, and removes any that were deleted after being uploaded.
+
+    Files identical to a checksum file of the same name in `link_from`, such as unchanged copies of
+    input files, are linked to it instead of being uploaded again.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        output_dataset: Callable[[], Dataset],
+        engine: Optional[TransferEngine] = None,
+        interval: float = 5,
+        prefix: str = '',
+        link_from: Optional[QuerySet] = None,
+    ):
+        self.output_dir = output_dir
+        self.engine = engine if engine is not None else TransferEngine()
+
+        # Return the dataset to add files to, creating it only once there is output to upload
+        self.output_dataset = output_dataset
+        self.interval = interval
+
+        # Prepended to the name of each file, relative to the output directory
+        self.prefix = prefix
+        self.link_from = link_from
+
+        self.uploaded: Dict[Path, UploadedFile] = {}
+
+        # Files uploaded by a scan which failed before adding them to the output dataset
+        self._not_added: Dict[Path, UploadedFile] = {}
+        self._pending: Dict[Path, FileState] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _upload(self, path: Path, state: FileState) -> UploadedFile:
+        """Upload or link a file, returning the checksum file that now represents it."""
+        name = f'{self.prefix}{path.relative_to(self.output_dir).as_posix()}'
+        previous = self._not_added.get(path) or self.uploaded.get(path)
+
+        # Replace the contents of a previous upload, but never those of a linked file
+        replace = previous.checksum_file if previous is not None and previous.owned else None
+        checksum_file, uploaded = self.engine.upload(
+            path, name, replace=replace, link_from=self.link_from
+        )
+
+        owned = uploaded or (replace is not None and replace.pk == checksum_file.pk)
+        self._not_added[path] = UploadedFile(checksum_file, state, owned)
+        return self._not_added[path]
+
+    def scan(self, final: bool = False) -> List[ChecksumFile]:
+        """Upload every completed file, returning those newly added to the output dataset."""
+        uploads: Dict[Path, UploadedFile] = {}
+        found: Set[Path] = set()
+        for root, _, files in os.walk(self.output_dir):
+            for filename in files:
+                path = Path(root) / filename
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+
+                found.add(path)
+
+                # Skip files which are unchanged since they were uploaded
+                state = (stat.st_size, stat.st_mtime_ns)
+                previous = self.uploaded.get(path)
+                if previous is not None and previous.state == state:
+                    continue
+
+                # Wait for files to stop changing, unless the algorithm has exited
+                if not final and self._pending.get(path) != state:
+                    self._pending[path] = state
+                    continue
+
+                self._pending.pop(path, None)
+                uploads[path] = self._upload(path, state)
+
+        added: List[ChecksumFile] = []
+        removed: List[ChecksumFile] = []
+        for path, upload in uploads.items():
+            previous = self.uploaded.get(path)
+            if previous is None or previous.checksum_file.pk != upload.checksum_file.pk:
+                added.append(upload.checksum_file)
+                if previous is not None:
+                    removed.append(previous.checksum_file)
+
+        if added:
+            output_dataset = self.output_dataset()
+            output_dataset.files.remove(*removed)
+            output_dataset.files.add(*added)
+
+        # Files are only recorded as uploaded once they're in the output dataset
+        self.uploaded.update(uploads)
+        for path in uploads:
+            del self._not_added[path]
+
+        # Only files present once the algorithm has exited are kept
+        if final:
+            self._remove_deleted(found)
+
+        return added
+
+    def _remove_deleted(self, found: Set[Path]):
+        """Remove uploaded files which no longer exist from the output dataset."""
+        deleted = [path for path in self.uploaded if path not in found]
+        if deleted:
+            self.output_dataset().files.remove(
+                *(self.uploaded[path].checksum_file for path in deleted)
+            )
+
+        # Delete the checksum files created by this watcher, but never those linked to
+        removed = [self.uploaded.pop(path) for path in deleted]
+        removed.extend(
+            self._not_added.pop(path) for path in list(self._not_added) if path not in found
+        )
+        ChecksumFile.objects.filter(
+            pk__in={upload.checksum_file.pk for upload in removed if upload.owned}
+        ).delete()
+
+    def _watch(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    self.scan()
+                except Exception:
+                    # Files not yet added to the output dataset are uploaded again by later scans
+                    logger.exception(f'Error uploading output files from {self.output_dir}')
+        finally:
+            # This runs in its own thread, with its own database connection
+            connection.close()
+
+    def start(self):
+        """Start uploading files in the background."""
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self, upload: bool = True) -> List[ChecksumFile]:
+        """Stop watching the output directory, then upload all remaining files if requested."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        return self.scan(final=True) if upload else []
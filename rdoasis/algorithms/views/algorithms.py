@@ -1,24 +1,32 @@
+import json
+
+from django.db.models import Count, Prefetch
 from django.db.utils import DatabaseError
 from django.utils.encoding import smart_str
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import renderers
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework_extensions.mixins import NestedViewSetMixin
-from rgd.models import ChecksumFile
-from rgd.serializers import (
-    ChecksumFilePathQuerySerializer,
-    ChecksumFilePathsSerializer,
-    ChecksumFileSerializer,
+from rgd.models import ChecksumFile, FileSourceType
+from rgd.serializers import ChecksumFilePathQuerySerializer, ChecksumFilePathsSerializer
+
+from rdoasis.algorithms.models import (
+    Algorithm,
+    AlgorithmTask,
+    AlgorithmTaskShard,
+    Dataset,
+    DockerImage,
 )
-
-from rdoasis.algorithms.models import Algorithm, AlgorithmTask, Dataset, DockerImage
-from rdoasis.algorithms.views.utils import paginate_action
+from rdoasis.algorithms.utils.presign import presign_keys
+from rdoasis.algorithms.views.streaming import async_streaming, follow_log_response
+from rdoasis.algorithms.views.utils import KeysetPaginationMixin, paginate_action
 
 from .serializers import (
     AlgorithmQuerySerializer,
@@ -27,13 +35,21 @@ from .serializers import (
     AlgorithmTaskLogsSerializer,
     AlgorithmTaskQuerySerializer,
     AlgorithmTaskSerializer,
+    DatasetDeriveSerializer,
+    DatasetFileSerializer,
     DatasetFilesUpdateSerializer,
+    DatasetFileUrlSerializer,
     DatasetListSerializer,
+    DatasetManifestSerializer,
     DatasetSerializer,
+    DatasetSummarySerializer,
     DockerImageSerializer,
-    LimitOffsetSerializer,
+    PaginationSerializer,
 )
 
+# Shard logs can be very large, and aren't included in the serialized task
+SHARDS_PREFETCH = Prefetch('shards', queryset=AlgorithmTaskShard.objects.defer('output_log'))
+
 
 class PlainTextRenderer(renderers.BaseRenderer):
     media_type = 'text/plain'
@@ -51,13 +67,13 @@ class ZipFileRenderer(renderers.BaseRenderer):
         return data
 
 
-class DockerImageViewSet(ModelViewSet):
+class DockerImageViewSet(KeysetPaginationMixin, ModelViewSet):
     queryset = DockerImage.objects.all()
     serializer_class = DockerImageSerializer
     pagination_class = LimitOffsetPagination
 
 
-class AlgorithmViewSet(ModelViewSet):
+class AlgorithmViewSet(KeysetPaginationMixin, ModelViewSet):
     queryset = Algorithm.objects.all()
     serializer_class = AlgorithmSerializer
     pagination_class = LimitOffsetPagination
@@ -89,14 +105,18 @@ class AlgorithmViewSet(ModelViewSet):
 
         return Response(AlgorithmTaskSerializer(algorithm_task).data)
 
-    @swagger_auto_schema(query_serializer=LimitOffsetSerializer())
+    @swagger_auto_schema(query_serializer=PaginationSerializer())
     @action(detail=True, methods=['GET'])
     @paginate_action(AlgorithmTaskSerializer)
     def tasks(self, request, pk):
-        return AlgorithmTask.objects.filter(algorithm__pk=pk)
+        return (
+            AlgorithmTask.objects.filter(algorithm__pk=pk)
+            .defer('output_log')
+            .prefetch_related(SHARDS_PREFETCH)
+        )
 
 
-class DatasetViewSet(ModelViewSet):
+class DatasetViewSet(KeysetPaginationMixin, ModelViewSet):
     serializer_class = DatasetSerializer
     pagination_class = LimitOffsetPagination
 
@@ -109,26 +129,81 @@ class DatasetViewSet(ModelViewSet):
         if not include_output_datasets:
             queryset = queryset.filter(output_tasks=None)
 
+        # Count files in the same query, instead of fetching every file ID per dataset
+        if self.action == 'list':
+            queryset = queryset.annotate(num_files=Count('files'))
+
         return queryset
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DatasetSummarySerializer
+
+        return DatasetSerializer
+
     @swagger_auto_schema(
-        query_serializer=DatasetListSerializer(), responses={200: DatasetSerializer(many=True)}
+        query_serializer=DatasetListSerializer(),
+        responses={200: DatasetSummarySerializer(many=True)},
     )
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
     @swagger_auto_schema(
-        query_serializer=LimitOffsetSerializer(), responses={200: ChecksumFileSerializer(many=True)}
+        query_serializer=PaginationSerializer(), responses={200: DatasetFileSerializer(many=True)}
     )
     @action(detail=True, methods=['GET'])
-    @paginate_action(ChecksumFileSerializer)
+    @paginate_action(DatasetFileSerializer)
     def files(self, request, pk: str):
         """Return the task output dataset as a list of files."""
-        dataset: Dataset = get_object_or_404(Dataset.objects.prefetch_related('files'), pk=pk)
+        dataset: Dataset = get_object_or_404(Dataset, pk=pk)
         queryset = dataset.files.all()
 
         return queryset
 
+    @swagger_auto_schema(
+        query_serializer=PaginationSerializer(),
+        responses={200: DatasetFileUrlSerializer(many=True)},
+    )
+    @action(detail=True, methods=['GET'])
+    def manifest(self, request, pk: str):
+        """
+        Return the name, checksum and download URL of each file in the dataset.
+
+        Stored files are given presigned URLs, signed together for each page of files, so that
+        clients can download files in parallel, directly from storage.
+        """
+        dataset: Dataset = get_object_or_404(Dataset, pk=pk)
+        queryset = dataset.files.order_by('pk').values(
+            'pk', 'name', 'checksum', 'type', 'file', 'url'
+        )
+
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        presigned_urls = presign_keys(
+            row['file'] for row in rows if row['type'] == FileSourceType.FILE_FIELD
+        )
+        serializer = DatasetFileUrlSerializer(
+            [
+                {
+                    'id': row['pk'],
+                    'name': row['name'],
+                    'checksum': row['checksum'],
+                    'url': (
+                        presigned_urls[row['file']]
+                        if row['type'] == FileSourceType.FILE_FIELD
+                        else row['url']
+                    ),
+                }
+                for row in rows
+            ],
+            many=True,
+        )
+
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+
+        return Response(serializer.data)
+
     @swagger_auto_schema(
         request_body=DatasetFilesUpdateSerializer(), responses={200: DatasetSerializer()}
     )
@@ -138,25 +213,104 @@ class DatasetViewSet(ModelViewSet):
         serializer = DatasetFilesUpdateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        insert = serializer.validated_data.get('insert')
-        delete = serializer.validated_data.get('delete')
-        dataset: Dataset = Dataset.objects.prefetch_related('files').get(id=pk)
-
-        # TODO: Currently, fires off two actions. Only one needs
-        # to be called after both add and remove are run.
-        if insert:
-            try:
-                dataset.files.add(*insert)
-            except DatabaseError as e:
-                return Response({'insert': str(e)}, status=HTTP_400_BAD_REQUEST)
-        if delete:
-            try:
-                dataset.files.remove(*delete)
-            except DatabaseError as e:
-                return Response({'delete': str(e)}, status=HTTP_400_BAD_REQUEST)
+        insert = serializer.validated_data.get('insert', [])
+        delete = serializer.validated_data.get('delete', [])
+        dataset: Dataset = get_object_or_404(Dataset, pk=pk)
+
+        try:
+            dataset.update_files(insert=insert, delete=delete)
+        except (ChecksumFile.DoesNotExist, DatabaseError) as e:
+            return Response({'insert': str(e)}, status=HTTP_400_BAD_REQUEST)
 
         return Response(DatasetSerializer(dataset).data)
 
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_STRING,
+            description=(
+                'Newline delimited JSON, where each line is an object '
+                'of the form {"insert": [...], "delete": [...]}'
+            ),
+        ),
+        responses={200: DatasetSummarySerializer()},
+    )
+    @action(detail=True, methods=['PUT'], url_path='files/stream')
+    def stream_update_files(self, request, pk: str):
+        """
+        Insert/Delete files into/from this Dataset, reading changes from the request as a stream.
+
+        Each line of the request body is applied in turn, without reading the entire body into
+        memory. All changes are applied atomically.
+        """
+        dataset: Dataset = get_object_or_404(Dataset, pk=pk)
+
+        def changes():
+            for line_number, line in enumerate(request.stream or [], start=1):
+                if not line.strip():
+                    continue
+
+                try:
+                    data = json.loads(line)
+                except ValueError as e:
+                    raise ValidationError({'line': line_number, 'error': str(e)})
+
+                serializer = DatasetFilesUpdateSerializer(data=data)
+                if not serializer.is_valid():
+                    raise ValidationError({'line': line_number, 'error': serializer.errors})
+
+                yield (
+                    serializer.validated_data.get('insert', []),
+                    serializer.validated_data.get('delete', []),
+                )
+
+        try:
+            dataset.apply_file_changes(changes())
+        except (ChecksumFile.DoesNotExist, DatabaseError) as e:
+            return Response({'insert': str(e)}, status=HTTP_400_BAD_REQUEST)
+
+        dataset = Dataset.objects.annotate(num_files=Count('files')).get(pk=dataset.pk)
+        return Response(DatasetSummarySerializer(dataset).data)
+
+    @swagger_auto_schema(
+        request_body=DatasetDeriveSerializer(), responses={200: DatasetSummarySerializer()}
+    )
+    @action(detail=False, methods=['POST'])
+    def derive(self, request):
+        """Create a Dataset from the union, intersection or difference of other Datasets."""
+        serializer = DatasetDeriveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        data = serializer.validated_data
+        dataset = Dataset.derive(
+            data['name'],
+            [source.pk for source in data['sources']],
+            operation=data['operation'],
+            include=data.get('include'),
+            exclude=data.get('exclude'),
+        )
+
+        dataset = Dataset.objects.annotate(num_files=Count('files')).get(pk=dataset.pk)
+        return Response(DatasetSummarySerializer(dataset).data)
+
+    @swagger_auto_schema(
+        request_body=DatasetManifestSerializer(), responses={200: DatasetSummarySerializer()}
+    )
+    @action(detail=True, methods=['POST'], url_path='files/bulk')
+    def register_files(self, request, pk: str):
+        """Create files from a manifest and add them to this Dataset, in bulk."""
+        serializer = DatasetManifestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        dataset: Dataset = get_object_or_404(Dataset, pk=pk)
+        user = request.user if request.user.is_authenticated else None
+        try:
+            dataset.register_files(serializer.validated_data['files'], created_by=user)
+        except DatabaseError as e:
+            return Response({'files': str(e)}, status=HTTP_400_BAD_REQUEST)
+
+        dataset = Dataset.objects.annotate(num_files=Count('files')).get(pk=dataset.pk)
+        return Response(DatasetSummarySerializer(dataset).data)
+
     @swagger_auto_schema(
         responses={
             '200': openapi.Response(
@@ -174,7 +328,7 @@ class DatasetViewSet(ModelViewSet):
     def download(self, request, pk: str):
         """Return a zip of the files."""
         dataset: Dataset = get_object_or_404(Dataset, pk=pk)
-        return dataset.streamed_zip_response()
+        return async_streaming(request, dataset.streamed_zip_response())
 
     @swagger_auto_schema(
         query_serializer=ChecksumFilePathQuerySerializer(),
@@ -233,7 +387,7 @@ class DatasetViewSet(ModelViewSet):
         return Response(ChecksumFilePathsSerializer({'folders': folders, 'files': files}).data)
 
 
-class AlgorithmTaskViewSet(NestedViewSetMixin, ReadOnlyModelViewSet):
+class AlgorithmTaskViewSet(KeysetPaginationMixin, NestedViewSetMixin, ReadOnlyModelViewSet):
     serializer_class = AlgorithmTaskSerializer
     pagination_class = LimitOffsetPagination
 
@@ -241,7 +395,8 @@ class AlgorithmTaskViewSet(NestedViewSetMixin, ReadOnlyModelViewSet):
         if getattr(self, 'swagger_fake_view', False):
             return
 
-        queryset = AlgorithmTask.objects.all()
+        # The log can be very large, and isn't included in the serialized task
+        queryset = AlgorithmTask.objects.defer('output_log').prefetch_related(SHARDS_PREFETCH)
         algorithm__pk = self.request.GET.get('algorithm__pk', None)
         if algorithm__pk is not None:
             queryset = queryset.filter(algorithm__pk=algorithm__pk)
@@ -274,30 +429,42 @@ class AlgorithmTaskViewSet(NestedViewSetMixin, ReadOnlyModelViewSet):
             lines = lines[-tail:] if tail else lines[:head]
             response_text = '\n'.join(lines)
 
+        if serializer.validated_data.get('follow'):
+            # Keep the line break before output logged after the slice
+            if tail and response_text and task.output_log.endswith('\n'):
+                response_text += '\n'
+
+            return follow_log_response(request, task, response_text)
+
         return Response(response_text, content_type='text/plain')
 
     @swagger_auto_schema(
-        query_serializer=LimitOffsetSerializer(), responses={200: ChecksumFileSerializer(many=True)}
+        query_serializer=PaginationSerializer(), responses={200: DatasetFileSerializer(many=True)}
     )
     @action(detail=True, methods=['GET'])
-    @paginate_action(ChecksumFileSerializer)
+    @paginate_action(DatasetFileSerializer)
     def input(self, request, pk: str):
         """Return the input dataset as a list of files."""
         return get_object_or_404(
-            AlgorithmTask.objects.select_related('input_dataset'), pk=pk
+            AlgorithmTask.objects.select_related('input_dataset').defer('output_log'), pk=pk
         ).input_dataset.files.all()
 
     @swagger_auto_schema(
-        query_serializer=LimitOffsetSerializer(), responses={200: ChecksumFileSerializer(many=True)}
+        query_serializer=PaginationSerializer(), responses={200: DatasetFileSerializer(many=True)}
     )
     @action(detail=True, methods=['GET'])
-    @paginate_action(ChecksumFileSerializer)
+    @paginate_action(DatasetFileSerializer)
     def output(self, request, pk: str):
         """Return the task output dataset as a list of files."""
-        task: AlgorithmTask = get_object_or_404(AlgorithmTask, pk=pk)
+        task: AlgorithmTask = get_object_or_404(
+            AlgorithmTask.objects.select_related('output_dataset').defer('output_log'), pk=pk
+        )
         output_dataset = task.output_dataset
 
-        return output_dataset.files.all() if output_dataset is not None else []
+        if output_dataset is None:
+            return ChecksumFile.objects.none()
+
+        return output_dataset.files.all()
 
     @swagger_auto_schema(
         responses={
@@ -317,10 +484,14 @@ class AlgorithmTaskViewSet(NestedViewSetMixin, ReadOnlyModelViewSet):
     def download_output(self, request, pk: str):
         """Return a zip of the output files."""
         task: AlgorithmTask = get_object_or_404(
-            AlgorithmTask.objects.select_related('output_dataset'), pk=pk
+            AlgorithmTask.objects.select_related('algorithm', 'output_dataset').defer('output_log'),
+            pk=pk,
         )
         output_dataset: Dataset = task.output_dataset
 
-        return output_dataset.streamed_zip_response(
-            filename=f'{task.algorithm.safe_name}__task_{task.pk}__output.zip'
+        return async_streaming(
+            request,
+            output_dataset.streamed_zip_response(
+                filename=f'{task.algorithm.safe_name}__task_{task.pk}__output.zip'
+            ),
         )
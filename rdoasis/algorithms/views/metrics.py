@@ -0,0 +1,29 @@
+import secrets
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+
+from rdoasis.algorithms.utils.metrics import TaskStatusCollector, get_registry
+
+
+def has_metrics_access(request) -> bool:
+    """Return whether a request is made by a staff user, or with the configured metrics token."""
+    if request.user.is_staff:
+        return True
+
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    return bool(token) and secrets.compare_digest(authorization, f'Bearer {token}')
+
+
+def metrics(request):
+    """Expose the metrics of the task pipeline to Prometheus."""
+    if not has_metrics_access(request):
+        return HttpResponseForbidden()
+
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(get_registry())
+    registry.register(TaskStatusCollector())
+
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
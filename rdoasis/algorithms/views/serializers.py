@@ -1,6 +1,15 @@
 from rest_framework import serializers
+from rgd.models import ChecksumFile, FileSourceType
+from rgd.serializers import ChecksumFileSerializer
 
-from rdoasis.algorithms.models import Algorithm, AlgorithmTask, Dataset, DockerImage
+from rdoasis.algorithms.models import (
+    Algorithm,
+    AlgorithmTask,
+    AlgorithmTaskShard,
+    Dataset,
+    DockerImage,
+)
+from rdoasis.algorithms.utils.presign import presign_keys
 
 
 class LimitOffsetSerializer(serializers.Serializer):
@@ -8,6 +17,17 @@ class LimitOffsetSerializer(serializers.Serializer):
     offset = serializers.IntegerField(required=False)
 
 
+class PaginationModeSerializer(serializers.Serializer):
+    """Query params for opting in to keyset (cursor) pagination."""
+
+    pagination = serializers.ChoiceField(choices=['offset', 'cursor'], required=False)
+    cursor = serializers.CharField(required=False)
+
+
+class PaginationSerializer(LimitOffsetSerializer, PaginationModeSerializer):
+    pass
+
+
 class DockerImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = DockerImage
@@ -24,7 +44,7 @@ class AlgorithmSerializer(serializers.ModelSerializer):
     environment = serializers.DictField(child=serializers.CharField())
 
 
-class AlgorithmQuerySerializer(serializers.Serializer):
+class AlgorithmQuerySerializer(PaginationModeSerializer):
     docker_image__pk = serializers.IntegerField(required=False)
 
 
@@ -39,7 +59,18 @@ class DatasetSerializer(serializers.ModelSerializer):
         read_only_fields = ['created', 'modified', 'size']
 
 
-class DatasetListSerializer(serializers.Serializer):
+class DatasetSummarySerializer(serializers.ModelSerializer):
+    """A Dataset serializer which reports the number of files, rather than every file ID."""
+
+    class Meta:
+        model = Dataset
+        exclude = ['files']
+
+    # Populated by annotating the queryset, to avoid a query per dataset
+    num_files = serializers.IntegerField(read_only=True)
+
+
+class DatasetListSerializer(PaginationModeSerializer):
     include_output_datasets = serializers.BooleanField(required=False, default=False)
 
 
@@ -48,13 +79,113 @@ class DatasetFilesUpdateSerializer(serializers.Serializer):
     delete = serializers.ListField(child=serializers.IntegerField(), required=False)
 
 
+class DatasetManifestEntrySerializer(serializers.Serializer):
+    """A single file to register, located either by key in the storage bucket, or by URL."""
+
+    name = serializers.CharField(max_length=1000, required=False)
+    s3_key = serializers.CharField(required=False)
+    url = serializers.CharField(required=False)
+    size = serializers.IntegerField(min_value=0, required=False)
+    checksum = serializers.CharField(max_length=128, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if bool(attrs.get('s3_key')) == bool(attrs.get('url')):
+            raise serializers.ValidationError('Exactly one of s3_key or url must be provided.')
+
+        return attrs
+
+
+class DatasetManifestSerializer(serializers.Serializer):
+    files = DatasetManifestEntrySerializer(many=True, allow_empty=False)
+
+
+class DatasetFileUrlSerializer(serializers.Serializer):
+    """A file in a dataset, with a URL to download it directly from storage."""
+
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    checksum = serializers.CharField()
+    url = serializers.CharField()
+
+
+class PresignedChecksumFileListSerializer(serializers.ListSerializer):
+    """Presign the URLs of all stored files at once, before serializing each file."""
+
+    def to_representation(self, data):
+        files = list(data.all() if hasattr(data, 'all') else data)
+        self._context['presigned_urls'] = presign_keys(
+            f.file.name for f in files if f.type == FileSourceType.FILE_FIELD
+        )
+        return super().to_representation(files)
+
+
+class DatasetFileSerializer(ChecksumFileSerializer):
+    """
+    A ChecksumFile, with URLs presigned in bulk by its list serializer.
+
+    The `file` and `download_url` of stored files are the same presigned URL, which is signed
+    once, rather than separately for each field. Unlike newer versions of rgd's serializer, the
+    `size` of each file isn't included, since it isn't stored, and would be requested from storage
+    for every file.
+    """
+
+    file = serializers.SerializerMethodField()
+
+    class Meta(ChecksumFileSerializer.Meta):
+        list_serializer_class = PresignedChecksumFileListSerializer
+
+    def get_file(self, value: ChecksumFile):
+        if value.type != FileSourceType.FILE_FIELD:
+            return None
+
+        presigned_urls = self.context.get('presigned_urls', {})
+        if value.file.name not in presigned_urls:
+            presigned_urls.update(presign_keys([value.file.name]))
+
+        return presigned_urls[value.file.name]
+
+    def to_representation(self, value: ChecksumFile):
+        # Skip ChecksumFileSerializer, which signs the download URL again
+        ret = serializers.ModelSerializer.to_representation(self, value)
+        ret['download_url'] = ret['file'] if value.type == FileSourceType.FILE_FIELD else value.url
+        return ret
+
+
+class DatasetDeriveSerializer(serializers.Serializer):
+    """Create a new dataset from a set operation over existing datasets."""
+
+    name = serializers.CharField(max_length=256)
+    sources = serializers.PrimaryKeyRelatedField(
+        queryset=Dataset.objects.all(), many=True, allow_empty=False
+    )
+    operation = serializers.ChoiceField(
+        choices=['union', 'intersection', 'difference'], default='union'
+    )
+    include = serializers.ListField(child=serializers.CharField(), required=False)
+    exclude = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def validate_name(self, value):
+        if Dataset.objects.filter(name=value).exists():
+            raise serializers.ValidationError('A dataset with this name already exists.')
+
+        return value
+
+
+class AlgorithmTaskShardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AlgorithmTaskShard
+        exclude = ['task', 'output_log', 'input_files']
+
+
 class AlgorithmTaskSerializer(serializers.ModelSerializer):
     class Meta:
         model = AlgorithmTask
         exclude = ['output_log']
 
+    shards = AlgorithmTaskShardSerializer(many=True, read_only=True)
+
 
-class AlgorithmTaskQuerySerializer(serializers.Serializer):
+class AlgorithmTaskQuerySerializer(PaginationModeSerializer):
     algorithm__pk = serializers.IntegerField(required=False)
 
 
@@ -63,3 +194,13 @@ class AlgorithmTaskLogsSerializer(serializers.Serializer):
 
     head = serializers.IntegerField(required=False)
     tail = serializers.IntegerField(required=False)
+    follow = serializers.BooleanField(
+        required=False, help_text='Stream new output as it is logged, until the task finishes.'
+    )
+
+    def validate(self, attrs):
+        # Following from the first lines of the log would skip any lines after them
+        if attrs.get('follow') and attrs.get('head'):
+            raise serializers.ValidationError('head cannot be used with follow.')
+
+        return attrs
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from typing import AsyncIterator, Iterable, Iterator, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.db.models.functions import Substr
+from django.http import StreamingHttpResponse
+
+from rdoasis.algorithms.models import AlgorithmTask
+
+# Seconds between checks for new log output, while following a task log
+LOG_POLL_INTERVAL = 1
+
+# Seconds after which a task log stops being followed, even if the task hasn't finished
+LOG_FOLLOW_MAX_DURATION = 60 * 60
+
+_END = object()
+
+
+def is_asgi(request) -> bool:
+    """Return whether a (Django or DRF) request is being served with ASGI."""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def next_in_thread(iterator: Iterator[bytes]):
+    """
+    Return the next chunk of an iterator from a worker thread, or `_END` once it's exhausted.
+
+    Chunks may be read with database queries (such as the files of a zipped dataset), so
+    connections are closed around each read, as for `read_log_in_thread`.
+    """
+    close_old_connections()
+    try:
+        return next(iterator, _END)
+    finally:
+        close_old_connections()
+
+
+async def iterate_in_thread(iterable: Iterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Yield the chunks of a synchronous iterable, reading each chunk in a worker thread.
+
+    No thread is held between chunks, so a slow client only occupies the event loop while it waits.
+    """
+    iterator = iter(iterable)
+    read = sync_to_async(next_in_thread, thread_sensitive=False)
+    while True:
+        chunk = await read(iterator)
+        if chunk is _END:
+            return
+
+        yield chunk
+
+
+def async_streaming(request, response: StreamingHttpResponse) -> StreamingHttpResponse:
+    """
+    Serve a streaming response asynchronously, if the request is being served with ASGI.
+
+    Django buffers the entire content of synchronous streaming responses when serving ASGI, so
+    their content must be converted to an asynchronous iterator.
+    """
+    if is_asgi(request) and not response.is_async:
+        response.streaming_content = iterate_in_thread(response.streaming_content)
+
+    return response
+
+
+def read_log(task_id: int, offset: int) -> Tuple[str, bool]:
+    """Return the log of a task after the offset, and whether the task has finished."""
+    log, status = (
+        AlgorithmTask.objects.filter(pk=task_id)
+        .annotate(new_log=Substr('output_log', offset + 1))
+        .values_list('new_log', 'status')
+        .get()
+    )
+    return log or '', status in AlgorithmTask.FINISHED_STATUSES
+
+
+def read_log_in_thread(task_id: int, offset: int) -> Tuple[str, bool]:
+    """
+    Read a task log from a worker thread. See `read_log`.
+
+    Worker threads outlive the request, so unusable or expired connections are closed around the
+    query, as they would be at the start and end of a request.
+    """
+    close_old_connections()
+    try:
+        return read_log(task_id, offset)
+    finally:
+        close_old_connections()
+
+
+def follow_log(task_id: int, offset: int) -> Iterator[str]:
+    """
+    Yield new output from a task log after the offset, until the task has finished.
+
+    The log is followed for at most `LOG_FOLLOW_MAX_DURATION` seconds.
+    """
+    deadline = time.monotonic() + LOG_FOLLOW_MAX_DURATION
+    while True:
+        log, finished = read_log(task_id, offset)
+        if log:
+            offset += len(log)
+            yield log
+        if finished or time.monotonic() >= deadline:
+            return
+
+        time.sleep(LOG_POLL_INTERVAL)
+
+
+async def afollow_log(task_id: int, offset: int) -> AsyncIterator[str]:
+    """Asynchronously yield new output from a task log. See `follow_log`."""
+    deadline = time.monotonic() + LOG_FOLLOW_MAX_DURATION
+    read = sync_to_async(read_log_in_thread, thread_sensitive=False)
+    while True:
+        log, finished = await read(task_id, offset)
+        if log:
+            offset += len(log)
+            yield log
+        if finished or time.monotonic() >= deadline:
+            return
+
+        await asyncio.sleep(LOG_POLL_INTERVAL)
+
+
+def follow_log_response(request, task: AlgorithmTask, log: str) -> StreamingHttpResponse:
+    """Return a response streaming the given log, followed by any new output from the task."""
+    offset = len(task.output_log or '')
+    if is_asgi(request):
+
+        async def content():
+            yield log
+            async for new_log in afollow_log(task.pk, offset):
+                yield new_log
+
+    else:
+
+        def content():
+            yield log
+            yield from follow_log(task.pk, offset)
+
+    return StreamingHttpResponse(content(), content_type='text/plain')
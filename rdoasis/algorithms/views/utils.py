@@ -2,10 +2,47 @@ from functools import wraps
 from typing import Iterable, Union
 
 from django.db.models.query import QuerySet
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.serializers import Serializer
 
 
+class KeysetPagination(CursorPagination):
+    """
+    Paginate by primary key, using the last seen key instead of an offset.
+
+    Unlike limit/offset pagination, fetching a page deep into a large result set doesn't require
+    scanning all preceding rows, and no total count is computed.
+    """
+
+    ordering = 'pk'
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+
+class KeysetPaginationMixin:
+    """
+    Allow a viewset to opt in to keyset pagination on a per-request basis.
+
+    Passing the `pagination=cursor` query parameter switches from the viewset's `pagination_class`
+    to `keyset_pagination_class`. This applies to both the default list endpoint and any actions
+    wrapped with `paginate_action`.
+    """
+
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            use_keyset = request is not None and request.query_params.get('pagination') == 'cursor'
+
+            pagination_class = self.keyset_pagination_class if use_keyset else self.pagination_class
+            self._paginator = pagination_class() if pagination_class is not None else None
+
+        return self._paginator
+
+
 def paginate_action(serializer_cls: Serializer):
     def decorator(view_method):
         @wraps(view_method)
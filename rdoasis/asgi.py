@@ -3,9 +3,13 @@ import os
 import configurations.importer
 from django.core.asgi import get_asgi_application
 
+from rdoasis.algorithms.utils.tracing import configure_tracing
+
 os.environ['DJANGO_SETTINGS_MODULE'] = 'rdoasis.settings'
 if not os.environ.get('DJANGO_CONFIGURATION'):
     raise ValueError('The environment variable "DJANGO_CONFIGURATION" must be set.')
 configurations.importer.install()
 
 application = get_asgi_application()
+
+configure_tracing('rdoasis-web')
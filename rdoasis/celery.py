@@ -1,6 +1,7 @@
 import os
 
-from celery import Celery
+from celery import Celery, signals
+from celery.utils.log import get_logger
 import configurations.importer
 
 os.environ['DJANGO_SETTINGS_MODULE'] = 'rdoasis.settings'
@@ -8,9 +9,51 @@ if not os.environ.get('DJANGO_CONFIGURATION'):
     raise ValueError('The environment variable "DJANGO_CONFIGURATION" must be set.')
 configurations.importer.install()
 
+logger = get_logger(__name__)
+
 # Using a string config_source means the worker doesn't have to serialize
 # the configuration object to child processes.
 app = Celery(config_source='django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
+
+
+@signals.worker_init.connect
+def start_metrics_server(sender=None, **kwargs):
+    from celery.concurrency.prefork import TaskPool
+    from django.conf import settings
+
+    from rdoasis.algorithms.utils.metrics import start_metrics_server
+
+    if not settings.WORKER_METRICS_PORT:
+        return
+
+    # Tasks of a prefork worker run in child processes, whose metrics are only visible to the
+    # parent process through PROMETHEUS_MULTIPROC_DIR. Otherwise, every metric would read zero.
+    pool_cls = getattr(sender, 'pool_cls', None)
+    prefork = isinstance(pool_cls, type) and issubclass(pool_cls, TaskPool)
+    if prefork and 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        logger.warning(
+            'Not exposing worker metrics, since PROMETHEUS_MULTIPROC_DIR is not set for the '
+            'prefork pool.'
+        )
+        return
+
+    start_metrics_server(settings.WORKER_METRICS_PORT)
+
+
+@signals.worker_process_init.connect
+def configure_worker_tracing(**kwargs):
+    # Configured in each worker process, since the span exporter's thread doesn't survive forking
+    from rdoasis.algorithms.utils.tracing import configure_tracing
+
+    configure_tracing('rdoasis-worker')
+
+
+@signals.worker_process_shutdown.connect
+def mark_metrics_process_dead(pid, **kwargs):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
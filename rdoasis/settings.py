@@ -48,6 +48,19 @@ class RdoasisMixin(ResonantGeoDataBaseMixin, ConfigMixin):
     DOCKER_TASK_RUNNER = values.BooleanValue(environ=True, default=False)
     K8S_CLUSTER_NAME = values.Value(environ=True)
 
+    # Transfer of algorithm task input and output files
+    TRANSFER_MAX_WORKERS = values.PositiveIntegerValue(environ=True, default=4)
+    TRANSFER_RETRIES = values.PositiveIntegerValue(environ=True, default=2)
+    TRANSFER_RETRY_DELAY = values.FloatValue(environ=True, default=1.0)
+    # Keep downloaded files in this directory, to avoid downloading them again
+    TRANSFER_CACHE_DIR = values.Value(environ=True, default=None)
+
+    # Prometheus metrics, exposed by celery workers on this port, and pushed by the k8s sidecars
+    WORKER_METRICS_PORT = values.IntegerValue(environ=True, default=None)
+    METRICS_PUSHGATEWAY_URL = values.Value(environ=True, default=None)
+    # Bearer token allowing Prometheus to scrape /metrics, which is otherwise only served to staff
+    METRICS_TOKEN = values.Value(environ=True, default=None)
+
 
 class DevelopmentConfiguration(RdoasisMixin, DevelopmentBaseConfiguration):
     # Default to use docker in dev env
@@ -57,6 +70,7 @@ class DevelopmentConfiguration(RdoasisMixin, DevelopmentBaseConfiguration):
 class TestingConfiguration(RdoasisMixin, TestingBaseConfiguration):
     CELERY_TASK_ALWAYS_EAGER = True
     DOCKER_TASK_RUNNER = True
+    TRANSFER_RETRY_DELAY = 0.0
 
 
 class ProductionConfiguration(RdoasisMixin, ProductionBaseConfiguration):
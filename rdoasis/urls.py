@@ -13,6 +13,7 @@ from rdoasis.algorithms.views.algorithms import (
     DatasetViewSet,
     DockerImageViewSet,
 )
+from rdoasis.algorithms.views.metrics import metrics
 
 # OpenAPI generation
 schema_view = get_schema_view(
@@ -38,6 +39,7 @@ urlpatterns = [
     path('', include('rgd.urls')),
     path('', include('rgd_imagery.urls')),
     path('api/', include(router.urls)),
+    path('metrics', metrics, name='metrics'),
     # Redirect homepage to RGD core app homepage
     path(r'', RedirectView.as_view(url='rgd', permanent=False), name='index'),
 ]
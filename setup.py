@@ -37,7 +37,7 @@ setup(
     include_package_data=True,
     install_requires=[
         'celery',
-        'django>=4',
+        'django>=4.2',
         'django-admin-display',
         'django-allauth',
         'django-configurations[database,email]',
@@ -52,12 +52,15 @@ setup(
         'drf-yasg',
         'flower',
         'gputil',
+        'opentelemetry-api',
+        'prometheus-client',
         'rules',
         'zipstream==1.1.4',
         # Production-only
         'django-composed-configuration[prod]>=0.21.0',
         'django-s3-file-field[boto3]',
         'gunicorn',
+        'uvicorn',
         'boto3',
         # RGD
         'django-rgd[configuration]>=0.3.3',
@@ -80,6 +83,10 @@ setup(
         'fuse': [
             'django-rgd[configuration,fuse]>=0.3.3',
         ],
+        'tracing': [
+            'opentelemetry-exporter-otlp-proto-http',
+            'opentelemetry-sdk',
+        ],
         'k8s': [
             'kubernetes',
             'awscli',